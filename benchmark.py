@@ -0,0 +1,596 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks for the invoice pipeline
+Run `python benchmark.py <benchmark> --help` for the options of each benchmark
+"""
+
+import argparse
+import gc
+import glob
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+from invoice_schema import (NUMERIC_COLUMNS, INVOICE_COLUMNS, LINE_COLUMNS, normalize_invoice_frame,
+                            read_invoice_csv, read_invoice_rows, memory_usage_report)
+from invoice_table import CompactInvoiceTable
+from invoice_generator import VARIANTS, generate_invoices
+
+SAMPLE_CSV = "invoice_data.csv"
+
+
+def make_sample_rows(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Build `rows` line items by resampling the bundled invoice_data.csv"""
+    base = read_invoice_rows(SAMPLE_CSV)
+    rng = np.random.default_rng(seed)
+    sample = base.iloc[rng.integers(0, len(base), rows)].reset_index(drop=True)
+    # Make invoice IDs unique per resampled invoice so group-bys stay realistic
+    sample['invoice_id'] = sample['invoice_id'] + '-' + (np.arange(rows) // 3).astype(str)
+    return sample
+
+
+def make_multiline_rows(rows: int, lines_per_invoice: int = 4, seed: int = 0) -> pd.DataFrame:
+    """
+    Build `rows` raw line items grouped into invoices of `lines_per_invoice` products each:
+    invoice-level fields are resampled per invoice, product lines per row
+    """
+    base = read_invoice_rows(SAMPLE_CSV)
+    rng = np.random.default_rng(seed)
+    invoice_numbers = np.arange(rows) // lines_per_invoice
+    headers = base.iloc[rng.integers(0, len(base), invoice_numbers[-1] + 1)].reset_index(drop=True)
+    sample = headers.iloc[invoice_numbers].reset_index(drop=True)
+    lines = base.iloc[rng.integers(0, len(base), rows)].reset_index(drop=True)
+    sample[LINE_COLUMNS] = lines[LINE_COLUMNS]
+    sample['invoice_id'] = sample['invoice_id'] + '-' + invoice_numbers.astype(str)
+    return sample
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, falling back to the peak RSS)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def time_call(func, repeat: int = 3):
+    """Return (best wall time in seconds, last result) over `repeat` runs"""
+    best, result = float('inf'), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def legacy_load_typing(df: pd.DataFrame) -> pd.DataFrame:
+    """The row-wise post-load typing previously done in dashboard.load_invoice_data"""
+    for col in ['invoice_date', 'due_date']:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    if 'days_to_payment' in df.columns and df['days_to_payment'].notna().any():
+        df['payment_date'] = df.apply(
+            lambda x: x['invoice_date'] + timedelta(days=x['days_to_payment'])
+            if pd.notna(x['days_to_payment']) else None,
+            axis=1
+        )
+    for col in INVOICE_COLUMNS:
+        if col not in df.columns:
+            df[col] = 0 if col in NUMERIC_COLUMNS else 'Unknown'
+    return df
+
+
+def bench_normalise(args):
+    """Compare the legacy row-wise typing step with the vectorised normalize_invoice_frame"""
+    print(f"📋 Building {args.rows:,} sample line items...")
+    csv_text = make_sample_rows(args.rows).to_csv(index=False)
+
+    def legacy():
+        return legacy_load_typing(pd.read_csv(StringIO(csv_text)))
+
+    def vectorised():
+        return normalize_invoice_frame(pd.read_csv(StringIO(csv_text)))
+
+    legacy_time, legacy_df = time_call(legacy, args.repeat)
+    vector_time, vector_df = time_call(vectorised, args.repeat)
+
+    same = legacy_df['payment_date'].astype('datetime64[ns]').equals(
+        vector_df['payment_date'].astype('datetime64[ns]'))
+    print(f"   legacy (apply, axis=1):  {legacy_time:8.3f}s")
+    print(f"   vectorised:              {vector_time:8.3f}s")
+    print(f"   speedup:                 {legacy_time / vector_time:8.1f}x")
+    print(f"   payment_date identical:  {same}")
+
+
+def bench_schema(args):
+    """Compare default read_csv inference plus coercion with the typed read-time schema"""
+    print(f"📋 Building {args.rows:,} sample line items...")
+    csv_text = make_sample_rows(args.rows).to_csv(index=False)
+
+    def inferred():
+        return normalize_invoice_frame(pd.read_csv(StringIO(csv_text)), derive_columns=False, fill_missing=False)
+
+    def typed():
+        return read_invoice_csv(StringIO(csv_text), usecols=args.usecols, compact=True)
+
+    inferred_time, inferred_df = time_call(inferred, args.repeat)
+    typed_time, typed_df = time_call(typed, args.repeat)
+
+    inferred_report = memory_usage_report(inferred_df)
+    typed_report = memory_usage_report(typed_df)
+    report = inferred_report[['dtype', 'bytes_per_row']].join(
+        typed_report[['dtype', 'bytes_per_row']], lsuffix='_inferred', rsuffix='_typed', how='left')
+
+    print(f"   inferred + coercion:     {inferred_time:8.3f}s")
+    print(f"   typed schema:            {typed_time:8.3f}s")
+    print(f"   speedup:                 {inferred_time / typed_time:8.1f}x")
+    print(f"   memory:                  {inferred_report.loc['TOTAL', 'bytes'] / 1e6:8.1f} MB -> "
+          f"{typed_report.loc['TOTAL', 'bytes'] / 1e6:.1f} MB")
+    print()
+    print(report.to_string())
+
+
+def measure_dataset_rss(csv_path: str, layout: str):
+    """Child process body for bench_compact: load the CSV as the given layout and print the RSS growth"""
+    baseline = current_rss_mb()
+    df = normalize_invoice_frame(read_invoice_csv(csv_path, compact=True))
+    dataset = CompactInvoiceTable.from_frame(df) if layout == 'compact' else df
+    del df
+    gc.collect()
+    print(f"{current_rss_mb() - baseline:.1f} {len(dataset)}")
+
+
+def bench_compact(args):
+    """Compare the RSS of the flat line item frame with the compact two-table representation"""
+    if args.measure:
+        measure_dataset_rss(args.csv, args.measure)
+        return
+
+    print(f"📋 Building {args.rows:,} sample line items ({args.lines_per_invoice} per invoice)...")
+    sample = make_multiline_rows(args.rows, args.lines_per_invoice)
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+        sample.to_csv(f, index=False)
+        csv_path = f.name
+    del sample
+
+    try:
+        results = {}
+        for layout in ['flat', 'compact']:
+            # A fresh interpreter per layout so allocations of one do not hide the other's
+            output = subprocess.run(
+                [sys.executable, __file__, 'compact', '--measure', layout, '--csv', csv_path],
+                check=True, capture_output=True, text=True
+            ).stdout.split()
+            results[layout] = float(output[-2])
+            print(f"   {layout:<8} RSS growth:       {results[layout]:8.1f} MB for {int(output[-1]):,} rows")
+        print(f"   reduction:               {1 - results['compact'] / results['flat']:8.1%}")
+
+        df = normalize_invoice_frame(read_invoice_csv(csv_path, compact=True))
+        usage = CompactInvoiceTable.from_frame(df).memory_usage()
+        print(f"   deep bytes/row:          {df.memory_usage(deep=True, index=False).sum() / len(df):8.1f} flat, "
+              f"{usage['total_bytes'] / usage['rows']:.1f} compact")
+    finally:
+        os.remove(csv_path)
+
+
+def measure_extraction(directory: str, limit: int):
+    """Child process body for bench_extract: extract the first `limit` PDFs and print stage timings as JSON"""
+    from invoice_extractor import InvoiceExtractor
+    extractor = InvoiceExtractor()
+    pdf_files = sorted(glob.glob(os.path.join(directory, "*.pdf")))[:limit]
+    baseline = current_rss_mb()
+
+    stages = {'text': [], 'fields': [], 'table': [], 'total': []}
+    tiers = {}
+    rows = 0
+    started = time.perf_counter()
+    for pdf_file in pdf_files:
+        stats = {}
+        _, lines = extractor.process_invoice_tables(pdf_file, stats)
+        timings = stats['stages']
+        stages['text'].append(timings['text'])
+        stages['fields'].append(timings['fields'])
+        # Product extraction: whichever tiers were tried before one succeeded
+        stages['table'].append(sum(timings.get(stage, 0.0) for stage in ['layout', 'find_tables', 'camelot', 'regex_products']))
+        stages['total'].append(timings['total'])
+        tiers[stats['tier']] = tiers.get(stats['tier'], 0) + 1
+        rows += len(lines) if stats['tier'] != 'none' else 0
+    elapsed = time.perf_counter() - started
+
+    print(json.dumps({
+        'files': len(pdf_files), 'rows': rows, 'unmatched': tiers.get('none', 0), 'tiers': tiers, 'seconds': elapsed,
+        'stages': {stage: np.percentile(np.array(times) * 1000, [50, 95, 99]).tolist()
+                   for stage, times in stages.items()},
+        'baseline_rss_mb': baseline, 'peak_rss_mb': peak_rss_mb()
+    }))
+
+
+def bench_extract(args):
+    """Extraction throughput, per-stage latency percentiles and peak RSS on synthetic invoice PDFs"""
+    if args.measure:
+        measure_extraction(args.directory, args.measure)
+        return
+
+    directory = args.directory
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix='invoice_bench_')
+        started = time.perf_counter()
+        print(f"📋 Generating {max(args.counts):,} synthetic invoices ({', '.join(args.variants)})...")
+        generate_invoices(directory, max(args.counts), args.seed, args.variants)
+        print(f"   done in {time.perf_counter() - started:.1f}s")
+
+    try:
+        print(f"   {'docs':>6} {'files/s':>8} {'rows':>7} {'unmatched':>9}  "
+              f"{'text p50/p95/p99 ms':>21}  {'fields p50/p95/p99 ms':>21}  {'table p50/p95/p99 ms':>21}  "
+              f"{'peak RSS':>9}")
+        for count in args.counts:
+            # A fresh interpreter per size so the peak RSS of one run does not carry into the next
+            output = subprocess.run(
+                [sys.executable, __file__, 'extract', '--measure', str(count), '--directory', directory],
+                check=True, capture_output=True, text=True
+            ).stdout.strip().splitlines()
+            result = json.loads(output[-1])
+            stages = ["/".join(f"{value:.1f}" for value in result['stages'][stage]) for stage in ['text', 'fields', 'table']]
+            print(f"   {result['files']:>6,} {result['files'] / result['seconds']:>8.1f} {result['rows']:>7,} "
+                  f"{result['unmatched']:>9,}  {stages[0]:>21}  {stages[1]:>21}  {stages[2]:>21}  "
+                  f"{result['peak_rss_mb']:>7.0f}MB  tiers {result['tiers']}")
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_batch(args):
+    """Multi-invoice PDF extraction: segments found and invoices per second for each number of workers"""
+    import fitz
+    from invoice_extractor import InvoiceExtractor
+
+    directory = tempfile.mkdtemp(prefix='invoice_batch_')
+    try:
+        print(f"📋 Generating {args.invoices:,} synthetic invoices ({', '.join(args.variants)}) as one PDF...")
+        batch = fitz.open()
+        for path in generate_invoices(directory, args.invoices, args.seed, args.variants):
+            with fitz.open(path) as invoice:
+                batch.insert_pdf(invoice)
+            os.remove(path)
+        batch_path = os.path.join(directory, 'batch.pdf')
+        batch.save(batch_path, garbage=3, deflate=True)
+        print(f"   {batch.page_count:,} pages")
+        batch.close()
+
+        print(f"   {'workers':>7} {'invoices':>9} {'rows':>7} {'seconds':>8} {'invoices/s':>11}")
+        for workers in args.workers:
+            extractor = InvoiceExtractor()
+            stats = {}
+            started = time.perf_counter()
+            invoices = extractor.process_pdf(batch_path, stats, workers=workers)
+            elapsed = time.perf_counter() - started
+            rows = sum(len(lines) for _, lines in invoices)
+            print(f"   {workers:>7} {len(invoices):>9,} {rows:>7,} {elapsed:>8.2f} {len(invoices) / elapsed:>11.1f}"
+                  f"  split {stats['stages']['split']:.2f}s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def bench_pool(args):
+    """Per-invoice latency in a fresh interpreter per PDF (imports paid per task) vs the warm worker pool"""
+    from invoice_workers import ExtractionPool
+
+    directory = tempfile.mkdtemp(prefix='invoice_pool_')
+    try:
+        paths = generate_invoices(directory, args.invoices, args.seed, args.variants)
+        script = "import sys; from invoice_extractor import InvoiceExtractor; InvoiceExtractor().process_pdf(sys.argv[1])"
+        print(f"   {'mode':<22} {'p50 ms':>8} {'p95 ms':>8} {'invoices/s':>11}")
+
+        cold = []
+        started = time.perf_counter()
+        for path in paths[:args.cold]:
+            task_started = time.perf_counter()
+            subprocess.run([sys.executable, '-c', script, path], check=True, capture_output=True,
+                           cwd=os.path.dirname(os.path.abspath(__file__)))
+            cold.append(time.perf_counter() - task_started)
+        elapsed = time.perf_counter() - started
+        p50, p95 = np.percentile(np.array(cold) * 1000, [50, 95])
+        print(f"   {'process per PDF':<22} {p50:>8.1f} {p95:>8.1f} {len(cold) / elapsed:>11.1f}")
+
+        with ExtractionPool(workers=args.workers, max_jobs=args.max_jobs) as pool:
+            pool.extract(paths[0])  # Wait for the workers to come up
+            warm = []
+            for path in paths:
+                task_started = time.perf_counter()
+                pool.extract(path)
+                warm.append(time.perf_counter() - task_started)
+            p50, p95 = np.percentile(np.array(warm) * 1000, [50, 95])
+            print(f"   {'warm pool, serial':<22} {p50:>8.1f} {p95:>8.1f} {len(warm) / sum(warm):>11.1f}")
+
+            started = time.perf_counter()
+            pool.map(paths)
+            elapsed = time.perf_counter() - started
+            print(f"   {f'warm pool, {pool.workers} workers':<22} {'':>8} {'':>8} {len(paths) / elapsed:>11.1f}")
+            snapshot = pool.snapshot()
+            print(f"   utilisation {snapshot['utilisation']:.0%}, recycles {snapshot['recycles']}, "
+                  f"worker start p50 {pool.start_seconds.quantile(0.5) * 1000:.0f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+async def asgi_get(app, path: str):
+    """Send one GET request straight to an ASGI app, discarding the response"""
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': [],
+        'client': ('127.0.0.1', 50000), 'server': ('benchmark', 80)
+    }
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+def time_requests(app, path: str, requests: int) -> float:
+    """Median seconds per GET request to an ASGI app"""
+    import asyncio
+
+    async def run():
+        await asgi_get(app, path)  # Builds the middleware stack outside the timed requests
+        times = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            await asgi_get(app, path)
+            times.append(time.perf_counter() - started)
+        return float(np.median(times))
+
+    return asyncio.run(run())
+
+
+def bench_metrics(args):
+    """Overhead of the request metrics middleware, absolute and relative to real API requests"""
+    from fastapi import FastAPI
+    from metrics import MetricsRegistry, PrometheusMiddleware
+
+    registry = MetricsRegistry()
+    duration = registry.histogram('bench_seconds', 'benchmark', ['method', 'route', 'status'])
+    record_time, _ = time_call(lambda: [duration.labels('GET', '/invoices/', 200).observe(0.01)
+                                        for _ in range(args.records)], args.repeat)
+
+    def noop_app(instrumented: bool):
+        app = FastAPI()
+
+        @app.get("/noop/")
+        async def noop():
+            return {}
+
+        if instrumented:
+            app.add_middleware(PrometheusMiddleware, registry=MetricsRegistry())
+        return app
+
+    plain = time_requests(noop_app(False), '/noop/', args.requests)
+    instrumented = time_requests(noop_app(True), '/noop/', args.requests)
+    overhead = max(instrumented - plain, 0.0)
+
+    print(f"   record (labels + observe):     {record_time / args.records * 1e6:8.2f} µs")
+    print(f"   no-op route, plain:            {plain * 1e6:8.1f} µs")
+    print(f"   no-op route, instrumented:     {instrumented * 1e6:8.1f} µs")
+    print(f"   middleware overhead:           {overhead * 1e6:8.1f} µs/request")
+
+    # Real routes of the API, served from the bundled local CSV
+    import main as api
+    for path in args.paths:
+        latency = time_requests(api.app, path, args.api_requests)
+        print(f"   GET {path:<26} {latency * 1e3:8.2f} ms median, overhead {overhead / latency:6.2%}")
+
+
+# Field patterns as matched before the regex engine, search windows and timeouts (stdlib re, whole text)
+LEGACY_FIELD_PATTERNS = {
+    'invoice_id': r'Tax Invoice No:\s*([\w\d-]+)',
+    'invoice_date': r'Date:\s*(\d{1,2}\s+[A-Za-z]{3}\s+\d{4})',
+    'customer_name': r'Customer Name:\s*([^\n]+)',
+    'customer_id': r'Customer ID:\s*([^\n]+)',
+    'customer_address': r'Address:\s*((?:.|\n)*?)\s*United Arab Emirates',
+    'customer_trn': r'Customer.*?TRN:\s*(\d+)',
+    'customer_type': r'Customer Type:\s*([^\n]+)',
+    'payment_status': r'Payment Status:\s*([^\n]+)',
+    'due_date': r'Due Date:\s*(\d{1,2}\s+[A-Za-z]{3}\s+\d{4})',
+    'total_amount': r'Total with VAT.*?AED\s+([\d,]+\.\d{2})',
+    'vat_amount': r'5% Total VAT.*?AED\s+([\d,]+\.\d{2})',
+    'amount_excl_vat': r'Total Excluding VAT.*?AED\s+([\d,]+\.\d{2})',
+    'profit': r'Profit:\s*AED\s+([\d,]+\.\d{2})',
+    'profit_margin': r'Profit Margin:\s*([\d.]+)%',
+    'cost_price': r'Cost Price:\s*AED\s+([\d,]+\.\d{2})',
+}
+LEGACY_PRODUCT_PATTERN = r'(\d+)\s+([^\n]+?)\s+(?:UN|EA)\s+(\d+)\s+([\d,.]+)\s+([\d,.]+)'
+
+# Inputs on which the legacy patterns backtrack over the rest of the text from every label occurrence;
+# (?:.|\n)*? is exponential in the number of newlines, since both alternatives match one under DOTALL
+PATHOLOGICAL_TEXTS = {
+    'customer_without_trn': lambda size: "Customer " * (size // 9),
+    'address_without_country': lambda size: "Address: unit\n" * (size // 14),
+    'totals_without_amount': lambda size: "Total with VAT 5% Total VAT " * (size // 28),
+    'long_item_line': lambda size: "1 " * (size // 2),
+}
+
+
+def legacy_extract_fields(text: str) -> dict:
+    return {field: re.search(pattern, text, re.IGNORECASE | re.DOTALL) for field, pattern in LEGACY_FIELD_PATTERNS.items()}
+
+
+def measure_legacy_regex(name: str, size: int):
+    """Child process body for bench_regex: time the legacy patterns on one input and print the seconds"""
+    text = PATHOLOGICAL_TEXTS[name](size)
+    seconds, _ = time_call(lambda: (legacy_extract_fields(text), re.findall(LEGACY_PRODUCT_PATTERN, text)), 1)
+    print(seconds)
+
+
+def bench_regex(args):
+    """Worst-case field and product-line matching time on pathological text, legacy re vs bounded regex"""
+    if args.measure:
+        measure_legacy_regex(args.measure, args.size)
+        return
+
+    import invoice_extractor
+    extractor = invoice_extractor.InvoiceExtractor()
+
+    def bounded_extract(text):
+        extractor.extract_fields(text)
+        invoice_extractor.find_product_lines(text)
+
+    print(f"   {'input':<24} {'chars':>9} {'legacy re':>11} {'bounded regex':>14}")
+    for name, build in PATHOLOGICAL_TEXTS.items():
+        for size in args.sizes:
+            # stdlib re cannot be interrupted, so the legacy patterns run in a child that is killed at the limit
+            try:
+                output = subprocess.run(
+                    [sys.executable, __file__, 'regex', '--measure', name, '--size', str(size)],
+                    check=True, capture_output=True, text=True, timeout=args.legacy_timeout
+                ).stdout.split()
+                legacy = f"{float(output[-1]):10.3f}s"
+            except subprocess.TimeoutExpired:
+                legacy = f"> {args.legacy_timeout:g}s"
+            bounded_time, _ = time_call(lambda: bounded_extract(build(size)), 1)
+            print(f"   {name:<24} {size:>9,} {legacy:>11} {bounded_time:13.3f}s")
+
+
+# Modules loaded on first use only; importing the API or the dashboard should not pull them in
+LAZY_MODULES = ['camelot', 'cv2', 'plotly.express']
+
+# Run in a bare interpreter: importing this file first would preload pandas and numpy for every module
+IMPORT_SCRIPT = (
+    "import sys, time; started = time.perf_counter(); __import__(sys.argv[1]); "
+    "elapsed = time.perf_counter() - started; "
+    "print(elapsed, ','.join(name for name in sys.argv[2:] if name in sys.modules) or '-')"
+)
+
+
+def bench_startup(args):
+    """Cold-start import time of the API and its modules, each imported in a fresh interpreter"""
+    print(f"   {'module':<20} {'median s':>9} {'max s':>7}  lazy modules loaded")
+    slow = []
+    for module in args.modules:
+        times = []
+        for _ in range(args.repeat):
+            output = subprocess.run(
+                [sys.executable, '-c', IMPORT_SCRIPT, module] + LAZY_MODULES,
+                check=True, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+            ).stdout.split()
+            times.append(float(output[-2]))
+            loaded = output[-1]
+        median = float(np.median(times))
+        print(f"   {module:<20} {median:>9.3f} {max(times):>7.3f}  {loaded}")
+        if args.max_seconds and median > args.max_seconds:
+            slow.append(module)
+    if slow:
+        # A non-zero exit lets CI track cold start against a budget
+        print(f"❌ Over the {args.max_seconds:g}s import budget: {', '.join(slow)}")
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    'normalise': bench_normalise,
+    'schema': bench_schema,
+    'compact': bench_compact,
+    'extract': bench_extract,
+    'batch': bench_batch,
+    'pool': bench_pool,
+    'metrics': bench_metrics,
+    'regex': bench_regex,
+    'startup': bench_startup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    normalise = subparsers.add_parser('normalise', help=bench_normalise.__doc__)
+    normalise.add_argument('--rows', type=int, default=500_000)
+    normalise.add_argument('--repeat', type=int, default=1)
+
+    schema = subparsers.add_parser('schema', help=bench_schema.__doc__)
+    schema.add_argument('--rows', type=int, default=500_000)
+    schema.add_argument('--repeat', type=int, default=1)
+    schema.add_argument('--usecols', nargs='+', default=None, help="Only parse these columns in the typed read")
+
+    compact = subparsers.add_parser('compact', help=bench_compact.__doc__)
+    compact.add_argument('--rows', type=int, default=1_000_000)
+    compact.add_argument('--lines-per-invoice', type=int, default=4)
+    compact.add_argument('--measure', choices=['flat', 'compact'], help=argparse.SUPPRESS)
+    compact.add_argument('--csv', help=argparse.SUPPRESS)
+
+    extract = subparsers.add_parser('extract', help=bench_extract.__doc__)
+    extract.add_argument('--counts', type=int, nargs='+', default=[100, 1_000, 10_000],
+                         help="Number of documents of each run")
+    extract.add_argument('--variants', nargs='+', choices=VARIANTS, default=VARIANTS,
+                         help="Invoice layouts to generate (see invoice_generator)")
+    extract.add_argument('--seed', type=int, default=0)
+    extract.add_argument('--directory', default=None,
+                         help="Benchmark an existing folder of PDFs instead of generating one")
+    extract.add_argument('--measure', type=int, help=argparse.SUPPRESS)
+
+    batch = subparsers.add_parser('batch', help=bench_batch.__doc__)
+    batch.add_argument('--invoices', type=int, default=200, help="Invoices in the generated batch PDF")
+    batch.add_argument('--variants', nargs='+', choices=VARIANTS, default=['table', 'multipage'])
+    batch.add_argument('--seed', type=int, default=0)
+    batch.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}),
+                       help="Worker process counts to compare")
+
+    pool = subparsers.add_parser('pool', help=bench_pool.__doc__)
+    pool.add_argument('--invoices', type=int, default=100)
+    pool.add_argument('--cold', type=int, default=10, help="PDFs extracted in a fresh interpreter each")
+    pool.add_argument('--variants', nargs='+', choices=VARIANTS, default=['table', 'multipage'])
+    pool.add_argument('--seed', type=int, default=0)
+    pool.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    pool.add_argument('--max-jobs', type=int, default=500, help="Jobs before a worker is replaced")
+
+    metrics = subparsers.add_parser('metrics', help=bench_metrics.__doc__)
+    metrics.add_argument('--records', type=int, default=100_000)
+    metrics.add_argument('--repeat', type=int, default=3)
+    metrics.add_argument('--requests', type=int, default=5_000, help="Requests per no-op measurement")
+    metrics.add_argument('--api-requests', type=int, default=50, help="Requests per API route")
+    metrics.add_argument('--paths', nargs='+', default=['/invoices/', '/health/', '/extraction-metrics/'])
+
+    regex_parser = subparsers.add_parser('regex', help=bench_regex.__doc__)
+    regex_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 50_000, 200_000, 1_000_000],
+                              help="Characters of pathological text")
+    regex_parser.add_argument('--legacy-timeout', type=float, default=10.0,
+                              help="Seconds after which a legacy measurement is killed")
+    regex_parser.add_argument('--measure', choices=list(PATHOLOGICAL_TEXTS), help=argparse.SUPPRESS)
+    regex_parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+
+    startup = subparsers.add_parser('startup', help=bench_startup.__doc__)
+    startup.add_argument('--modules', nargs='+', default=['invoice_extractor', 'dashboard', 'main'])
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--max-seconds', type=float, default=None,
+                         help="Exit with status 1 when a module's median import time is over this")
+
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
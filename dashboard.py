@@ -1,14 +1,18 @@
 import pandas as pd
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 import dash
 from dash import dcc, html, dash_table
 from dash.dependencies import Input, Output, State
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 import requests
+import threading
 from io import StringIO
+from dash.exceptions import PreventUpdate
+from dashboard_cache import LRUCache, ResultCache
+from dashboard_cube import InvoiceCube
+from invoice_schema import normalize_invoice_frame, read_invoice_rows
+from invoice_table import CompactInvoiceTable
+from metrics import REGISTRY
 
 # Import GitHub storage configuration
 try:
@@ -19,8 +23,38 @@ except ImportError:
     print("Warning: GitHub storage not available, falling back to local CSV")
 
 data_version = 0
+# Set up on first data load (ensure_github_storage), not at import, so importing the dashboard stays cheap
 github_storage = None
 use_github_storage = False
+storage_initialized = False
+storage_lock = threading.Lock()
+
+# Deltas published by the write path, oldest first: {'version', 'inserted', 'deleted_invoice_ids', 'full_reload'}
+data_changes = []
+MAX_PENDING_CHANGES = 200
+data_lock = threading.Lock()
+cache_lock = threading.Lock()
+
+# Columns the dashboard reads (filename is kept too so deletes by filename can be applied);
+# everything else in the invoice CSV is skipped at parse time
+DASHBOARD_COLUMNS = ['invoice_id', 'invoice_date', 'customer_name', 'customer_location', 'customer_type',
+                     'payment_status', 'product', 'qty', 'total', 'amount_excl_vat', 'vat', 'profit',
+                     'days_to_payment']
+
+# Optional callable returning the full dataset (e.g. the MongoDB backend) used instead of the CSV sources
+data_loader = None
+
+# Dataset currently shown by the dashboard and the data_version it reflects
+cached_data = None
+cached_cube = None
+cached_data_version = -1
+
+# Seconds to bring the cached dataset up to date: a full reload or applying published deltas
+dataset_load_seconds = REGISTRY.histogram('dashboard_dataset_load_seconds',
+                                          'Seconds to load or update the dashboard dataset', ['mode'])
+
+# Prepared (DataFrame, cube) pairs by data_version; the browser-side dcc.Store only holds the version key
+dataset_cache = LRUCache(int(os.getenv('DASHBOARD_DATASET_CACHE_SIZE', '4')))
 
 def initialize_github_storage():
     """Initialize GitHub storage if environment variables are available"""
@@ -48,32 +82,96 @@ def initialize_github_storage():
         use_github_storage = False
         return False
 
+def _record_change(change: dict):
+    """Append a change to the log under data_lock, bumping data_version"""
+    global data_version
+    with data_lock:
+        data_version += 1
+        change['version'] = data_version
+        data_changes.append(change)
+        # Older deltas are dropped; a dashboard that falls behind them reloads in full
+        del data_changes[:-MAX_PENDING_CHANGES]
+    return data_version
+
 def increment_data_version():
     """Call this function when data is updated to trigger dashboard refresh"""
-    global data_version
-    data_version += 1
-    print(f"Data version incremented to: {data_version}")
+    version = _record_change({'inserted': [], 'deleted_invoice_ids': [], 'full_reload': True})
+    print(f"Data version incremented to: {version}")
+
+def publish_data_change(inserted_records=None, deleted_invoice_ids=None):
+    """
+    Publish a delta from the write path so the dashboard can update its cached dataset
+    without reloading everything. deleted_invoice_ids may hold invoice IDs or filenames.
+    """
+    inserted_records = list(inserted_records or [])
+    deleted_invoice_ids = [str(i) for i in (deleted_invoice_ids or [])]
+    if not inserted_records and not deleted_invoice_ids:
+        return data_version
+    version = _record_change({
+        'inserted': inserted_records,
+        'deleted_invoice_ids': deleted_invoice_ids,
+        'full_reload': False
+    })
+    print(f"Data version incremented to: {version} "
+          f"(+{len(inserted_records)} rows, -{len(deleted_invoice_ids)} invoice IDs)")
+    return version
+
+def get_changes_since(version: int):
+    """
+    Return the deltas published after the given version, or None if the log
+    no longer covers that range (or contains a full reload marker)
+    """
+    with data_lock:
+        current = data_version
+        pending = [change for change in data_changes if change['version'] > version]
+    if version > current:
+        return None
+    if current - version != len(pending):
+        return None
+    if any(change['full_reload'] for change in pending):
+        return None
+    return pending
+
+def ensure_github_storage():
+    """Initialize GitHub storage the first time the dashboard needs its data source"""
+    global storage_initialized
+    with storage_lock:
+        if not storage_initialized:
+            initialize_github_storage()
+            storage_initialized = True
+
+def set_data_loader(loader):
+    """Register a callable returning the full invoice DataFrame, replacing the CSV sources"""
+    global data_loader
+    data_loader = loader
+
+def prepare_invoice_data(df):
+    """Narrow the invoice rows to the dashboard columns, type them and add derived/missing columns"""
+    df = df[[col for col in DASHBOARD_COLUMNS + ['filename'] if col in df.columns]]
+    return normalize_invoice_frame(df.copy(), expected_columns=DASHBOARD_COLUMNS)
 
 def load_invoice_data():
-    """Load invoice data from GitHub CSV or local CSV file for dashboard visualization"""
+    """Load invoice data from the registered loader, GitHub CSV or local CSV file for dashboard visualization"""
     global github_storage, use_github_storage
-    
-    # Define expected columns structure
-    expected_columns = [
-        'invoice_id', 'invoice_date', 'customer_name', 'customer_id',
-        'customer_location', 'customer_type', 'customer_trn', 'payment_status',
-        'due_date', 'product', 'qty', 'unit_price', 'total', 'amount_excl_vat',
-        'vat', 'profit', 'profit_margin', 'cost_price', 'days_to_payment'
-    ]
+    ensure_github_storage()
     
     try:
         df = None
         
+        # Use the registered backend loader if there is one
+        if data_loader is not None:
+            try:
+                df = data_loader()
+                print(f"✅ Successfully loaded {len(df) if df is not None else 0} records from data loader")
+            except Exception as e:
+                print(f"❌ Error loading from data loader: {e}")
+                df = None
+        
         # Try GitHub first if configured
-        if use_github_storage and github_storage:
+        elif use_github_storage and github_storage:
             try:
                 print("📡 Attempting to load CSV from GitHub...")
-                df = github_storage.read_csv_as_dataframe()
+                df = github_storage.read_csv_as_dataframe(usecols=DASHBOARD_COLUMNS + ['filename'], compact=True)
                 if df is not None and not df.empty:
                     print(f"✅ Successfully loaded {len(df)} records from GitHub CSV")
                 else:
@@ -88,7 +186,8 @@ def load_invoice_data():
         if df is None:
             if os.path.exists('invoice_data.csv'):
                 try:
-                    df = pd.read_csv('invoice_data.csv')
+                    df = read_invoice_rows('invoice_data.csv', usecols=DASHBOARD_COLUMNS + ['filename'],
+                                           compact=True)
                     print(f"📁 Successfully loaded {len(df)} records from local CSV")
                 except Exception as e:
                     print(f"❌ Error loading local CSV: {e}")
@@ -99,39 +198,11 @@ def load_invoice_data():
         # If no data could be loaded, return empty DataFrame
         if df is None or df.empty:
             print("📊 No data available, creating empty DataFrame")
-            return pd.DataFrame(columns=expected_columns)
+            return pd.DataFrame(columns=DASHBOARD_COLUMNS)
         
         # Data processing and cleaning
         print(f"📋 Processing {len(df)} records...")
-        
-        # Convert date columns to datetime
-        date_columns = ['invoice_date', 'due_date']
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-        
-        # Ensure numeric columns are properly typed
-        numeric_cols = ['qty', 'unit_price', 'total', 'amount_excl_vat', 'vat', 
-                         'profit', 'profit_margin', 'cost_price', 'days_to_payment']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Calculate payment date based on invoice_date and days_to_payment if available
-        if 'days_to_payment' in df.columns and df['days_to_payment'].notna().any():
-            df['payment_date'] = df.apply(
-                lambda x: x['invoice_date'] + timedelta(days=x['days_to_payment']) 
-                if pd.notna(x['days_to_payment']) else None, 
-                axis=1
-            )
-        
-        # Add any missing expected columns
-        for col in expected_columns:
-            if col not in df.columns:
-                if col in numeric_cols:
-                    df[col] = 0
-                else:
-                    df[col] = 'Unknown'
+        df = prepare_invoice_data(df)
         
         print(f"✅ Successfully processed {len(df)} invoice records")
         return df
@@ -139,11 +210,72 @@ def load_invoice_data():
     except Exception as e:
         print(f"❌ Critical error loading CSV data: {e}")
         # Return empty DataFrame with expected columns as fallback
-        return pd.DataFrame(columns=expected_columns)
+        return pd.DataFrame(columns=DASHBOARD_COLUMNS)
+
+def apply_data_changes(table, cube, changes):
+    """
+    Apply published deltas (deleted invoice IDs, then inserted rows) to a compact invoice table
+    and its daily cube, returning the updated (table, cube)
+    """
+    for change in changes:
+        if change['deleted_invoice_ids'] and not table.empty:
+            deleted = table.match_invoices(change['deleted_invoice_ids'])
+            if deleted.any():
+                cube = cube.remove(table.rows_for_invoices(deleted))
+                table = table.drop_invoices(deleted)
+        
+        if change['inserted']:
+            inserted = prepare_invoice_data(pd.DataFrame(change['inserted']))
+            cube = cube.add(inserted)
+            table = table.append(inserted)
+    
+    return table, cube
+
+def get_current_data(force_reload=False):
+    """
+    Return (table, cube, version, changed) for the dashboard, applying pending deltas
+    to the cached dataset and only reloading in full when they cannot be applied
+    """
+    global cached_data, cached_cube, cached_data_version
+    
+    with cache_lock:
+        with data_lock:
+            target_version = data_version
+        
+        if not force_reload and cached_data is not None:
+            if cached_data_version == target_version:
+                return cached_data, cached_cube, cached_data_version, False
+            
+            changes = get_changes_since(cached_data_version)
+            if changes is not None:
+                print(f"🔁 Applying {len(changes)} data change(s) since version {cached_data_version}")
+                with dataset_load_seconds.labels('delta').time():
+                    cached_data, cached_cube = apply_data_changes(cached_data, cached_cube, changes)
+                cached_data_version = changes[-1]['version'] if changes else target_version
+                return cached_data, cached_cube, cached_data_version, True
+        
+        with dataset_load_seconds.labels('full').time():
+            df = load_invoice_data()
+            cached_cube = InvoiceCube.from_frame(df)
+            cached_data = CompactInvoiceTable.from_frame(df)
+        cached_data_version = target_version
+        return cached_data, cached_cube, cached_data_version, True
+
+def get_dataset(store_data):
+    """Resolve the dataset version key held in dcc.Store to the server-side (table, cube, version)"""
+    version = store_data.get('version') if isinstance(store_data, dict) else None
+    dataset = dataset_cache.get(version)
+    if dataset is None:
+        # Evicted or from another worker process: serve the current dataset instead
+        table, cube, version, _ = get_current_data()
+        dataset = (table, cube)
+        dataset_cache.put(version, dataset)
+    return dataset + (version,)
 
 def get_data_source_info():
     """Get information about the current data source"""
     global github_storage, use_github_storage
+    ensure_github_storage()
     
     if use_github_storage and github_storage:
         try:
@@ -164,8 +296,7 @@ def get_data_source_info():
 
 
 
-initialize_github_storage()
-
+DATA_POLL_INTERVAL_MS = int(os.getenv('DASHBOARD_POLL_INTERVAL_MS', '5000'))
 
 app = dash.Dash(__name__, 
                 title="🍯 Honey Analytics Dashboard",
@@ -327,9 +458,12 @@ app.layout = html.Div([
         'boxShadow': '0 4px 20px rgba(0,0,0,0.1)'
     }),
     
-    # Data store component to hold the current dataframe
+    # Data store component holding the version key of the server-side dataset
     dcc.Store(id='data-store'),
     
+    # Polls for data changes published by the API so uploads show up without a manual refresh
+    dcc.Interval(id='data-poll', interval=DATA_POLL_INTERVAL_MS),
+    
     # Status indicator
     html.Div([
         html.Div(id='status-indicator', style={
@@ -590,7 +724,7 @@ app.layout = html.Div([
                         {'name': 'Customer', 'id': 'customer_name'},
                         {'name': 'Location', 'id': 'customer_location'},
                         {'name': 'Product', 'id': 'product'},
-                        {'name': 'Quantity', 'id': 'qty'},
+                        {'name': 'Quantity', 'id': 'qty', 'type': 'numeric'},
                         {'name': 'Total', 'id': 'total_str'},
                         {'name': 'Status', 'id': 'payment_status'}
                     ],
@@ -611,9 +745,14 @@ app.layout = html.Div([
                         'backgroundColor': honey_colors['card_bg'],
                         'border': f'1px solid {honey_colors["secondary"]}'
                     },
+                    page_current=0,
                     page_size=10,
-                    filter_action="native",
-                    sort_action="native",
+                    page_action="custom",
+                    filter_action="custom",
+                    filter_query='',
+                    sort_action="custom",
+                    sort_mode="multi",
+                    sort_by=[],
                 )
             ], id='table-container', style={'display': 'none'})
         ], style={
@@ -631,26 +770,38 @@ app.layout = html.Div([
     [Output('data-store', 'data'),
      Output('last-update-time', 'children'),
      Output('status-indicator', 'children')],
-    [Input('refresh-button', 'n_clicks')],
+    [Input('refresh-button', 'n_clicks'),
+     Input('data-poll', 'n_intervals')],
+    [State('data-store', 'data')],
     prevent_initial_call=False  # Allow initial load
 )
-def update_data_store(n_clicks):
-    print(f"Loading data - Button clicks: {n_clicks}")
-    df = load_invoice_data()
+def update_data_store(n_clicks, n_intervals, current_store):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    polled = triggered == ['data-poll.n_intervals']
     
-    # Convert DataFrame to dict for storage
-    data_dict = df.to_dict('records') if not df.empty else []
+    # The refresh button forces a full reload, page loads and polling only apply published changes
+    table, cube, version, _ = get_current_data(force_reload='refresh-button.n_clicks' in triggered)
+    # The cache is shared by every session, so compare with the version this browser holds, not
+    # whether this call changed the cache (another tab's poll may already have applied the delta)
+    current_version = current_store.get('version') if isinstance(current_store, dict) else None
+    if polled and current_version == version:
+        raise PreventUpdate
+    print(f"Loading data - Button clicks: {n_clicks}, data version: {version}")
+    
+    # Keep the dataset server-side and only send its version key to the browser
+    dataset_cache.put(version, (table, cube))
+    store_data = {'version': version}
     
     # Update timestamp
     current_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     # Status message with honey theme
-    if df.empty:
+    if table.empty:
         status_msg = "🍯 No honey sales data available yet. Upload some invoices to see your sweet analytics!"
     else:
-        status_msg = f"🐝 Dashboard loaded successfully! Showing {len(df)} records from {df['invoice_id'].nunique()} unique invoices."
+        status_msg = f"🐝 Dashboard loaded successfully! Showing {len(table)} records from {table.invoice_count} unique invoices."
     
-    return data_dict, f"⏰ Last Updated: {current_time}", status_msg
+    return store_data, f"⏰ Last Updated: {current_time}", status_msg
 
 # Callback to update date range when data changes
 @app.callback(
@@ -658,139 +809,137 @@ def update_data_store(n_clicks):
      Output('date-range', 'max_date_allowed'),
      Output('date-range', 'start_date'),
      Output('date-range', 'end_date')],
-    [Input('data-store', 'data')]
+    [Input('data-store', 'data')],
+    [State('date-range', 'start_date'),
+     State('date-range', 'end_date'),
+     State('date-range', 'min_date_allowed'),
+     State('date-range', 'max_date_allowed')]
 )
-def update_date_range(data):
+def update_date_range(data, start_date, end_date, old_min, old_max):
     if not data:
         return None, None, None, None
     
-    df = pd.DataFrame(data)
-    if df.empty or 'invoice_date' not in df.columns:
+    table, _, _ = get_dataset(data)
+    min_date, max_date = table.date_bounds()
+    if min_date is None:
         return None, None, None, None
     
-    # Convert invoice_date back to datetime
-    df['invoice_date'] = pd.to_datetime(df['invoice_date'], errors='coerce')
-    
-    # Filter out invalid dates
-    valid_dates = df['invoice_date'].dropna()
-    
-    if valid_dates.empty:
-        return None, None, None, None
-    
-    min_date = valid_dates.min()
-    max_date = valid_dates.max()
-    
+    # Keep a narrowed selection (clamped to the new bounds) when polled changes arrive; a selection
+    # of the whole previous range follows the bounds, so newly uploaded dates show up
+    day = lambda value: str(value)[:10] if value else None
+    selected = (day(start_date), day(end_date))
+    if all(selected) and selected != (day(old_min), day(old_max)):
+        start = min(max(selected[0], day(min_date)), day(max_date))
+        end = max(min(selected[1], day(max_date)), start)
+        return min_date, max_date, start, end
     return min_date, max_date, min_date, max_date
 
-# Main callback to update all dashboard components
-@app.callback(
-    [
-        Output('total-revenue', 'children'),
-        Output('invoice-count', 'children'),
-        Output('avg-invoice', 'children'),
-        Output('payment-rate', 'children'),
-        Output('revenue-trend-graph', 'figure'),
-        Output('product-distribution', 'figure'),
-        Output('product-revenue', 'figure'),
-        Output('location-revenue', 'figure'),
-        Output('customer-type-revenue', 'figure'),
-        Output('profit-margin', 'figure'),
-        Output('invoice-table', 'data')
-    ],
-    [
-        Input('data-store', 'data'),
-        Input('date-range', 'start_date'),
-        Input('date-range', 'end_date')
-    ]
+# Custom color palette for charts
+honey_chart_colors = [honey_colors['primary'], honey_colors['accent'], honey_colors['warning'], 
+                      honey_colors['success'], '#CD853F', '#DAA520', '#B8860B', '#FFB347']
+
+EMPTY_KPIS = ("AED 0.00", "0", "AED 0.00", "0.0%")
+NO_DATA_TITLE = "🍯 No data available - Click refresh or upload invoices"
+NO_DATA_IN_RANGE_TITLE = "🍯 No data available for selected date range"
+
+# Memoized summaries and rendered components keyed by (component, cube fingerprint, date range);
+# set DASHBOARD_CACHE_DIR to share them between worker processes
+component_cache = ResultCache(
+    maxsize=int(os.getenv('DASHBOARD_COMPONENT_CACHE_SIZE', '256')),
+    ttl=float(os.getenv('DASHBOARD_CACHE_TTL_SECONDS', '600')),
+    directory=os.getenv('DASHBOARD_CACHE_DIR') or None
 )
-def update_dashboard(data, start_date, end_date):
-    # Custom color palette for charts
-    honey_chart_colors = [honey_colors['primary'], honey_colors['accent'], honey_colors['warning'], 
-                         honey_colors['success'], '#CD853F', '#DAA520', '#B8860B', '#FFB347']
-    
-    # Handle empty data
+
+def cache_metric_samples():
+    """Prometheus samples of the component cache counters (see metrics.MetricsRegistry.register_collector)"""
+    stats = component_cache.stats()
+    labels = {'cache': 'components'}
+    return [
+        ('dashboard_cache_hits_total', 'counter', 'Dashboard cache hits', [(labels, stats['hits'])]),
+        ('dashboard_cache_misses_total', 'counter', 'Dashboard cache misses', [(labels, stats['misses'])]),
+        ('dashboard_cache_hit_ratio', 'gauge', 'Dashboard cache hits / lookups', [(labels, stats['hit_ratio'])]),
+        ('dashboard_cache_entries', 'gauge', 'Entries held by the dashboard caches',
+         [(labels, stats['entries']), ({'cache': 'datasets'}, len(dataset_cache))])
+    ]
+
+REGISTRY.register_collector(cache_metric_samples)
+
+def normalise_date_range(start_date, end_date):
+    """Normalise the picker values to ('YYYY-MM-DD', 'YYYY-MM-DD'), or (None, None) when not both set"""
+    if not (start_date and end_date):
+        return None, None
+    return (pd.to_datetime(start_date).strftime('%Y-%m-%d'),
+            pd.to_datetime(end_date).strftime('%Y-%m-%d'))
+
+def get_summary(data, start_date, end_date):
+    """
+    Return (summary, fingerprint, empty_title) for the selected dataset and range; summary is None
+    when there is nothing to show, in which case empty_title explains why
+    """
     if not data:
-        empty_fig = px.scatter()
-        empty_fig.update_layout(
-            title="🍯 No data available - Click refresh or upload invoices",
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg']
-        )
-        return ("AED 0.00", "0", "AED 0.00", "0.0%", empty_fig, empty_fig, 
-                empty_fig, empty_fig, empty_fig, empty_fig, [])
-    
-    # Convert data back to DataFrame
-    df = pd.DataFrame(data)
-    
-    if df.empty:
-        empty_fig = px.scatter()
-        empty_fig.update_layout(
-            title="🍯 No data available - Click refresh or upload invoices",
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg']
-        )
-        return ("AED 0.00", "0", "AED 0.00", "0.0%", empty_fig, empty_fig, 
-                empty_fig, empty_fig, empty_fig, empty_fig, [])
-    
-    # Convert date columns back to datetime
-    date_columns = ['invoice_date', 'due_date']
-    for col in date_columns:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors='coerce')
-    
-    # Apply date filter if dates are provided
-    if start_date and end_date:
-        if isinstance(start_date, str):
-            start_date = pd.to_datetime(start_date)
-        if isinstance(end_date, str):
-            end_date = pd.to_datetime(end_date)
-        
-        filtered_df = df[(df['invoice_date'] >= start_date) & (df['invoice_date'] <= end_date)]
-    else:
-        filtered_df = df
-    
-    # If filtering results in empty dataframe
-    if filtered_df.empty:
-        empty_fig = px.scatter()
-        empty_fig.update_layout(
-            title="🍯 No data available for selected date range",
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg']
-        )
-        return ("AED 0.00", "0", "AED 0.00", "0.0%", empty_fig, empty_fig, 
-                empty_fig, empty_fig, empty_fig, empty_fig, [])
+        return None, None, NO_DATA_TITLE
+    
+    # Resolve the version key to the cached invoice table and its daily cube
+    table, cube, _ = get_dataset(data)
+    if table.empty:
+        return None, None, NO_DATA_TITLE
+    
+    # Slice and sum the precomputed cube instead of re-scanning the line items
+    start_date, end_date = normalise_date_range(start_date, end_date)
+    fingerprint = cube.fingerprint
+    summary = component_cache.get_or_compute(
+        ('summary', fingerprint, start_date, end_date),
+        lambda: cube.query(start_date, end_date) or {}
+    )
     
+    return (summary, fingerprint, None) if summary else (None, fingerprint, NO_DATA_IN_RANGE_TITLE)
+
+def render_component(name, builder, empty_result, data, start_date, end_date):
+    """Build a dashboard component from the summary, serving repeat requests from component_cache"""
+    summary, fingerprint, empty_title = get_summary(data, start_date, end_date)
+    if summary is None:
+        return empty_result(empty_title)
+    
+    key = (name, fingerprint) + normalise_date_range(start_date, end_date)
+    return component_cache.get_or_compute(key, lambda: builder(summary))
+
+def get_cache_stats():
+    """Hit/miss counters and sizes of the dashboard caches"""
+    return {
+        'components': component_cache.stats(),
+        'datasets': {'entries': len(dataset_cache), 'maxsize': dataset_cache.maxsize},
+        'current_dataset': cached_data.memory_usage() if cached_data is not None else None
+    }
+
+# The figure builders import plotly on first use, so it is not loaded until a chart is rendered
+def build_empty_figure(title):
+    import plotly.express as px
+    empty_fig = px.scatter()
+    empty_fig.update_layout(
+        title=title,
+        plot_bgcolor=honey_colors['background'],
+        paper_bgcolor=honey_colors['card_bg']
+    )
+    return empty_fig
+
+def build_kpis(summary):
     # Calculate KPIs
-    total_revenue = f"AED {filtered_df['total'].sum():,.2f}"
-    invoice_count = len(filtered_df['invoice_id'].unique())
+    total_revenue = f"AED {summary['total_revenue']:,.2f}"
+    invoice_count = summary['invoice_count']
     
     # Calculate average invoice value
-    invoice_totals = filtered_df.groupby('invoice_id')['total'].sum()
-    avg_invoice = f"AED {invoice_totals.mean():,.2f}" if not invoice_totals.empty else "AED 0.00"
+    avg_invoice = f"AED {summary['avg_invoice']:,.2f}" if summary['avg_invoice'] is not None else "AED 0.00"
     
     # Calculate payment rate 
-    paid_amount = filtered_df[filtered_df['payment_status'] == 'Paid']['total'].sum()
-    total_amount = filtered_df['total'].sum()
-    payment_rate = f"{(paid_amount / total_amount * 100) if total_amount > 0 else 0:.1f}%"
+    payment_rate = f"{summary['payment_rate']:.1f}%"
     
+    return total_revenue, invoice_count, avg_invoice, payment_rate
+
+def build_revenue_trend_figure(summary):
     # Revenue Trend Graph with honey styling
-    df_monthly = filtered_df.copy()
-    df_monthly['month'] = df_monthly['invoice_date'].dt.strftime('%Y-%m')
-    
-    # Handle case when amount_excl_vat column doesn't exist
-    if 'amount_excl_vat' not in df_monthly.columns:
-        df_monthly['amount_excl_vat'] = df_monthly['total'] / 1.05  # Assuming 5% VAT
-    
-    # Handle case when vat column doesn't exist
-    if 'vat' not in df_monthly.columns:
-        df_monthly['vat'] = df_monthly['total'] - df_monthly['amount_excl_vat']
-    
-    monthly_revenue = df_monthly.groupby('month').agg(
-        revenue=('total', 'sum'),
-        vat=('vat', 'sum'),
-        amount_excl_vat=('amount_excl_vat', 'sum')
-    ).reset_index()
+    monthly_revenue = summary['monthly']
     
+    import plotly.graph_objects as go
     revenue_trend = go.Figure()
     revenue_trend.add_trace(go.Bar(
         x=monthly_revenue['month'],
@@ -820,16 +969,14 @@ def update_dashboard(data, start_date, end_date):
             x=1
         )
     )
-    
-    # STEP 1: Replace your Product Distribution section in the update_dashboard callback
-
-# Product Distribution with honey styling
-    if 'product' in filtered_df.columns:
+    return revenue_trend
 
-        product_qty = filtered_df.groupby('product')['qty'].sum().reset_index()
-        product_qty = product_qty.sort_values('product')  # Sort alphabetically
+def build_product_distribution_figure(summary):
+    # Product Distribution with honey styling
+    product_qty = summary['product'][['product', 'qty']].sort_values('product')  # Sort alphabetically
     
-        product_dist = px.pie(
+    import plotly.express as px
+    product_dist = px.pie(
         product_qty, 
         names='product', 
         values='qty',
@@ -838,170 +985,291 @@ def update_dashboard(data, start_date, end_date):
     )
     
     # Add these lines to make it stable
-        product_dist.update_traces(rotation=90)  # Fixed starting position
-        product_dist.update_layout(
+    product_dist.update_traces(rotation=90)  # Fixed starting position
+    product_dist.update_layout(
         plot_bgcolor=honey_colors['background'],
         paper_bgcolor=honey_colors['card_bg'],
         font=dict(color=honey_colors['text_dark'])
     )
-    else:
-       product_dist = px.pie(title='Product data not available')
-       product_dist.update_layout(
-        plot_bgcolor=honey_colors['background'],
-        paper_bgcolor=honey_colors['card_bg']
-    )
-
-# STEP 2: Replace your Customer Type Revenue section
-
-# Customer Type Revenue with honey styling
+    return product_dist
 
+def build_product_revenue_figure(summary):
     # Product Revenue with honey styling
-    if 'product' in filtered_df.columns:
-        product_revenue = filtered_df.groupby('product')['total'].sum().reset_index()
-        product_revenue = product_revenue.sort_values('total', ascending=False)
-        
-        product_rev_fig = px.bar(
-            product_revenue,
-            x='product',
-            y='total',
-            title='Revenue by Product',
-            color='total',
-            color_continuous_scale=[[0, honey_colors['secondary']], [1, honey_colors['accent']]]
-        )
-        product_rev_fig.update_layout(
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg'],
-            font=dict(color=honey_colors['text_dark'])
-        )
-    else:
-        product_rev_fig = px.bar(title='Product revenue data not available')
-        product_rev_fig.update_layout(
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg']
-        )
+    product_revenue = summary['product'][['product', 'total']].sort_values('total', ascending=False)
     
+    import plotly.express as px
+    product_rev_fig = px.bar(
+        product_revenue,
+        x='product',
+        y='total',
+        title='Revenue by Product',
+        color='total',
+        color_continuous_scale=[[0, honey_colors['secondary']], [1, honey_colors['accent']]]
+    )
+    product_rev_fig.update_layout(
+        plot_bgcolor=honey_colors['background'],
+        paper_bgcolor=honey_colors['card_bg'],
+        font=dict(color=honey_colors['text_dark'])
+    )
+    return product_rev_fig
+
+def build_location_revenue_figure(summary):
     # Location Revenue with honey styling
-    if 'customer_location' in filtered_df.columns:
-        location_revenue = filtered_df.groupby('customer_location')['total'].sum().reset_index()
-        location_revenue = location_revenue.sort_values('total', ascending=False)
-        
-        location_fig = px.bar(
-            location_revenue,
-            x='customer_location',
-            y='total',
-            title='Revenue by Location',
-            color='total',
-            color_continuous_scale=[[0, honey_colors['secondary']], [1, honey_colors['primary']]]
-        )
-        location_fig.update_layout(
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg'],
-            font=dict(color=honey_colors['text_dark'])
-        )
-    else:
-        location_fig = px.bar(title='Location data not available')
-        location_fig.update_layout(
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg']
-        )
+    location_revenue = summary['location'].sort_values('total', ascending=False)
     
+    import plotly.express as px
+    location_fig = px.bar(
+        location_revenue,
+        x='customer_location',
+        y='total',
+        title='Revenue by Location',
+        color='total',
+        color_continuous_scale=[[0, honey_colors['secondary']], [1, honey_colors['primary']]]
+    )
+    location_fig.update_layout(
+        plot_bgcolor=honey_colors['background'],
+        paper_bgcolor=honey_colors['card_bg'],
+        font=dict(color=honey_colors['text_dark'])
+    )
+    return location_fig
+
+def build_customer_type_figure(summary):
     # Customer Type Revenue with honey styling
-    if 'customer_type' in filtered_df.columns:
-       type_revenue = filtered_df.groupby('customer_type')['total'].sum().reset_index()
-       type_revenue = type_revenue.sort_values('customer_type')  # Sort alphabetically
+    type_revenue = summary['customer_type'].sort_values('customer_type')  # Sort alphabetically
     
-       type_fig = px.pie(
-       type_revenue,
+    import plotly.express as px
+    type_fig = px.pie(
+        type_revenue,
         names='customer_type',
         values='total',
         title='Revenue by Customer Type',
         color_discrete_sequence=honey_chart_colors
     )
-       type_fig.update_traces(rotation=90)  # Fixed starting position
-       type_fig.update_layout(
+    type_fig.update_traces(rotation=90)  # Fixed starting position
+    type_fig.update_layout(
         plot_bgcolor=honey_colors['background'],
         paper_bgcolor=honey_colors['card_bg'],
         font=dict(color=honey_colors['text_dark'])
     )
-    else:
-       type_fig = px.pie(
-        pd.DataFrame({'type': ['Unknown'], 'value': [1]}),
-        names='type',
-        values='value',
-        title='Customer Type Data Not Available'
+    return type_fig
+
+def build_profit_margin_figure(summary):
+    # Profit Margin Analysis with honey styling
+    profit_data = summary['monthly'][['month', 'amount_excl_vat', 'profit']].rename(columns={'amount_excl_vat': 'revenue'})
+    profit_data['margin'] = profit_data['profit'] / profit_data['revenue'] * 100
+    
+    import plotly.graph_objects as go
+    from plotly.subplots import make_subplots
+    profit_fig = make_subplots(specs=[[{"secondary_y": True}]])
+    
+    profit_fig.add_trace(
+        go.Bar(x=profit_data['month'], y=profit_data['profit'], name="Profit", 
+               marker_color=honey_colors['success']),
+        secondary_y=False
     )
-       type_fig.update_layout(
+    
+    profit_fig.add_trace(
+        go.Scatter(x=profit_data['month'], y=profit_data['margin'], name="Margin %", 
+                  line=dict(color=honey_colors['accent'], width=3)),
+        secondary_y=True
+    )
+    
+    profit_fig.update_layout(
+        title_text="Monthly Profit and Margin",
         plot_bgcolor=honey_colors['background'],
-        paper_bgcolor=honey_colors['card_bg']
+        paper_bgcolor=honey_colors['card_bg'],
+        font=dict(color=honey_colors['text_dark']),
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        )
     )
     
+    profit_fig.update_yaxes(title_text="Profit (AED)", secondary_y=False)
+    profit_fig.update_yaxes(title_text="Margin (%)", secondary_y=True)
+    return profit_fig
+
+# Figure components, each rendered by its own callback so they update independently
+FIGURE_BUILDERS = {
+    'revenue-trend-graph': build_revenue_trend_figure,
+    'product-distribution': build_product_distribution_figure,
+    'product-revenue': build_product_revenue_figure,
+    'location-revenue': build_location_revenue_figure,
+    'customer-type-revenue': build_customer_type_figure,
+    'profit-margin': build_profit_margin_figure
+}
+
+DASHBOARD_INPUTS = [
+    Input('data-store', 'data'),
+    Input('date-range', 'start_date'),
+    Input('date-range', 'end_date')
+]
+
+# KPI cards callback
+@app.callback(
+    [
+        Output('total-revenue', 'children'),
+        Output('invoice-count', 'children'),
+        Output('avg-invoice', 'children'),
+        Output('payment-rate', 'children')
+    ],
+    DASHBOARD_INPUTS
+)
+def update_kpis(data, start_date, end_date):
+    return render_component('kpis', build_kpis, lambda title: EMPTY_KPIS, data, start_date, end_date)
+
+def register_figure_callback(component_id, builder):
+    """Register the callback rendering one dashboard figure"""
+    @app.callback(Output(component_id, 'figure'), DASHBOARD_INPUTS)
+    def update_figure(data, start_date, end_date):
+        return render_component(component_id, builder, build_empty_figure, data, start_date, end_date)
+    return update_figure
+
+for figure_id, figure_builder in FIGURE_BUILDERS.items():
+    register_figure_callback(figure_id, figure_builder)
+
+# Table columns backed by a different source column for filtering and sorting
+TABLE_SOURCE_COLUMNS = {
+    'invoice_date_str': 'invoice_date',
+    'total_str': 'total'
+}
+TABLE_COLUMNS = ['invoice_id', 'invoice_date', 'customer_name', 'customer_location', 'product', 'qty', 'total',
+                 'payment_status']
+
+FILTER_OPERATORS = [['ge ', '>='],
+                    ['le ', '<='],
+                    ['lt ', '<'],
+                    ['gt ', '>'],
+                    ['ne ', '!='],
+                    ['eq ', '='],
+                    ['contains '],
+                    ['datestartswith ']]
+
+def split_filter_part(filter_part):
+    """Split one DataTable filter expression into (column_id, operator, value)"""
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+                
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                elif operator_type[0] in ('contains ', 'datestartswith '):
+                    value = value_part
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+                
+                # word operators need spaces after them in the filter string,
+                # but we don't want these later
+                return name, operator_type[0].strip(), value
+    
+    return [None] * 3
+
+def filter_table_rows(df, filter_query):
+    """Apply a DataTable filter_query to the rows with vectorised comparisons"""
+    if not filter_query:
+        return df
     
-    # Profit Margin Analysis with honey styling
-    if 'profit' in filtered_df.columns and 'amount_excl_vat' in filtered_df.columns:
-        df_profit = filtered_df.copy()
-        df_profit['month'] = df_profit['invoice_date'].dt.strftime('%Y-%m')
-        profit_data = df_profit.groupby('month').agg(
-            revenue=('amount_excl_vat', 'sum'),
-            profit=('profit', 'sum')
-        ).reset_index()
-        profit_data['margin'] = profit_data['profit'] / profit_data['revenue'] * 100
+    for filter_part in filter_query.split(' && '):
+        col_name, operator, filter_value = split_filter_part(filter_part)
+        source_column = TABLE_SOURCE_COLUMNS.get(col_name, col_name)
+        if col_name is None or source_column not in df.columns:
+            continue
+        column = df[source_column]
         
-        profit_fig = make_subplots(specs=[[{"secondary_y": True}]])
-        
-        profit_fig.add_trace(
-            go.Bar(x=profit_data['month'], y=profit_data['profit'], name="Profit", 
-                   marker_color=honey_colors['success']),
-            secondary_y=False
-        )
-        
-        profit_fig.add_trace(
-            go.Scatter(x=profit_data['month'], y=profit_data['margin'], name="Margin %", 
-                      line=dict(color=honey_colors['accent'], width=3)),
-            secondary_y=True
-        )
-        
-        profit_fig.update_layout(
-            title_text="Monthly Profit and Margin",
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg'],
-            font=dict(color=honey_colors['text_dark']),
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            )
-        )
+        if operator in ('contains', 'datestartswith'):
+            if col_name == 'invoice_date_str':
+                text = column.dt.strftime('%Y-%m-%d')
+            else:
+                text = column.astype(str)
+            if operator == 'contains':
+                mask = text.str.contains(str(filter_value), regex=False, na=False)
+            else:
+                mask = text.str.startswith(str(filter_value), na=False)
+        else:
+            if pd.api.types.is_datetime64_any_dtype(column):
+                value = pd.to_datetime(filter_value, errors='coerce')
+            elif pd.api.types.is_numeric_dtype(column):
+                value = pd.to_numeric(filter_value, errors='coerce')
+            else:
+                column = column.astype(str)
+                value = str(filter_value)
+            mask = {
+                'eq': column == value,
+                'ne': column != value,
+                'lt': column < value,
+                'le': column <= value,
+                'gt': column > value,
+                'ge': column >= value
+            }[operator]
         
-        profit_fig.update_yaxes(title_text="Profit (AED)", secondary_y=False)
-        profit_fig.update_yaxes(title_text="Margin (%)", secondary_y=True)
-    else:
-        profit_fig = px.scatter(title="Profit Data Not Available")
-        profit_fig.update_layout(
-            plot_bgcolor=honey_colors['background'],
-            paper_bgcolor=honey_colors['card_bg']
-        )
+        df = df[mask]
+    
+    return df
+
+def sort_table_rows(df, sort_by):
+    """Apply DataTable sort_by to the rows"""
+    if not sort_by:
+        return df
+    return df.sort_values(
+        [TABLE_SOURCE_COLUMNS.get(col['column_id'], col['column_id']) for col in sort_by],
+        ascending=[col['direction'] == 'asc' for col in sort_by],
+        kind='mergesort',
+        na_position='last'
+    )
+
+def format_table_page(page_df):
+    """Build the display records for the rows of one table page"""
+    return pd.DataFrame({
+        'invoice_id': page_df['invoice_id'].astype(object).fillna('N/A'),
+        'invoice_date_str': page_df['invoice_date'].dt.strftime('%Y-%m-%d').fillna('N/A'),
+        'customer_name': page_df['customer_name'].astype(object).fillna('N/A'),
+        'customer_location': page_df['customer_location'].astype(object).fillna('N/A'),
+        'product': page_df['product'].astype(object).fillna('N/A'),
+        'qty': page_df['qty'],
+        'total_str': page_df['total'].fillna(0).map('AED {:,.2f}'.format),
+        'payment_status': page_df['payment_status'].astype(object).fillna('N/A')
+    }).to_dict('records')
+
+# Table callback: filter, sort and page server-side so only the visible rows are sent
+@app.callback(
+    [Output('invoice-table', 'data'),
+     Output('invoice-table', 'page_count')],
+    [Input('data-store', 'data'),
+     Input('date-range', 'start_date'),
+     Input('date-range', 'end_date'),
+     Input('invoice-table', 'page_current'),
+     Input('invoice-table', 'page_size'),
+     Input('invoice-table', 'sort_by'),
+     Input('invoice-table', 'filter_query')]
+)
+def update_invoice_table(data, start_date, end_date, page_current, page_size, sort_by, filter_query):
+    if not data:
+        return [], 0
+    
+    table, _, _ = get_dataset(data)
+    if table.empty:
+        return [], 0
+    
+    # Materialise only the displayed columns of the invoices within the date range
+    df = table.to_frame(TABLE_COLUMNS, start_date, end_date)
+    df = sort_table_rows(filter_table_rows(df, filter_query), sort_by)
+    
+    page_size = page_size or 10
+    page_count = max(1, -(-len(df) // page_size))
+    page_current = min(page_current or 0, page_count - 1)
+    page_df = df.iloc[page_current * page_size:(page_current + 1) * page_size]
     
-    # Data Table
-    table_df = filtered_df.copy()
-    
-    # Prepare table data with safe column access
-    table_data = []
-    for _, row in table_df.iterrows():
-        table_row = {
-            'invoice_id': row.get('invoice_id', 'N/A'),
-            'invoice_date_str': row['invoice_date'].strftime('%Y-%m-%d') if pd.notna(row.get('invoice_date')) else 'N/A',
-            'customer_name': row.get('customer_name', 'N/A'),
-            'customer_location': row.get('customer_location', 'N/A'),
-            'product': row.get('product', 'N/A'),
-            'qty': row.get('qty', 0),
-            'total_str': f"AED {row.get('total', 0):,.2f}",
-            'payment_status': row.get('payment_status', 'N/A')
-        }
-        table_data.append(table_row)
-    
-    return total_revenue, invoice_count, avg_invoice, payment_rate, revenue_trend, product_dist, product_rev_fig, location_fig, type_fig, profit_fig, table_data
+    return format_table_page(page_df), page_count
 
 # Toggle table visibility callback
 @app.callback(
@@ -0,0 +1,179 @@
+# dashboard_cube.py
+
+import pandas as pd
+from typing import Optional
+
+# Dimensions and additive line item measures of the daily rollup cube
+CUBE_DIMENSIONS = ['date', 'product', 'customer_location', 'customer_type', 'payment_status']
+CUBE_MEASURES = ['qty', 'total', 'line_items']
+
+# Invoice-level amounts are repeated on every line item of an invoice, so they are kept
+# once per invoice rather than summed over line items (which would count them once per product)
+INVOICE_MEASURES = ['amount_excl_vat', 'vat', 'profit']
+
+
+def _empty_cells() -> pd.DataFrame:
+    return pd.DataFrame({
+        **{dim: pd.Series(dtype='datetime64[ns]' if dim == 'date' else object) for dim in CUBE_DIMENSIONS},
+        **{measure: pd.Series(dtype=float) for measure in CUBE_MEASURES}
+    })
+
+
+def _empty_invoices() -> pd.DataFrame:
+    return pd.DataFrame({
+        'date': pd.Series(dtype='datetime64[ns]'),
+        'total': pd.Series(dtype=float),
+        'line_items': pd.Series(dtype=float),
+        **{measure: pd.Series(dtype=float) for measure in INVOICE_MEASURES}
+    }, index=pd.Index([], name='invoice_id', dtype=object))
+
+
+def _aggregate_invoices(frame: pd.DataFrame, by) -> pd.DataFrame:
+    return frame.groupby(by, sort=False).agg(
+        date=('date', 'first'),
+        total=('total', 'sum'),
+        line_items=('line_items', 'sum'),
+        **{measure: (measure, 'first') for measure in INVOICE_MEASURES}
+    )
+
+
+def build_cells(df: pd.DataFrame) -> pd.DataFrame:
+    """Roll line item rows up to one row per (date, product, location, customer type, payment status)"""
+    if df.empty:
+        return _empty_cells()
+    frame = pd.DataFrame({
+        'date': pd.to_datetime(df['invoice_date'], errors='coerce').dt.normalize(),
+        **{dim: df[dim].astype(object) for dim in CUBE_DIMENSIONS[1:]},
+        **{measure: pd.to_numeric(df[measure], errors='coerce') for measure in CUBE_MEASURES[:-1]},
+        'line_items': 1.0
+    })
+    return frame.groupby(CUBE_DIMENSIONS, dropna=False, sort=False).sum().reset_index()
+
+
+def build_invoices(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per invoice with its date, line item total and invoice-level amounts
+    Distinct invoice counts are not additive across cube cells, so they are kept per invoice
+    """
+    df = df[df['invoice_id'].notna()]
+    if df.empty:
+        return _empty_invoices()
+    frame = pd.DataFrame({
+        'invoice_id': df['invoice_id'].astype(str),
+        'date': pd.to_datetime(df['invoice_date'], errors='coerce').dt.normalize(),
+        'total': pd.to_numeric(df['total'], errors='coerce'),
+        'line_items': 1.0,
+        **{measure: pd.to_numeric(df[measure], errors='coerce') for measure in INVOICE_MEASURES}
+    })
+    return _aggregate_invoices(frame, 'invoice_id')
+
+
+def _combine_cells(cells: pd.DataFrame, delta: pd.DataFrame, sign: float) -> pd.DataFrame:
+    if delta.empty:
+        return cells
+    delta = delta.copy()
+    delta[CUBE_MEASURES] = delta[CUBE_MEASURES] * sign
+    combined = pd.concat([cells, delta], ignore_index=True)
+    combined = combined.groupby(CUBE_DIMENSIONS, dropna=False, sort=False).sum().reset_index()
+    return combined[combined['line_items'] > 0].reset_index(drop=True)
+
+
+def _combine_invoices(invoices: pd.DataFrame, delta: pd.DataFrame, sign: float) -> pd.DataFrame:
+    if delta.empty:
+        return invoices
+    delta = delta.copy()
+    delta[['total', 'line_items']] = delta[['total', 'line_items']] * sign
+    # Invoice-level amounts are not signed: the stored invoice keeps its values until all its lines are removed
+    combined = _aggregate_invoices(pd.concat([invoices, delta]), pd.Grouper(level=0))
+    return combined[combined['line_items'] > 0]
+
+
+class InvoiceCube:
+    """
+    Daily rollup of the invoice line items used by the dashboard callbacks
+    A date range filter becomes a slice-and-sum over the cube instead of a scan of the raw rows.
+    Instances are never mutated: add/remove return a new cube so older dataset versions stay valid.
+    """
+
+    def __init__(self, cells: pd.DataFrame, invoices: pd.DataFrame):
+        self.cells = cells
+        self.invoices = invoices
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self) -> str:
+        """
+        Content hash of the cube, independent of row order and stable across processes
+        Measures are rounded so incrementally maintained and freshly built cubes agree.
+        """
+        if self._fingerprint is None:
+            cells = self.cells.copy()
+            cells[CUBE_MEASURES] = cells[CUBE_MEASURES].round(4)
+            invoices = self.invoices.copy()
+            invoices[['total', 'line_items'] + INVOICE_MEASURES] = \
+                invoices[['total', 'line_items'] + INVOICE_MEASURES].round(4)
+            cell_hash = int(pd.util.hash_pandas_object(cells, index=False).sum())
+            invoice_hash = int(pd.util.hash_pandas_object(invoices, index=True).sum())
+            self._fingerprint = f"{len(cells)}-{len(invoices)}-{cell_hash:016x}-{invoice_hash:016x}"
+        return self._fingerprint
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'InvoiceCube':
+        return cls(build_cells(df), build_invoices(df))
+
+    def add(self, rows: pd.DataFrame) -> 'InvoiceCube':
+        """Return a cube including the given line item rows"""
+        if rows.empty:
+            return self
+        return InvoiceCube(_combine_cells(self.cells, build_cells(rows), 1.0),
+                           _combine_invoices(self.invoices, build_invoices(rows), 1.0))
+
+    def remove(self, rows: pd.DataFrame) -> 'InvoiceCube':
+        """Return a cube excluding the given line item rows"""
+        if rows.empty:
+            return self
+        return InvoiceCube(_combine_cells(self.cells, build_cells(rows), -1.0),
+                           _combine_invoices(self.invoices, build_invoices(rows), -1.0))
+
+    @staticmethod
+    def _date_mask(dates: pd.Series, start_date=None, end_date=None) -> pd.Series:
+        mask = pd.Series(True, index=dates.index)
+        if start_date is not None:
+            mask &= dates >= pd.to_datetime(start_date)
+        if end_date is not None:
+            mask &= dates <= pd.to_datetime(end_date)
+        return mask
+
+    def query(self, start_date=None, end_date=None) -> Optional[dict]:
+        """
+        Aggregate the cube over [start_date, end_date] (no filtering when either is missing)
+        Returns None when no line items fall into the range
+        """
+        cells = self.cells
+        invoices = self.invoices
+        if start_date and end_date:
+            cells = cells[self._date_mask(cells['date'], start_date, end_date)]
+            invoices = invoices[self._date_mask(invoices['date'], start_date, end_date)]
+
+        if cells.empty or cells['line_items'].sum() <= 0:
+            return None
+
+        total_revenue = cells['total'].sum()
+        paid_revenue = cells.loc[cells['payment_status'] == 'Paid', 'total'].sum()
+
+        # Revenue sums line items; VAT, amount excluding VAT and profit sum one value per invoice
+        revenue = cells.groupby(cells['date'].dt.strftime('%Y-%m'))['total'].sum().rename('revenue')
+        invoice_amounts = invoices.groupby(invoices['date'].dt.strftime('%Y-%m'))[['vat', 'amount_excl_vat', 'profit']].sum()
+        monthly = pd.concat([revenue, invoice_amounts], axis=1).fillna(0.0).sort_index()
+        monthly = monthly.rename_axis('month').reset_index()
+
+        return {
+            'total_revenue': total_revenue,
+            'invoice_count': len(invoices),
+            'avg_invoice': invoices['total'].mean() if not invoices.empty else None,
+            'payment_rate': (paid_revenue / total_revenue * 100) if total_revenue > 0 else 0,
+            'monthly': monthly,
+            'product': cells.groupby('product')[['qty', 'total']].sum().reset_index(),
+            'location': cells.groupby('customer_location')['total'].sum().reset_index(),
+            'customer_type': cells.groupby('customer_type')['total'].sum().reset_index()
+        }
@@ -5,10 +5,21 @@ load_dotenv()  # Load environment variables from .env
 
 import os
 import base64
+import time
 import requests
 import pandas as pd
 from typing import List, Dict, Optional
 from datetime import datetime
+from invoice_schema import join_invoice_tables, line_items_path, read_invoice_tables, split_invoice_rows
+from metrics import REGISTRY
+
+# Every GitHub contents API call, by HTTP method and response status ('error' when the request failed)
+github_request_seconds = REGISTRY.histogram('github_request_duration_seconds', 'GitHub API request latency',
+                                            ['method', 'status'])
+
+
+class GitHubStorageError(Exception):
+    """A stored CSV exists but could not be fetched or parsed"""
 
 
 class GitHubCSVStorage:
@@ -17,6 +28,8 @@ class GitHubCSVStorage:
         self.repo_name = repo_name
         self.token = token
         self.csv_filename = csv_filename
+        # Line items are stored in a second CSV next to the invoice header CSV
+        self.lines_filename = line_items_path(csv_filename)
         self.base_url = f"https://api.github.com/repos/{repo_owner}/{repo_name}"
         self.headers = {
             'Authorization': f'token {token}',
@@ -24,6 +37,8 @@ class GitHubCSVStorage:
         }
 
     def _make_request(self, method: str, url: str, data: dict = None) -> requests.Response:
+        started = time.perf_counter()
+        status = 'error'
         try:
             if method.upper() == 'GET':
                 response = requests.get(url, headers=self.headers)
@@ -31,31 +46,63 @@ class GitHubCSVStorage:
                 response = requests.put(url, headers=self.headers, json=data)
             else:
                 raise ValueError(f"Unsupported HTTP method: {method}")
+            status = response.status_code
             return response
         except Exception as e:
             print(f"Error making GitHub API request: {e}")
             raise
+        finally:
+            github_request_seconds.labels(method.upper(), status).observe(time.perf_counter() - started)
+
+    def get_file_content(self, filename: Optional[str] = None) -> tuple[Optional[str], Optional[str]]:
+        try:
+            return self.fetch_file(filename)
+        except GitHubStorageError as e:
+            print(f"Error getting file content: {e}")
+            return None, None
 
-    def get_file_content(self) -> tuple[Optional[str], Optional[str]]:
-        url = f"{self.base_url}/contents/{self.csv_filename}"
+    def fetch_file(self, filename: Optional[str] = None) -> tuple[Optional[str], Optional[str]]:
+        """(content, sha) of a stored file, (None, None) when it does not exist; raises GitHubStorageError otherwise"""
+        filename = filename or self.csv_filename
+        url = f"{self.base_url}/contents/{filename}"
         try:
             response = self._make_request('GET', url)
-            if response.status_code == 200:
-                file_data = response.json()
-                content = base64.b64decode(file_data['content']).decode('utf-8')
-                return content, file_data['sha']
-            elif response.status_code == 404:
-                print(f"CSV file {self.csv_filename} not found in repository")
-                return None, None
-            else:
-                print(f"Error fetching file: {response.status_code} - {response.text}")
-                return None, None
         except Exception as e:
-            print(f"Error getting file content: {e}")
+            raise GitHubStorageError(f"Error fetching {filename}: {e}") from e
+        if response.status_code == 404:
+            print(f"CSV file {filename} not found in repository")
             return None, None
+        if response.status_code != 200:
+            raise GitHubStorageError(f"Error fetching {filename}: {response.status_code} - {response.text}")
+        try:
+            file_data = response.json()
+            return base64.b64decode(file_data['content']).decode('utf-8'), file_data['sha']
+        except Exception as e:
+            raise GitHubStorageError(f"Error decoding {filename}: {e}") from e
+
+    def get_file_metadata(self, filename: Optional[str] = None) -> Optional[dict]:
+        """
+        GitHub's entry (name, path, sha, size) for a stored file, or None when it does not exist
+        Lists the file's directory, which returns metadata only, so checking a large CSV does not download it
+        """
+        filename = filename or self.csv_filename
+        directory, name = os.path.split(filename)
+        url = f"{self.base_url}/contents/{directory}"
+        try:
+            response = self._make_request('GET', url)
+            if response.status_code == 200:
+                return next((entry for entry in response.json() if entry.get('name') == name), None)
+            elif response.status_code != 404:
+                print(f"Error listing files: {response.status_code} - {response.text}")
+            return None
+        except Exception as e:
+            print(f"Error getting file metadata: {e}")
+            return None
 
-    def upload_csv_content(self, content: str, sha: Optional[str] = None, commit_message: str = None) -> bool:
-        url = f"{self.base_url}/contents/{self.csv_filename}"
+    def upload_csv_content(self, content: str, sha: Optional[str] = None, commit_message: str = None,
+                           filename: Optional[str] = None) -> bool:
+        filename = filename or self.csv_filename
+        url = f"{self.base_url}/contents/{filename}"
         if not commit_message:
             timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             commit_message = f"Update invoice data - {timestamp}"
@@ -69,7 +116,7 @@ class GitHubCSVStorage:
         try:
             response = self._make_request('PUT', url, data)
             if response.status_code in [200, 201]:
-                print(f"Successfully {'updated' if sha else 'created'} {self.csv_filename}")
+                print(f"Successfully {'updated' if sha else 'created'} {filename}")
                 return True
             else:
                 print(f"Error uploading file: {response.status_code} - {response.text}")
@@ -78,44 +125,72 @@ class GitHubCSVStorage:
             print(f"Error uploading CSV: {e}")
             return False
 
-    def read_csv_as_dataframe(self) -> Optional[pd.DataFrame]:
-        content, _ = self.get_file_content()
-        if content:
-            try:
-                from io import StringIO
-                return pd.read_csv(StringIO(content))
-            except Exception as e:
-                print(f"Error parsing CSV content: {e}")
-                return None
-        return None
+    def read_tables(self, usecols: Optional[List[str]] = None, compact: bool = False) -> Optional[tuple]:
+        """Read the (invoices, line_items) tables; a legacy flat CSV without a line item file is split on read"""
+        try:
+            return self.fetch_tables(usecols=usecols, compact=compact)
+        except GitHubStorageError as e:
+            print(e)
+            return None
+
+    def fetch_tables(self, usecols: Optional[List[str]] = None, compact: bool = False) -> Optional[tuple]:
+        """
+        Like read_tables, but None only when the invoice CSV does not exist:
+        a failed fetch or an unparseable CSV raises GitHubStorageError
+        """
+        content, _ = self.fetch_file()
+        if not content:
+            return None
+        lines_content, _ = self.fetch_file(self.lines_filename)
+        try:
+            from io import StringIO
+            return read_invoice_tables(StringIO(content), StringIO(lines_content) if lines_content else None,
+                                       usecols=usecols, compact=compact)
+        except Exception as e:
+            raise GitHubStorageError(f"Error parsing CSV content: {e}") from e
+
+    def write_tables(self, invoices: pd.DataFrame, lines: pd.DataFrame, commit_message: str) -> bool:
+        """
+        Upload both tables, line items first: readers join line items onto the invoice header table,
+        so until the header is updated any new line items are simply not visible yet
+        """
+        lines_metadata = self.get_file_metadata(self.lines_filename) or {}
+        if not self.upload_csv_content(lines.to_csv(index=False), lines_metadata.get('sha'), commit_message,
+                                       self.lines_filename):
+            return False
+        metadata = self.get_file_metadata() or {}
+        return self.upload_csv_content(invoices.to_csv(index=False), metadata.get('sha'), commit_message)
+
+    def read_csv_as_dataframe(self, usecols: Optional[List[str]] = None,
+                              compact: bool = False) -> Optional[pd.DataFrame]:
+        """Flat line item rows joined from the invoice header and line item tables (see read_invoice_csv for compact)"""
+        tables = self.read_tables(usecols=usecols, compact=compact)
+        return join_invoice_tables(*tables) if tables is not None else None
 
     def append_data_to_csv(self, new_data: List[Dict]) -> bool:
         if not new_data:
             print("No new data to append")
             return True
-        existing_content, sha = self.get_file_content()
-        if existing_content:
-            try:
-                from io import StringIO
-                df_existing = pd.read_csv(StringIO(existing_content))
-                df_new = pd.DataFrame(new_data)
-                df_combined = pd.concat([df_existing, df_new], ignore_index=True)
-            except Exception as e:
-                print(f"Error processing existing CSV: {e}")
-                return False
-        else:
-            df_combined = pd.DataFrame(new_data)
-            sha = None
-        csv_content = df_combined.to_csv(index=False)
+        df_new = pd.DataFrame(new_data)
+        # Start from empty tables only when none are stored yet: rewriting them after a failed read
+        # would replace every stored invoice with the new rows
+        try:
+            tables = self.fetch_tables()
+        except GitHubStorageError as e:
+            print(f"Error processing existing CSV: {e}")
+            return False
+        df_combined = df_new if tables is None else pd.concat([join_invoice_tables(*tables), df_new], ignore_index=True)
+        # Invoices extracted again replace their earlier header and line items
+        invoices, lines = split_invoice_rows(df_combined)
         commit_message = f"Add {len(new_data)} new invoice records"
-        return self.upload_csv_content(csv_content, sha, commit_message)
+        return self.write_tables(invoices, lines, commit_message)
 
     def update_entire_csv(self, dataframe: pd.DataFrame, commit_message: str = None) -> bool:
-        _, sha = self.get_file_content()
-        csv_content = dataframe.to_csv(index=False)
+        """Replace the stored tables with the given flat line item rows"""
         if not commit_message:
             commit_message = f"Update complete CSV with {len(dataframe)} records"
-        return self.upload_csv_content(csv_content, sha, commit_message)
+        invoices, lines = split_invoice_rows(dataframe)
+        return self.write_tables(invoices, lines, commit_message)
 
     def delete_records_by_condition(self, condition_func) -> bool:
         df = self.read_csv_as_dataframe()
@@ -0,0 +1,102 @@
+# health.py
+"""
+Health report computed in the background
+HealthMonitor runs a (possibly slow) check every interval seconds in a thread and keeps the last
+report in memory, so health endpoints answer in constant time however often they are probed;
+the report says how old it is and whether it is stale.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from metrics import REGISTRY, MetricsRegistry
+
+HEALTH_INTERVAL_SECONDS = float(os.getenv('HEALTH_INTERVAL_SECONDS', '30'))
+
+
+class HealthMonitor:
+    """
+    Run check() every interval seconds and serve its last result from memory
+    A report older than stale_after seconds (twice the interval by default) is marked stale,
+    e.g. when the check hangs on an unreachable storage backend.
+    """
+
+    def __init__(self, check: Callable[[], dict], interval: float = HEALTH_INTERVAL_SECONDS,
+                 stale_after: Optional[float] = None, registry: MetricsRegistry = REGISTRY):
+        self.check = check
+        self.interval = interval
+        self.stale_after = stale_after if stale_after is not None else 2 * interval
+        self._report = None
+        self._generated = None  # time.monotonic() of the report
+        self._generated_at = None
+        self._check_seconds = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.check_duration = registry.histogram('health_check_duration_seconds',
+                                                 'Seconds to compute the background health report').labels()
+        registry.gauge('health_report_age_seconds', 'Seconds since the health report was last computed',
+                       function=self.age).labels()
+
+    def refresh(self) -> dict:
+        """Compute the report now; a check that raises becomes an error report"""
+        started = time.perf_counter()
+        try:
+            report = self.check()
+        except Exception as e:
+            print(f"Error computing health report: {e}")
+            report = {"status": "error", "message": f"Health check failed: {str(e)}"}
+        elapsed = time.perf_counter() - started
+        self.check_duration.observe(elapsed)
+        with self._lock:
+            self._report = report
+            self._generated = time.monotonic()
+            self._generated_at = datetime.now().isoformat(timespec='seconds')
+            self._check_seconds = elapsed
+        return report
+
+    def age(self) -> float:
+        """Seconds since the last report, or since the monitor was created when there is none yet"""
+        return time.monotonic() - (self._generated if self._generated is not None else self._started)
+
+    def snapshot(self) -> dict:
+        """The last report plus its generated_at, age_seconds, check_seconds and stale flag"""
+        with self._lock:
+            report = self._report
+            generated_at = self._generated_at
+            check_seconds = self._check_seconds
+        age = self.age()
+        if report is None:
+            report = {"status": "starting", "message": "Health report not computed yet"}
+        return {
+            **report,
+            "report": {
+                "generated_at": generated_at,
+                "age_seconds": round(age, 3),
+                "check_seconds": round(check_seconds, 3) if check_seconds is not None else None,
+                "interval_seconds": self.interval,
+                "stale": age > self.stale_after
+            }
+        }
+
+    def run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Compute reports in a background thread, the first one straight away"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='health-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -1,28 +1,169 @@
 import os
-import re
+import sys
+import errno
+import json
+import time
+import hashlib
+import itertools
+import argparse
+import functools
+import shutil
+import tempfile
+import regex
 import pandas as pd
 import fitz 
 from datetime import datetime
 import glob
-import csv
-import camelot
+from concurrent.futures import ProcessPoolExecutor
+from invoice_schema import (INVOICE_COLUMNS, INVOICE_HEADER_COLUMNS, LINE_COLUMNS, line_items_path,
+                            normalize_invoice_frame, read_invoice_rows)
+from invoice_sinks import CsvInvoiceSink
+
+# Field patterns run on the `regex` engine: each is only tried where its leading label occurs, on at most
+# FIELD_SEARCH_WINDOW characters from there, and gives up after FIELD_PATTERN_TIMEOUT seconds per field.
+# The timeouts are wall-clock and only meant to stop runaway backtracking: a normal match takes well under
+# a millisecond, but may wait far longer for a CPU shared with the pool and split workers. A field that
+# times out is left empty and listed in stats['regex_timeouts'] (see ExtractionMetrics)
+FIELD_FLAGS = regex.IGNORECASE | regex.DOTALL
+FIELD_SEARCH_WINDOW = int(os.getenv('INVOICE_FIELD_SEARCH_WINDOW', '600'))
+FIELD_PATTERN_TIMEOUT = float(os.getenv('INVOICE_REGEX_TIMEOUT_SECONDS', '1.0'))
+PRODUCT_PATTERN_TIMEOUT = float(os.getenv('INVOICE_PRODUCT_REGEX_TIMEOUT_SECONDS', '2.0'))
+
+@functools.lru_cache(maxsize=256)
+def pattern_label(pattern):
+    """Literal text a pattern starts with, up to its first metacharacter ('' when it has none)"""
+    label = regex.match(r'[^\\.^$*+?{}\[\]|()]*', pattern).group(0)
+    # A quantifier after the prefix applies to its last character, which is then not fixed
+    if len(label) < len(pattern) and pattern[len(label)] in '*+?{':
+        label = label[:-1]
+    return label
+
+def search_field(pattern, text, window=None, timeout=None, field=None, timeouts=None):
+    """
+    First match of a field pattern in text, like re.search with IGNORECASE | DOTALL, but only
+    attempted at occurrences of the pattern's leading label and within `window` characters of each.
+    Returns None when nothing matches or the `timeout` (seconds, for the whole search) runs out;
+    a timeout is logged and the field name (or the pattern) appended to the `timeouts` list if given.
+    """
+    window = window or FIELD_SEARCH_WINDOW
+    timeout = timeout or FIELD_PATTERN_TIMEOUT
+    deadline = time.perf_counter() + timeout
+    label = pattern_label(pattern)
+    try:
+        if not label:
+            return regex.search(pattern, text, FIELD_FLAGS, timeout=timeout)
+        for anchor in regex.finditer(regex.escape(label), text, regex.IGNORECASE, timeout=timeout):
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError
+            match = regex.match(pattern, text, FIELD_FLAGS, pos=anchor.start(),
+                                endpos=anchor.start() + window, timeout=remaining)
+            if match:
+                return match
+    except TimeoutError:
+        print(f"Warning: gave up matching {field or pattern!r} after {timeout}s")
+        if timeouts is not None:
+            timeouts.append(field or pattern)
+    return None
+
+# '<sl> <description> UN|EA <qty> <unit rate> <amount>' item lines, the last product extraction tier
+PRODUCT_LINE_PATTERN = r'(\d+)\s+([^\n]{1,200}?)\s+(?:UN|EA)\s+(\d+)\s+([\d,.]+)\s+([\d,.]+)'
+
+def find_product_lines(text, timeout=None, timeouts=None):
+    """
+    All PRODUCT_LINE_PATTERN matches as tuples of groups ([] if they take longer than timeout seconds,
+    when 'product_lines' is appended to the `timeouts` list if given)
+    """
+    timeout = timeout or PRODUCT_PATTERN_TIMEOUT
+    try:
+        return regex.findall(PRODUCT_LINE_PATTERN, text, timeout=timeout)
+    except TimeoutError:
+        print(f"Warning: gave up matching product lines after {timeout}s")
+        if timeouts is not None:
+            timeouts.append('product_lines')
+        return []
+
+# Table layouts remembered per template (see InvoiceExtractor.extract_known_layout); 0 disables the cache
+LAYOUT_CACHE_SIZE = int(os.getenv('INVOICE_LAYOUT_CACHE_SIZE', '64'))
+
+def text_lines(words, tolerance=2.0):
+    """page.get_text('words') tuples grouped into lines by baseline, top to bottom, each sorted left to right"""
+    lines = []
+    for word in sorted(words, key=lambda w: (w[3], w[0])):
+        if lines and word[3] - lines[-1][0][3] <= tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return [sorted(line, key=lambda w: w[0]) for line in lines]
+
+def column_cells(line, columns):
+    """Text of a line split into the (x0, x1) columns, or None if a word does not fit inside one"""
+    cells = [[] for _ in columns]
+    for word in line:
+        index = next((i for i, (x0, x1) in enumerate(columns) if x0 - 1 <= word[0] and word[2] <= x1 + 1), None)
+        if index is None:
+            return None
+        cells[index].append(word[4])
+    return [" ".join(cell) for cell in cells]
+
+def parse_amount(value):
+    """'1,234.50' as a float, None for an empty cell; raises ValueError for anything else"""
+    return float(value.replace(',', '')) if value else None
+
+# PDFs over these limits are rejected before any page is parsed (0 disables a limit)
+MAX_PDF_MB = float(os.getenv('INVOICE_MAX_FILE_MB', '50'))
+MAX_PDF_PAGES = int(os.getenv('INVOICE_MAX_PAGES', '1000'))
+
+class InvoiceRejected(ValueError):
+    """A PDF refused before extraction for exceeding MAX_PDF_MB or MAX_PDF_PAGES"""
+    reason = 'rejected'
+
+def open_checked_pdf(pdf_path):
+    """fitz document of pdf_path, raising InvoiceRejected when the file or its page count is over the limits"""
+    size_mb = os.path.getsize(pdf_path) / 2**20
+    if MAX_PDF_MB and size_mb > MAX_PDF_MB:
+        raise InvoiceRejected(f"{os.path.basename(pdf_path)} is {size_mb:.1f} MB, over the {MAX_PDF_MB:g} MB limit")
+    doc = fitz.open(pdf_path)
+    if MAX_PDF_PAGES and doc.page_count > MAX_PDF_PAGES:
+        page_count = doc.page_count
+        doc.close()
+        raise InvoiceRejected(f"{os.path.basename(pdf_path)} has {page_count} pages, over the {MAX_PDF_PAGES} page limit")
+    return doc
+
+def raise_if_out_of_memory(error):
+    """
+    Re-raise a failed allocation (MemoryError, or ENOMEM from e.g. Ghostscript) as MemoryError, so the
+    catch-all handlers below do not turn a PDF over the sandbox memory limit into a partial extraction
+    """
+    if isinstance(error, MemoryError):
+        raise error
+    if isinstance(error, OSError) and error.errno == errno.ENOMEM:
+        raise MemoryError(str(error)) from error
+
+# Processes extracting the invoices of one multi-invoice PDF (see InvoiceExtractor.process_pdf); 0 = one per CPU
+SPLIT_WORKERS = int(os.getenv('INVOICE_SPLIT_WORKERS', '0')) or os.cpu_count() or 1
+
+# Timed stages of process_invoice_tables; the last four are the product tiers, tried in order
+EXTRACTION_STAGES = ['text', 'fields', 'layout', 'find_tables', 'camelot', 'regex_products', 'total']
+PRODUCT_TIERS = ['layout', 'find_tables', 'camelot', 'regex', 'none']
 
 class InvoiceExtractor:
     def __init__(self):
         # Define key field patterns to extract from invoices
+        # (see search_field: every pattern starts with its label and spans a bounded number of characters)
         self.patterns = {
             'invoice_id': r'Tax Invoice No:\s*([\w\d-]+)',
             'invoice_date': r'Date:\s*(\d{1,2}\s+[A-Za-z]{3}\s+\d{4})',
             'customer_name': r'Customer Name:\s*([^\n]+)',
             'customer_id': r'Customer ID:\s*([^\n]+)',
-            'customer_address': r'Address:\s*([^\n]+(?:\n[^\n]+)*?)(?:United Arab Emirates|Tel:|Ref:|Customer Type:)',
-            'customer_trn': r'Customer.*?TRN:\s*(\d+)',
+            'customer_address': r'Address:\s*(.{0,400}?)\s*United Arab Emirates',
+            'customer_trn': r'Customer.{0,400}?TRN:\s*(\d+)',
             'customer_type': r'Customer Type:\s*([^\n]+)',
             'payment_status': r'Payment Status:\s*([^\n]+)',
             'due_date': r'Due Date:\s*(\d{1,2}\s+[A-Za-z]{3}\s+\d{4})',
-            'total_amount': r'Total with VAT.*?AED\s+([\d,]+\.\d{2})',
-            'vat_amount': r'5% Total VAT.*?AED\s+([\d,]+\.\d{2})',
-            'amount_excl_vat': r'Total Excluding VAT.*?AED\s+([\d,]+\.\d{2})',
+            'total_amount': r'Total with VAT.{0,200}?AED\s+([\d,]+\.\d{2})',
+            'vat_amount': r'5% Total VAT.{0,200}?AED\s+([\d,]+\.\d{2})',
+            'amount_excl_vat': r'Total Excluding VAT.{0,200}?AED\s+([\d,]+\.\d{2})',
             'profit': r'Profit:\s*AED\s+([\d,]+\.\d{2})',
             'profit_margin': r'Profit Margin:\s*([\d.]+)%',
             'cost_price': r'Cost Price:\s*AED\s+([\d,]+\.\d{2})',
@@ -37,13 +178,11 @@ class InvoiceExtractor:
         # Keywords to identify tables with product information
         self.table_identifiers = ['Item Description', 'QTY', 'Unit Rate', 'Amount']
         
-        # Output CSV fields
-        self.csv_fields = [
-            'invoice_id', 'invoice_date', 'customer_name', 'customer_id', 
-            'customer_location', 'customer_type', 'customer_trn', 'payment_status', 
-            'due_date', 'product', 'qty', 'unit_price', 'total', 'amount_excl_vat', 
-            'vat', 'profit', 'profit_margin', 'cost_price', 'days_to_payment'
-        ]
+        # Output CSV fields (shared with the read-time schema in invoice_schema)
+        self.csv_fields = list(INVOICE_COLUMNS)
+
+        # Product table geometry by layout fingerprint, learned from find_tables (oldest evicted first)
+        self.layouts = {}
 
     def extract_text_from_pdf(self, pdf_path):
         """Extract all text from PDF using PyMuPDF (fitz)"""
@@ -55,38 +194,43 @@ class InvoiceExtractor:
             doc.close()
             return text
         except Exception as e:
+            raise_if_out_of_memory(e)
             print(f"Error extracting text from {pdf_path}: {e}")
             return ""
 
-    def extract_fields(self, text):
-        """Extract fields from text using regex patterns"""
+    def extract_fields(self, text, stats=None):
+        """
+        Extract fields from text using regex patterns
+        When a stats dict is given, fields whose pattern timed out are added to stats['regex_timeouts']
+        """
         fields = {}
+        timeouts = []
 
-        # Updated pattern for customer_address to support multiline and flexible end
-        self.patterns['customer_address'] = r'Address:\s*((?:.|\n)*?)\s*United Arab Emirates'
-
-        # Extract fields using regex
+        # Extract fields using regex, near their labels and with a time limit
         for field, pattern in self.patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
+            match = search_field(pattern, text, field=field, timeouts=timeouts)
             if match:
                 fields[field] = match.group(1).strip()
             else:
                 fields[field] = None
+        if timeouts and stats is not None:
+            stats.setdefault('regex_timeouts', []).extend(timeouts)
 
         # Extract customer location from address
         fields['customer_location'] = "Unknown"
     
         if fields.get('customer_address'):
             for emirate in self.uae_emirates:
-                pattern = r'\b' + re.escape(emirate) + r'\b'
-                match = re.search(pattern, fields['customer_address'], re.IGNORECASE)
+                pattern = r'\b' + regex.escape(emirate) + r'\b'
+                match = regex.search(pattern, fields['customer_address'], regex.IGNORECASE)
                 if match:
                     fields['customer_location'] = match.group(0)
                     break
         
             # If no known emirate found, try "City, P.O. Box"
             if fields['customer_location'] == "Unknown":
-                location_match = re.search(r'([A-Za-z\s]+),\s*P\.O\.\s*Box', fields['customer_address'])
+                location_match = regex.search(r'([A-Za-z\s]+),\s*P\.O\.\s*Box', fields['customer_address'],
+                                              timeout=FIELD_PATTERN_TIMEOUT)
                 if location_match:
                     potential_location = location_match.group(1).strip()
                     if len(potential_location) > 3 and potential_location.lower() not in ["box", "p.o"]:
@@ -108,63 +252,200 @@ class InvoiceExtractor:
 
         return fields
 
-    def extract_product_table(self, pdf_path):
-        """Extract product information from tables in the PDF"""
+    def find_header_line(self, words):
+        """The first text line naming at least two product table columns, or None"""
+        identifiers = [id_text.lower() for id_text in self.table_identifiers]
+        for line in text_lines(words):
+            line_text = " ".join(word[4] for word in line).lower()
+            if sum(id_text in line_text for id_text in identifiers) >= 2:
+                return line
+        return None
+
+    def layout_fingerprint(self, page, header_line):
+        """Template key from the page size and the header words with their x positions (not y, which moves with the address)"""
+        signature = (round(page.rect.width), round(page.rect.height),
+                     tuple((word[4].lower(), round(word[0])) for word in header_line))
+        return hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+    def learn_layout(self, page, words, table, indices):
+        """Remember the column edges and row geometry of a product table found by find_tables"""
+        if LAYOUT_CACHE_SIZE <= 0:
+            return
+        header_line = self.find_header_line(words)
+        header_row = table.rows[0]
+        if header_line is None or None in header_row.cells:
+            return
+        baseline = max(word[3] for word in header_line)
+        if not header_row.bbox[1] <= baseline <= header_row.bbox[3]:
+            return  # The header text found is not this table's header row
+
+        heights = sorted(row.bbox[3] - row.bbox[1] for row in table.rows[1:]) or [header_row.bbox[3] - header_row.bbox[1]]
+        fingerprint = self.layout_fingerprint(page, header_line)
+        if fingerprint not in self.layouts and len(self.layouts) >= LAYOUT_CACHE_SIZE:
+            self.layouts.pop(next(iter(self.layouts)))
+        self.layouts[fingerprint] = {
+            'columns': [(cell[0], cell[2]) for cell in header_row.cells],
+            'header_depth': header_row.bbox[3] - baseline,
+            'row_height': heights[len(heights) // 2],
+            **indices
+        }
+
+    def read_layout_rows(self, words, header_line, layout):
+        """
+        Product rows below header_line, reading each word into the cached column under it
+        Returns None when a row does not validate (a cell that is not a number, an unlabelled row)
+        """
+        columns = layout['columns']
+        left, right = columns[0][0], columns[-1][1]
+        top = max(word[3] for word in header_line) + layout['header_depth']
+        body = [word for word in words if word[1] >= top - 1 and left <= (word[0] + word[2]) / 2 <= right]
+
+        rows = []
+        last_baseline = top
+        for line in text_lines(body):
+            # The table ends at the first gap of more than a row, or text running across the column edges
+            if line[0][3] - last_baseline > layout['row_height'] * 1.5:
+                break
+            cells = column_cells(line, columns)
+            if cells is None:
+                break
+            if not cells[layout['qty_idx']] and rows and cells[layout['desc_idx']]:
+                rows[-1][layout['desc_idx']] += "\n" + cells[layout['desc_idx']]  # Wrapped description
+            else:
+                rows.append(cells)
+            last_baseline = line[0][3]
+
+        products = []
+        for row in rows:
+            product = row[layout['desc_idx']]
+            if product.lower() in ["item description", "total"]:
+                continue
+            if not product:
+                return None
+            try:
+                qty = parse_amount(row[layout['qty_idx']])
+                unit_price = parse_amount(row[layout['price_idx']]) if layout['price_idx'] is not None else None
+                total = parse_amount(row[layout['total_idx']]) if layout['total_idx'] is not None else None
+            except ValueError:
+                return None
+            if qty is None:
+                return None
+            products.append({'product': product, 'qty': qty, 'unit_price': unit_price, 'total': total})
+        return products or None
+
+    def extract_known_layout(self, doc):
+        """
+        (product rows, 'hit') for a document whose table headers all match a cached layout, read without find_tables
+        ([], 'miss') for an unknown layout, ([], 'invalid') when the cached geometry does not validate on it
+        """
+        product_rows = []
+        for page in doc:
+            words = page.get_text("words")
+            header_line = self.find_header_line(words)
+            if header_line is None:
+                continue
+            layout = self.layouts.get(self.layout_fingerprint(page, header_line))
+            if layout is None:
+                return [], 'miss'
+            rows = self.read_layout_rows(words, header_line, layout)
+            if rows is None:
+                return [], 'invalid'
+            product_rows.extend(rows)
+        return product_rows, 'hit' if product_rows else 'miss'
+
+    def extract_product_table(self, pdf_path, stats=None, doc=None):
+        """
+        Extract product information from tables in the PDF
+        When a stats dict is given, the seconds spent in each tier are added to stats['stages'],
+        the tier that found the products is stored in stats['tier'] and the layout cache result
+        (hit, miss or invalid) in stats['layout']. doc is the PDF already opened by the caller, if any.
+        """
         product_rows = []
+        stages = {} if stats is None else stats.setdefault('stages', {})
+        tier = 'none'
+        layout_result = 'miss'
+        own_doc = doc is None
         
         try:
-            # Try with PyMuPDF first
-            doc = fitz.open(pdf_path)
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                tables = page.find_tables()
-                
-                for table in tables:
-                    table_data = table.extract()
-                    headers = [h.lower() if h else "" for h in table_data[0]]
+            if own_doc:
+                doc = fitz.open(pdf_path)
+
+            # Invoices of a known template are read by position, skipping table detection
+            if self.layouts:
+                started = time.perf_counter()
+                product_rows, layout_result = self.extract_known_layout(doc)
+                stages['layout'] = time.perf_counter() - started
+                if product_rows:
+                    tier = 'layout'
+                elif layout_result == 'invalid':
+                    print(f"Warning: cached table layout did not match {os.path.basename(pdf_path)}, detecting the table again")
+
+            # Then let PyMuPDF find the table (and learn its layout for the next invoice of this template)
+            if not product_rows:
+                started = time.perf_counter()
+                for page_num in range(len(doc)):
+                    page = doc[page_num]
+                    tables = page.find_tables()
+                    words = None
                     
-                    # Check if this is the product table
-                    if any(id_text.lower() in " ".join(headers).lower() for id_text in self.table_identifiers):
-                        # Find column indices
-                        desc_idx = next((i for i, h in enumerate(headers) if 'description' in h.lower()), None)
-                        qty_idx = next((i for i, h in enumerate(headers) if 'qty' in h.lower() or 'quantity' in h.lower()), None)
-                        price_idx = next((i for i, h in enumerate(headers) if 'rate' in h.lower() or 'price' in h.lower()), None)
-                        total_idx = next((i for i, h in enumerate(headers) if 'amount' in h.lower() and 'incl' in h.lower()), None)
-                        
-                        if not all([desc_idx is not None, qty_idx is not None]):
-                            continue
+                    for table in tables:
+                        table_data = table.extract()
+                        headers = [h.lower() if h else "" for h in table_data[0]]
                         
-                        # Process data rows
-                        for row in table_data[1:]:
-                            if len(row) > max(filter(None, [desc_idx, qty_idx, price_idx, total_idx])):
-                                product = row[desc_idx] if desc_idx is not None else ""
-                                
-                                # Skip headers or empty rows
-                                if not product or product.lower() in ["item description", "total", ""]:
-                                    continue
-                                
-                                qty = row[qty_idx] if qty_idx is not None else ""
-                                unit_price = row[price_idx] if price_idx is not None else ""
-                                total = row[total_idx] if total_idx is not None else ""
-                                
-                                # Clean numeric values
-                                try:
-                                    qty = float(qty.replace(',', '')) if qty else None
-                                    unit_price = float(unit_price.replace(',', '')) if unit_price else None
-                                    total = float(total.replace(',', '')) if total else None
-                                except Exception:
-                                    pass
-                                
-                                product_rows.append({
-                                    'product': product,
-                                    'qty': qty,
-                                    'unit_price': unit_price,
-                                    'total': total
-                                })
-            doc.close()
+                        # Check if this is the product table
+                        if any(id_text.lower() in " ".join(headers).lower() for id_text in self.table_identifiers):
+                            # Find column indices
+                            desc_idx = next((i for i, h in enumerate(headers) if 'description' in h.lower()), None)
+                            qty_idx = next((i for i, h in enumerate(headers) if 'qty' in h.lower() or 'quantity' in h.lower()), None)
+                            price_idx = next((i for i, h in enumerate(headers) if 'rate' in h.lower() or 'price' in h.lower()), None)
+                            total_idx = next((i for i, h in enumerate(headers) if 'amount' in h.lower() and 'incl' in h.lower()), None)
+                            
+                            if not all([desc_idx is not None, qty_idx is not None]):
+                                continue
+                            
+                            if words is None:
+                                words = page.get_text("words")
+                            self.learn_layout(page, words, table, {'desc_idx': desc_idx, 'qty_idx': qty_idx,
+                                                                   'price_idx': price_idx, 'total_idx': total_idx})
+                            
+                            # Process data rows
+                            for row in table_data[1:]:
+                                if len(row) > max(filter(None, [desc_idx, qty_idx, price_idx, total_idx])):
+                                    product = row[desc_idx] if desc_idx is not None else ""
+                                    
+                                    # Skip headers or empty rows
+                                    if not product or product.lower() in ["item description", "total", ""]:
+                                        continue
+                                    
+                                    qty = row[qty_idx] if qty_idx is not None else ""
+                                    unit_price = row[price_idx] if price_idx is not None else ""
+                                    total = row[total_idx] if total_idx is not None else ""
+                                    
+                                    # Clean numeric values
+                                    try:
+                                        qty = float(qty.replace(',', '')) if qty else None
+                                        unit_price = float(unit_price.replace(',', '')) if unit_price else None
+                                        total = float(total.replace(',', '')) if total else None
+                                    except Exception:
+                                        pass
+                                    
+                                    product_rows.append({
+                                        'product': product,
+                                        'qty': qty,
+                                        'unit_price': unit_price,
+                                        'total': total
+                                    })
+                stages['find_tables'] = time.perf_counter() - started
+                if product_rows:
+                    tier = 'find_tables'
+            if own_doc:
+                doc.close()
             
             # If no products found with PyMuPDF, try camelot
             if not product_rows:
+                started = time.perf_counter()
+                # Imported on first use: camelot loads OpenCV and Ghostscript, most of this module's import time
+                import camelot
                 tables = camelot.read_pdf(pdf_path, pages='1-end', flavor='stream')
                 for table in tables:
                     headers = [h.lower() for h in table.df.iloc[0]]
@@ -203,11 +484,18 @@ class InvoiceExtractor:
                                 'total': total
                             })
             
+                stages['camelot'] = time.perf_counter() - started
+                if product_rows:
+                    tier = 'camelot'
+            
             # If still no products found, try to extract using regex
             if not product_rows:
+                started = time.perf_counter()
                 text = self.extract_text_from_pdf(pdf_path)
-                product_pattern = r'(\d+)\s+([^\n]+?)\s+(?:UN|EA)\s+(\d+)\s+([\d,.]+)\s+([\d,.]+)'
-                matches = re.findall(product_pattern, text)
+                timeouts = []
+                matches = find_product_lines(text, timeouts=timeouts)
+                if timeouts and stats is not None:
+                    stats.setdefault('regex_timeouts', []).extend(timeouts)
                 
                 for match in matches:
                     try:
@@ -219,125 +507,439 @@ class InvoiceExtractor:
                         })
                     except Exception:
                         pass
+                stages['regex_products'] = time.perf_counter() - started
+                if product_rows:
+                    tier = 'regex'
                         
         except Exception as e:
+            raise_if_out_of_memory(e)
             print(f"Error extracting product table from {pdf_path}: {e}")
-            
+        
+        if stats is not None:
+            stats['tier'] = tier
+            stats['layout'] = layout_result
         return product_rows
 
-    def process_invoice(self, pdf_path):
-        """Process a single invoice PDF and extract all relevant data"""
-        results = []
+    def process_invoice_tables(self, pdf_path, stats=None, doc=None, text=None):
+        """
+        Process a single invoice PDF into its header (invoice-level fields, once)
+        and its line items (product, qty, unit_price, total with a 1-based line_no)
+        When a stats dict is given it is filled with the seconds spent in each stage
+        (stats['stages'], see EXTRACTION_STAGES), the product tier that succeeded and the line count
+        doc and text are the opened PDF and its text when the caller has them already (see process_pdf).
+        """
+        stages = {} if stats is None else stats.setdefault('stages', {})
+        started = time.perf_counter()
         
         # Extract text and fields
-        text = self.extract_text_from_pdf(pdf_path)
-        fields = self.extract_fields(text)
+        if text is None:
+            text = self.extract_text_from_pdf(pdf_path)
+        stages['text'] = time.perf_counter() - started
+        fields_started = time.perf_counter()
+        fields = self.extract_fields(text, stats)
+        stages['fields'] = time.perf_counter() - fields_started
         
         # Extract product information
-        products = self.extract_product_table(pdf_path)
+        products = self.extract_product_table(pdf_path, stats, doc=doc)
         
         # If no products found, create a dummy record to preserve invoice data
         if not products:
             products = [{'product': 'Unknown', 'qty': None, 'unit_price': None, 'total': fields.get('total_amount')}]
         
-        # Create a row for each product
-        for product in products:
-            row = {
-                'invoice_id': fields.get('invoice_id'),
-                'invoice_date': fields.get('invoice_date'),
-                'customer_name': fields.get('customer_name'),
-                'customer_id': fields.get('customer_id'),
-                'customer_location': fields.get('customer_location'),
-                'customer_type': fields.get('customer_type'),
-                'customer_trn': fields.get('customer_trn'),
-                'payment_status': fields.get('payment_status'),
-                'due_date': fields.get('due_date'),
-                'product': product.get('product'),
-                'qty': product.get('qty'),
-                'unit_price': product.get('unit_price'),
-                'total': product.get('total'),
-                'amount_excl_vat': fields.get('amount_excl_vat'),
-                'vat': fields.get('vat_amount'),
-                'profit': fields.get('profit'),
-                'profit_margin': fields.get('profit_margin'),
-                'cost_price': fields.get('cost_price')
-            }
+        header = {
+            'invoice_id': fields.get('invoice_id'),
+            'invoice_date': fields.get('invoice_date'),
+            'customer_name': fields.get('customer_name'),
+            'customer_id': fields.get('customer_id'),
+            'customer_location': fields.get('customer_location'),
+            'customer_type': fields.get('customer_type'),
+            'customer_trn': fields.get('customer_trn'),
+            'payment_status': fields.get('payment_status'),
+            'due_date': fields.get('due_date'),
+            'amount_excl_vat': fields.get('amount_excl_vat'),
+            'vat': fields.get('vat_amount'),
+            'profit': fields.get('profit'),
+            'profit_margin': fields.get('profit_margin'),
+            'cost_price': fields.get('cost_price')
+        }
+        
+        # Calculate days to payment (if paid)
+        if fields.get('payment_status') == 'Paid' and fields.get('invoice_date') and fields.get('due_date'):
+            try:
+                invoice_date = datetime.strptime(fields.get('invoice_date'), "%Y-%m-%d")
+                due_date = datetime.strptime(fields.get('due_date'), "%Y-%m-%d")
+                header['days_to_payment'] = (due_date - invoice_date).days
+            except Exception:
+                header['days_to_payment'] = None
+        else:
+            header['days_to_payment'] = None
+        
+        # Create a line item for each product
+        lines = []
+        for line_no, product in enumerate(products, start=1):
+            lines.append({
+                'invoice_id': header['invoice_id'],
+                'line_no': line_no,
+                **{field: product.get(field) for field in LINE_COLUMNS}
+            })
+        
+        stages['total'] = time.perf_counter() - started
+        if stats is not None:
+            stats['line_items'] = len(lines)
+        return header, lines
+
+    def process_invoice(self, pdf_path, stats=None):
+        """Process an invoice PDF into flat rows (the invoice-level fields repeated on each line item)"""
+        return invoice_rows(self.process_pdf(pdf_path, stats))
+
+    def split_invoice_pdf(self, pdf_path):
+        """
+        Page ranges [(first, last)] of the invoices in a PDF: a page with a Tax Invoice No. other than the
+        current invoice's starts a new one, pages without one (or repeating it) continue the current invoice
+        Raises InvoiceRejected for a PDF over the size or page limits (see open_checked_pdf)
+        """
+        doc = open_checked_pdf(pdf_path)
+        try:
+            return self.read_invoice_pages(doc)[0]
+        finally:
+            doc.close()
+
+    def read_invoice_pages(self, doc):
+        """Page ranges of the invoices in an open PDF (see split_invoice_pdf) and the text of each page"""
+        segments = []
+        texts = []
+        current_id = None
+        for page_num, page in enumerate(doc):
+            texts.append(page.get_text())
+            match = search_field(self.patterns['invoice_id'], texts[-1])
+            invoice_id = match.group(1).strip() if match else None
+            if not segments or (invoice_id and current_id and invoice_id != current_id):
+                segments.append((page_num, page_num))
+            else:
+                segments[-1] = (segments[-1][0], page_num)
+            current_id = invoice_id or current_id
+        return segments, texts
+
+    def extract_or_split_pdf(self, pdf_path, stats=None):
+        """
+        First step of process_pdf: extract a single-invoice PDF, reusing the document and page text read
+        to find the invoice boundaries, and return (invoices, None); or save the invoices of a multi-invoice
+        PDF as separate PDFs in a new temporary directory and return (None, segment_paths), leaving their
+        extraction (and the removal of that directory) to the caller.
+        Raises InvoiceRejected for a PDF over the size or page limits (see open_checked_pdf)
+        """
+        started = time.perf_counter()
+        doc = open_checked_pdf(pdf_path)
+        try:
+            segments, texts = self.read_invoice_pages(doc)
+            if len(segments) <= 1:
+                scan_seconds = time.perf_counter() - started
+                result = self.process_invoice_tables(pdf_path, stats, doc=doc, text="".join(texts))
+                if stats is not None:
+                    # The text was read while looking for invoice boundaries
+                    stats['stages']['text'] += scan_seconds
+                    stats['stages']['total'] += scan_seconds
+                return [result], None
             
-            # Calculate days to payment (if paid)
-            if fields.get('payment_status') == 'Paid' and fields.get('invoice_date') and fields.get('due_date'):
-                try:
-                    invoice_date = datetime.strptime(fields.get('invoice_date'), "%Y-%m-%d")
-                    due_date = datetime.strptime(fields.get('due_date'), "%Y-%m-%d")
-                    row['days_to_payment'] = (due_date - invoice_date).days
-                except Exception:
-                    row['days_to_payment'] = None
+            directory = tempfile.mkdtemp(prefix='invoice_split_')
+            try:
+                segment_paths = []
+                for i, (first, last) in enumerate(segments):
+                    segment = fitz.open()
+                    segment.insert_pdf(doc, from_page=first, to_page=last)
+                    segment_paths.append(os.path.join(directory, f"{i:05d}.pdf"))
+                    segment.save(segment_paths[-1])
+                    segment.close()
+            except BaseException:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise
+            print(f"Split {os.path.basename(pdf_path)} into {len(segments)} invoices")
+            return None, segment_paths
+        finally:
+            doc.close()
+
+    def process_pdf(self, pdf_path, stats=None, workers=None):
+        """
+        Process a PDF holding one or more invoices into a list of (header, lines), one per invoice
+        A single invoice goes through process_invoice_tables as it is (see extract_or_split_pdf).
+        The invoices of a multi-invoice PDF are saved as separate PDFs and extracted by up to `workers`
+        processes (SPLIT_WORKERS); stats then gets the split time in stats['stages'] and the stats of
+        each invoice in stats['segments'].
+        Raises InvoiceRejected for a PDF over the size or page limits (see open_checked_pdf)
+        """
+        started = time.perf_counter()
+        invoices, segment_paths = self.extract_or_split_pdf(pdf_path, stats)
+        if invoices is not None:
+            return invoices
+        
+        try:
+            split_seconds = time.perf_counter() - started
+            
+            workers = max(1, min(workers or SPLIT_WORKERS, len(segment_paths)))
+            if workers == 1:
+                results = []
+                for segment_path in segment_paths:
+                    segment_stats = {}
+                    results.append((*self.process_invoice_tables(segment_path, segment_stats), segment_stats))
             else:
-                row['days_to_payment'] = None
-                
-            results.append(row)
+                # Workers start with the table layouts learned so far (see extract_known_layout)
+                with ProcessPoolExecutor(max_workers=workers, initializer=init_segment_worker,
+                                         initargs=(self.layouts,)) as pool:
+                    results = list(pool.map(extract_segment, segment_paths,
+                                            chunksize=max(1, len(segment_paths) // (workers * 4))))
+        finally:
+            shutil.rmtree(os.path.dirname(segment_paths[0]), ignore_errors=True)
         
-        return results
+        if stats is not None:
+            stats['stages'] = {'split': split_seconds, 'total': time.perf_counter() - started}
+            stats['segments'] = [segment_stats for _, _, segment_stats in results]
+            stats['line_items'] = sum(len(lines) for _, lines, _ in results)
+        return [(header, lines) for header, lines, _ in results]
 
-    def process_all_invoices(self, directory):
-        """Process all PDF invoices in the specified directory"""
-        all_results = []
-        pdf_files = glob.glob(os.path.join(directory, "*.pdf"))
+    def iter_invoice_tables(self, directory):
+        """
+        Yield (pdf_path, header, lines) for each invoice in the directory's PDFs, one file at a time
+        A PDF that is rejected or cannot be read (e.g. corrupt or truncated) is logged and skipped
+        """
+        pdf_files = sorted(glob.glob(os.path.join(directory, "*.pdf")))
         
         total_files = len(pdf_files)
         print(f"Found {total_files} PDF files to process")
         
         for i, pdf_file in enumerate(pdf_files):
             print(f"Processing [{i+1}/{total_files}]: {os.path.basename(pdf_file)}")
-            invoice_data = self.process_invoice(pdf_file)
-            all_results.extend(invoice_data)
-            
-        return all_results
+            try:
+                invoices = self.process_pdf(pdf_file)
+            except InvoiceRejected as e:
+                print(f"Skipping {os.path.basename(pdf_file)}: {e}")
+                continue
+            except Exception as e:
+                raise_if_out_of_memory(e)
+                print(f"Error processing {os.path.basename(pdf_file)}, skipping it: {e}")
+                continue
+            for header, lines in invoices:
+                yield pdf_file, header, lines
+
+    def iter_invoices(self, directory, batch_size=None):
+        """
+        Yield the flat rows of every PDF invoice in the directory as they are extracted,
+        or lists of up to batch_size rows when batch_size is given
+        """
+        batch = []
+        for _, header, lines in self.iter_invoice_tables(directory):
+            for line in lines:
+                row = {**header, **{field: line[field] for field in LINE_COLUMNS}}
+                if batch_size is None:
+                    yield row
+                    continue
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def iter_invoice_frames(self, directory, chunk_rows=50_000):
+        """Yield typed DataFrames of at most chunk_rows flat rows each (see create_dataframe)"""
+        for batch in self.iter_invoices(directory, batch_size=chunk_rows):
+            yield self.create_dataframe(batch)
+
+    def process_all_invoices(self, directory):
+        """Process all PDF invoices in the specified directory"""
+        return list(self.iter_invoices(directory))
+
+    def write_invoices(self, directory, sink):
+        """Stream every PDF invoice in the directory into an invoice sink (see invoice_sinks)"""
+        with sink:
+            for _, header, lines in self.iter_invoice_tables(directory):
+                sink.write(header, lines)
+        print(f"Data saved to {sink.path} ({sink.invoices_written} invoices) and {sink.lines_path} ({sink.lines_written} line items)")
+        return sink
 
     def save_to_csv(self, data, output_path):
-        """Save extracted data to a CSV file"""
-        with open(output_path, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=self.csv_fields)
-            writer.writeheader()
-            for row in data:
-                # Ensure all fields are present
-                clean_row = {field: row.get(field, '') for field in self.csv_fields}
-                writer.writerow(clean_row)
+        """
+        Save extracted invoices as the invoice header table (output_path) and the
+        line item table next to it (see invoice_schema.line_items_path)
+        data may be any iterable of (header, lines) pairs (e.g. process_pdf) or of flat rows
+        (e.g. iter_invoices, see invoice_tables), streamed to disk as they arrive
+        """
+        with CsvInvoiceSink(output_path) as sink:
+            for header, lines in invoice_tables(data):
+                sink.write(header, lines)
         
-        print(f"Data saved to {output_path}")
+        print(f"Data saved to {output_path} ({sink.invoices_written} invoices) and {sink.lines_path} ({sink.lines_written} line items)")
         return output_path
 
+    def backfill(self, directory, output_path, checkpoint_path=None, resume=True, checkpoint_every=50,
+                 report_every=100):
+        """
+        Extract every PDF in a directory, streaming each invoice to the header CSV (output_path) and
+        line item CSV as soon as it is processed, so memory stays flat however many files there are.
+        Progress (file hashes done, output byte offsets) is checkpointed every checkpoint_every files;
+        a resumed run truncates the outputs to the last checkpoint and skips the files it lists as done;
+        files that failed are listed separately and extracted again.
+        Returns the run statistics.
+        """
+        checkpoint_path = checkpoint_path or f"{output_path}.checkpoint.json"
+        pdf_files = sorted(glob.glob(os.path.join(directory, "*.pdf")))
+        
+        checkpoint = None
+        if resume and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+            print(f"Resuming backfill: {checkpoint['files_done']} files / {checkpoint['rows_written']} rows already written")
+        else:
+            checkpoint = {'input': directory, 'output': output_path, 'lines_output': line_items_path(output_path),
+                          'processed': {}, 'failed': {}, 'offsets': None, 'files_done': 0, 'rows_written': 0}
+        
+        with CsvInvoiceSink(output_path, offsets=checkpoint['offsets']) as sink:
+            def save_checkpoint():
+                # Rows written after the last checkpoint are dropped on resume and those files processed again
+                checkpoint['offsets'] = sink.checkpoint()
+                tmp_path = f"{checkpoint_path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(checkpoint, f)
+                os.replace(tmp_path, checkpoint_path)
+            
+            save_checkpoint()
+            total_files = len(pdf_files)
+            started = time.perf_counter()
+            run_files = run_rows = skipped = since_checkpoint = 0
+            
+            for i, pdf_file in enumerate(pdf_files, start=1):
+                filename = os.path.basename(pdf_file)
+                with open(pdf_file, 'rb') as f:
+                    file_hash = hashlib.md5(f.read()).hexdigest()
+                if checkpoint['processed'].get(filename) == file_hash:
+                    skipped += 1
+                    continue
+                
+                try:
+                    for header, lines in self.process_pdf(pdf_file):
+                        if sink.write(header, lines):
+                            run_rows += len(lines)
+                            checkpoint['rows_written'] += len(lines)
+                    checkpoint['failed'].pop(filename, None)
+                    # Only files that succeeded are skipped on resume; failed ones are retried
+                    checkpoint['processed'][filename] = file_hash
+                    checkpoint['files_done'] += 1
+                except Exception as e:
+                    print(f"Error processing {filename}: {e}")
+                    checkpoint['failed'][filename] = str(e)
+                    checkpoint['processed'].pop(filename, None)
+                run_files += 1
+                since_checkpoint += 1
+                
+                if since_checkpoint >= checkpoint_every:
+                    save_checkpoint()
+                    since_checkpoint = 0
+                
+                if run_files % report_every == 0 or i == total_files:
+                    elapsed = max(time.perf_counter() - started, 1e-9)
+                    files_per_second = run_files / elapsed
+                    remaining = total_files - i
+                    eta = remaining / files_per_second if files_per_second > 0 else float('inf')
+                    print(f"[{i}/{total_files}] {files_per_second:.1f} files/s, {run_rows / elapsed:.1f} rows/s, "
+                          f"ETA {time.strftime('%H:%M:%S', time.gmtime(eta)) if eta != float('inf') else 'unknown'}")
+            
+            save_checkpoint()
+        
+        elapsed = time.perf_counter() - started
+        stats = {
+            'files_total': total_files,
+            'files_processed': run_files,
+            'files_skipped': skipped,
+            'files_failed': len(checkpoint['failed']),
+            'rows_written': run_rows,
+            'seconds': round(elapsed, 2),
+            'files_per_second': round(run_files / elapsed, 2) if elapsed > 0 else None,
+            'rows_per_second': round(run_rows / elapsed, 2) if elapsed > 0 else None
+        }
+        print(f"Backfill complete: {stats}")
+        return stats
+
     def create_dataframe(self, data):
         """Create a pandas DataFrame from the extracted data"""
         df = pd.DataFrame(data)
         
-        # Convert date columns to datetime
-        for date_col in ['invoice_date', 'due_date']:
-            if date_col in df.columns:
-                df[date_col] = pd.to_datetime(df[date_col], errors='coerce')
-        
-        # Convert numeric columns
-        numeric_cols = ['qty', 'unit_price', 'total', 'amount_excl_vat', 'vat', 
-                        'profit', 'profit_margin', 'cost_price', 'days_to_payment']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        return df
+        # Convert date and numeric columns
+        return normalize_invoice_frame(df, derive_columns=False, fill_missing=False)
+
+def invoice_rows(invoices):
+    """Flat rows (the invoice-level fields repeated on each line item) of [(header, lines)]"""
+    return [{**header, **{field: line[field] for field in LINE_COLUMNS}} for header, lines in invoices for line in lines]
+
+def invoice_tables(data):
+    """
+    (header, lines) pairs of an iterable of pairs or of flat rows; consecutive flat rows with the same
+    invoice_id form one invoice, and a row without an invoice_id (which cannot be told apart from its
+    neighbours) is an invoice of its own
+    """
+    data = iter(data)
+    first = next(data, None)
+    if first is None:
+        return
+    data = itertools.chain([first], data)
+    if isinstance(first, tuple):
+        yield from data
+        return
+    
+    rows_without_id = itertools.count()
+    def invoice_key(row):
+        invoice_id = row.get('invoice_id')
+        return invoice_id if invoice_id is not None else (None, next(rows_without_id))
+    
+    for _, rows in itertools.groupby(data, key=invoice_key):
+        rows = list(rows)
+        header = {field: rows[0].get(field) for field in INVOICE_HEADER_COLUMNS}
+        lines = [{'invoice_id': header.get('invoice_id'), 'line_no': line_no,
+                  **{field: row.get(field) for field in LINE_COLUMNS}}
+                 for line_no, row in enumerate(rows, start=1)]
+        yield header, lines
+
+_segment_extractor = None
+
+def init_segment_worker(layouts):
+    """Process pool initializer of process_pdf: one extractor per worker, seeded with the parent's layouts"""
+    global _segment_extractor
+    _segment_extractor = InvoiceExtractor()
+    _segment_extractor.layouts.update(layouts)
+
+def extract_segment(segment_path):
+    """Worker body of process_pdf: (header, lines, stats) of one single-invoice PDF"""
+    stats = {}
+    header, lines = _segment_extractor.process_invoice_tables(segment_path, stats)
+    return header, lines, stats
+
+def backfill_main(argv):
+    """Command line entry point of the resumable backfill"""
+    parser = argparse.ArgumentParser(
+        prog="invoice_extractor.py backfill",
+        description="Extract a folder of invoice PDFs into CSV, resumably and in constant memory"
+    )
+    parser.add_argument('--input', default="invoices", help="Directory containing invoice PDFs")
+    parser.add_argument('--output', default="invoice_data.csv", help="Invoice header CSV (line items go next to it)")
+    parser.add_argument('--checkpoint', default=None, help="Checkpoint file (default: <output>.checkpoint.json)")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint and start over")
+    parser.add_argument('--checkpoint-every', type=int, default=50, help="Files between checkpoints")
+    parser.add_argument('--report-every', type=int, default=100, help="Files between progress reports")
+    args = parser.parse_args(argv)
+    
+    extractor = InvoiceExtractor()
+    return extractor.backfill(args.input, args.output, checkpoint_path=args.checkpoint, resume=not args.restart,
+                              checkpoint_every=args.checkpoint_every, report_every=args.report_every)
 
 def main():
     # Set the directory containing invoice PDFs
     invoice_dir = "invoices"
     output_csv = "invoice_data.csv"
     
-    # Create extractor and process invoices
+    # Create extractor and stream the invoices to CSV as they are processed
     extractor = InvoiceExtractor()
-    all_data = extractor.process_all_invoices(invoice_dir)
-    
-    # Save to CSV
-    extractor.save_to_csv(all_data, output_csv)
+    extractor.write_invoices(invoice_dir, CsvInvoiceSink(output_csv))
     
-    # Create DataFrame
-    df = extractor.create_dataframe(all_data)
+    # Load the typed DataFrame back from the saved tables
+    df = read_invoice_rows(output_csv)
     
     print(f"Successfully processed {len(df)} invoice line items")
     print(f"Unique invoices: {df['invoice_id'].nunique()}")
@@ -353,4 +955,7 @@ def main():
     return df
 
 if __name__ == "__main__":
-    df = main()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+        backfill_main(sys.argv[2:])
+    else:
+        df = main()
\ No newline at end of file
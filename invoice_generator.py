@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# invoice_generator.py
+"""
+Render synthetic tax invoice PDFs in the layout InvoiceExtractor expects
+Run `python invoice_generator.py --count 100 --output synthetic_invoices` to write a folder of them.
+
+Layout variants (each exercises a different tier of extract_product_table):
+- table:     ruled product table, found by PyMuPDF find_tables
+- multipage: ruled product table long enough to continue over several pages
+- stream:    aligned columns without ruling lines, left to camelot's stream parser
+- text:      one text line per item, only matched by the regex fallback
+"""
+
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import fitz
+
+VARIANTS = ['table', 'multipage', 'stream', 'text']
+
+PRODUCTS = ['Sidr Honey', 'Manuka Honey', 'Clover Honey', 'Forest Honey', 'Royal Jelly Honey',
+            'Mountain Honey', 'Acacia Honey', 'Wildflower Honey']
+PACK_SIZES = ['90g', '100g', '350g', '450g', '800g', '850g', '900g']
+CUSTOMER_TYPES = ['Hotel', 'Supermarket', 'Restaurant', 'Distributor', 'Direct Consumer', 'Retail Store']
+EMIRATES = ['Abu Dhabi', 'Dubai', 'Sharjah', 'Ajman', 'Umm Al Quwain', 'Fujairah', 'Ras Al Khaimah']
+OTHER_CITIES = ['Al Ain', 'Khor Fakkan', 'Dibba', 'Ruwais']
+STREETS = ['Al Wasl Road', 'Corniche Street', 'Sheikh Zayed Road', 'King Faisal Street', 'Al Ittihad Road']
+
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size('a4')
+MARGIN = 40
+FONT_SIZE = 9
+ROW_HEIGHT = 16
+
+# Ruled table: (header, x offset, width); stream layout keeps only the columns camelot's tier reads
+TABLE_COLUMNS = [('Sl', 0, 25), ('Item Description', 25, 185), ('Unit', 210, 35), ('QTY', 245, 40),
+                 ('Unit Rate', 285, 60), ('Amount Excl VAT', 345, 80), ('VAT', 425, 45),
+                 ('Amount Incl VAT', 470, 75)]
+STREAM_COLUMNS = [('Item Description', 0), ('QTY', 230), ('Unit Rate', 310), ('Amount Incl VAT', 410)]
+
+
+def _money(value: float) -> str:
+    return f"{value:,.2f}"
+
+
+def make_invoice(rng: random.Random, number: int, variant: Optional[str] = None) -> Dict:
+    """Random but internally consistent invoice data (line totals, VAT and profit add up)"""
+    variant = variant or rng.choice(VARIANTS)
+    line_count = rng.randint(25, 70) if variant == 'multipage' else rng.randint(1, 8)
+
+    lines = []
+    for _ in range(line_count):
+        qty = rng.randint(1, 40)
+        unit_price = round(rng.uniform(15, 450), 2)
+        amount = round(qty * unit_price, 2)
+        vat = round(amount * 0.05, 2)
+        lines.append({
+            'product': f"{rng.choice(PRODUCTS)} {rng.choice(PACK_SIZES)}",
+            'qty': qty, 'unit_price': unit_price,
+            'amount_excl_vat': amount, 'vat': vat, 'total': round(amount + vat, 2)
+        })
+
+    amount_excl_vat = round(sum(line['amount_excl_vat'] for line in lines), 2)
+    vat = round(sum(line['vat'] for line in lines), 2)
+    cost_price = round(amount_excl_vat * rng.uniform(0.55, 0.85), 2)
+    invoice_date = datetime(2023, 1, 1) + timedelta(days=rng.randint(0, 729))
+    customer_number = rng.randint(100, 999)
+
+    # Address variants: an emirate, a non-emirate "City, P.O. Box" line, or no recognisable location
+    emirate = rng.choice(EMIRATES)
+    address_kind = rng.choice(['emirate', 'emirate', 'po_box', 'unknown'])
+    if address_kind == 'emirate':
+        address = [f"Shop {rng.randint(1, 99)}, {rng.choice(STREETS)}", emirate]
+    elif address_kind == 'po_box':
+        address = [f"Warehouse {rng.randint(1, 40)}", f"{rng.choice(OTHER_CITIES)}, P.O. Box {rng.randint(1000, 99999)}"]
+    else:
+        address = [f"Plot {rng.randint(1, 500)}, Industrial Area {rng.randint(1, 18)}"]
+
+    return {
+        'variant': variant,
+        'invoice_id': f"SINU{rng.randint(1000, 9999)}-{number:07d}",
+        'invoice_date': invoice_date,
+        'due_date': invoice_date + timedelta(days=rng.choice([0, 15, 30, 60, 90])),
+        'customer_name': f"Company {chr(65 + customer_number % 26)}{customer_number}",
+        'customer_id': f"{chr(65 + customer_number % 26)}{customer_number}",
+        'customer_trn': f"{rng.randint(100000000, 999999999)}",
+        'customer_type': rng.choice(CUSTOMER_TYPES),
+        'payment_status': 'Paid' if rng.random() < 0.9 else 'Unpaid',
+        'address': address,
+        'lines': lines,
+        'amount_excl_vat': amount_excl_vat,
+        'vat': vat,
+        'total': round(amount_excl_vat + vat, 2),
+        'cost_price': cost_price,
+        'profit': round(amount_excl_vat - cost_price, 2),
+        'profit_margin': round((amount_excl_vat - cost_price) / amount_excl_vat * 100, 2)
+    }
+
+
+class _PageWriter:
+    """
+    Writes text lines top to bottom, starting a new page when the current one is full
+    Drawing goes through one Shape per page (committed once), as each page.insert_text call rewrites the page contents
+    """
+
+    def __init__(self, doc: fitz.Document):
+        self.doc = doc
+        self.shape = None
+        self.new_page()
+
+    def new_page(self):
+        self.finish()
+        self.page = self.doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        self.shape = self.page.new_shape()
+        self.y = MARGIN + FONT_SIZE
+
+    def finish(self):
+        if self.shape is not None:
+            self.shape.commit()
+            self.shape = None
+
+    def room_for(self, height: float) -> bool:
+        return self.y + height <= PAGE_HEIGHT - MARGIN
+
+    def text(self, text: str, x: float = MARGIN, size: float = FONT_SIZE, advance: bool = True):
+        if not self.room_for(ROW_HEIGHT):
+            self.new_page()
+        self.shape.insert_text((x, self.y), text, fontsize=size)
+        if advance:
+            self.y += ROW_HEIGHT
+
+    def gap(self, height: float = ROW_HEIGHT / 2):
+        self.y += height
+
+
+def _line_cells(index: int, line: Dict) -> List[str]:
+    return [str(index), line['product'], 'EA', str(line['qty']), _money(line['unit_price']),
+            _money(line['amount_excl_vat']), _money(line['vat']), _money(line['total'])]
+
+
+def _ruled_row(writer: _PageWriter, cells: List[str]):
+    top = writer.y - FONT_SIZE - 3
+    for (_, offset, width), cell in zip(TABLE_COLUMNS, cells):
+        rect = fitz.Rect(MARGIN + offset, top, MARGIN + offset + width, top + ROW_HEIGHT)
+        writer.shape.draw_rect(rect)
+        writer.shape.insert_text((rect.x0 + 3, writer.y), cell, fontsize=FONT_SIZE - 1)
+    writer.shape.finish(color=(0, 0, 0), width=0.5)
+    writer.y += ROW_HEIGHT
+
+
+def _draw_ruled_table(writer: _PageWriter, lines: List[Dict]):
+    """Ruled product table; the header row is repeated at the top of every continuation page"""
+    headers = [header for header, _, _ in TABLE_COLUMNS]
+    _ruled_row(writer, headers)
+    for index, line in enumerate(lines, start=1):
+        if not writer.room_for(ROW_HEIGHT):
+            writer.new_page()
+            _ruled_row(writer, headers)
+        _ruled_row(writer, _line_cells(index, line))
+
+
+def _draw_stream_table(writer: _PageWriter, lines: List[Dict]):
+    """Whitespace-aligned columns with no ruling lines"""
+    for header, offset in STREAM_COLUMNS:
+        writer.text(header, MARGIN + offset, advance=False)
+    writer.gap(ROW_HEIGHT)
+    for line in lines:
+        cells = [line['product'], str(line['qty']), _money(line['unit_price']), _money(line['total'])]
+        for cell, (_, offset) in zip(cells, STREAM_COLUMNS):
+            writer.text(cell, MARGIN + offset, advance=False)
+        writer.gap(ROW_HEIGHT)
+
+
+def _draw_text_lines(writer: _PageWriter, lines: List[Dict]):
+    """'<sl> <product> EA <qty> <unit rate> <amount>' lines, the format of the regex fallback"""
+    writer.text("Items supplied")
+    for index, line in enumerate(lines, start=1):
+        writer.text(f"{index} {line['product']} EA {line['qty']} {line['unit_price']:.2f} {line['total']:.2f}")
+
+
+def _write_totals(writer: _PageWriter, invoice: Dict):
+    writer.gap(ROW_HEIGHT)
+    writer.text(f"Total Excluding VAT: AED {_money(invoice['amount_excl_vat'])}")
+    writer.text(f"5% Total VAT: AED {_money(invoice['vat'])}")
+    writer.text(f"Total with VAT: AED {_money(invoice['total'])}")
+    writer.gap()
+    writer.text(f"Cost Price: AED {_money(invoice['cost_price'])}")
+    writer.text(f"Profit: AED {_money(invoice['profit'])}")
+    writer.text(f"Profit Margin: {invoice['profit_margin']:.2f}%")
+
+
+def render_invoice(path: str, invoice: Dict) -> str:
+    """Render one invoice (see make_invoice) as a PDF at path"""
+    doc = fitz.open()
+    writer = _PageWriter(doc)
+
+    writer.text("Golden Hive Trading LLC", size=14)
+    writer.text("TRN: 100293847500003")
+    writer.text("TAX INVOICE", size=12)
+    writer.gap()
+    writer.text(f"Tax Invoice No: {invoice['invoice_id']}")
+    writer.text(f"Date: {invoice['invoice_date']:%d %b %Y}")
+    writer.text(f"Due Date: {invoice['due_date']:%d %b %Y}")
+    writer.gap()
+    writer.text(f"Customer Name: {invoice['customer_name']}")
+    writer.text(f"Customer ID: {invoice['customer_id']}")
+    writer.text(f"Customer TRN: {invoice['customer_trn']}")
+    writer.text(f"Address: {invoice['address'][0]}")
+    for address_line in invoice['address'][1:]:
+        writer.text(address_line, MARGIN + 40)
+    writer.text("United Arab Emirates", MARGIN + 40)
+    writer.text(f"Customer Type: {invoice['customer_type']}")
+    writer.text(f"Payment Status: {invoice['payment_status']}")
+    writer.gap(ROW_HEIGHT)
+
+    if invoice['variant'] in ('table', 'multipage'):
+        _draw_ruled_table(writer, invoice['lines'])
+        _write_totals(writer, invoice)
+    elif invoice['variant'] == 'stream':
+        # Without ruling lines camelot reads the whole page as one table, so the items get a page of their own
+        _write_totals(writer, invoice)
+        writer.new_page()
+        _draw_stream_table(writer, invoice['lines'])
+    else:
+        _draw_text_lines(writer, invoice['lines'])
+        _write_totals(writer, invoice)
+
+    writer.finish()
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def generate_invoices(directory: str, count: int, seed: int = 0, variants: Optional[List[str]] = None) -> List[str]:
+    """Write count invoices to directory (same seed -> same files) and return their paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for number in range(count):
+        invoice = make_invoice(rng, number, rng.choice(variants) if variants else None)
+        paths.append(render_invoice(os.path.join(directory, f"{invoice['invoice_id']}.pdf"), invoice))
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100)
+    parser.add_argument('--output', default='synthetic_invoices')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=None,
+                        help="Only generate these layouts (default: a random mix of all)")
+    args = parser.parse_args()
+
+    paths = generate_invoices(args.output, args.count, args.seed, args.variants)
+    print(f"✅ Wrote {len(paths)} invoices to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
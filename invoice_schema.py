@@ -0,0 +1,236 @@
+# invoice_schema.py
+
+import csv
+import io
+import os
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+
+# Columns written by InvoiceExtractor for every invoice line item
+INVOICE_COLUMNS = [
+    'invoice_id', 'invoice_date', 'customer_name', 'customer_id',
+    'customer_location', 'customer_type', 'customer_trn', 'payment_status',
+    'due_date', 'product', 'qty', 'unit_price', 'total', 'amount_excl_vat',
+    'vat', 'profit', 'profit_margin', 'cost_price', 'days_to_payment'
+]
+DATE_COLUMNS = ['invoice_date', 'due_date']
+NUMERIC_COLUMNS = ['qty', 'unit_price', 'total', 'amount_excl_vat', 'vat',
+                   'profit', 'profit_margin', 'cost_price', 'days_to_payment']
+
+# Read-time dtypes. Low-cardinality dimensions are categoricals; identifiers stay strings
+# (customer_trn would otherwise be inferred as an integer and lose leading zeros).
+# Quantities, percentages and day counts fit float32 in compact reads (the dashboard); other readers keep
+# float64 so values round-trip unchanged. AED amounts are always float64 so sums stay exact to the fil.
+CATEGORICAL_COLUMNS = ['customer_location', 'customer_type', 'payment_status', 'product']
+STRING_COLUMNS = ['invoice_id', 'customer_name', 'customer_id', 'customer_trn']
+FLOAT32_COLUMNS = ['qty', 'profit_margin', 'days_to_payment']
+FLOAT64_COLUMNS = ['unit_price', 'total', 'amount_excl_vat', 'vat', 'profit', 'cost_price']
+DATE_FORMAT = '%Y-%m-%d'
+
+# Fields that describe the whole invoice (repeated on each of its line items in the flat CSV)
+# and fields that belong to a single product line
+LINE_COLUMNS = ['product', 'qty', 'unit_price', 'total']
+HEADER_COLUMNS = [col for col in INVOICE_COLUMNS if col not in LINE_COLUMNS] + ['filename', 'payment_date']
+
+# Normalised storage model: one header row per invoice_id, and line items referencing it
+INVOICE_HEADER_COLUMNS = [col for col in INVOICE_COLUMNS if col not in LINE_COLUMNS]
+LINE_ITEM_COLUMNS = ['invoice_id', 'line_no'] + LINE_COLUMNS
+
+
+def _to_datetime(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, errors='coerce')
+
+
+def _to_numeric(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return series
+    return pd.to_numeric(series, errors='coerce')
+
+
+def normalize_invoice_frame(df: pd.DataFrame, derive_columns: bool = True, fill_missing: bool = True,
+                            extra_date_columns: Optional[list] = None,
+                            expected_columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Vectorised typing stage shared by every reader of invoice rows
+    - date columns become datetime64 and numeric columns become floats (invalid values -> NaT/NaN)
+    - derive_columns adds payment_date = invoice_date + days_to_payment
+    - fill_missing adds absent expected_columns, INVOICE_COLUMNS by default (0 for numeric, 'Unknown' otherwise)
+    Columns that already have the target dtype are left untouched, so the stage is cheap to re-apply.
+    """
+    for col in DATE_COLUMNS + list(extra_date_columns or []):
+        if col in df.columns:
+            df[col] = _to_datetime(df[col])
+
+    for col in NUMERIC_COLUMNS:
+        if col in df.columns:
+            df[col] = _to_numeric(df[col])
+
+    # Calculate payment date based on invoice_date and days_to_payment if available
+    if derive_columns and 'days_to_payment' in df.columns and 'invoice_date' in df.columns \
+            and df['days_to_payment'].notna().any():
+        df['payment_date'] = df['invoice_date'] + pd.to_timedelta(df['days_to_payment'], unit='D')
+
+    # Add any missing expected columns
+    if fill_missing:
+        for col in expected_columns or INVOICE_COLUMNS:
+            if col not in df.columns:
+                df[col] = 0 if col in NUMERIC_COLUMNS else 'Unknown'
+
+    return df
+
+
+def csv_dtypes(columns: Optional[List[str]] = None, compact: bool = False) -> Dict[str, str]:
+    """Explicit read_csv dtypes for the given invoice columns (all INVOICE_COLUMNS by default)"""
+    dtypes = {}
+    for col in columns or INVOICE_COLUMNS:
+        if col in CATEGORICAL_COLUMNS:
+            dtypes[col] = 'category'
+        elif col in STRING_COLUMNS:
+            dtypes[col] = 'str'
+        elif col in FLOAT32_COLUMNS:
+            dtypes[col] = 'float32' if compact else 'float64'
+        elif col in FLOAT64_COLUMNS:
+            dtypes[col] = 'float64'
+    return dtypes
+
+
+def _header_columns(source) -> List[str]:
+    """Read only the header row of a CSV path or text buffer"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8') as f:
+            return next(csv.reader(f), [])
+    position = source.tell()
+    header = next(csv.reader(io.StringIO(source.readline())), [])
+    source.seek(position)
+    return header
+
+
+def read_invoice_csv(source, usecols: Optional[List[str]] = None, compact: bool = False) -> pd.DataFrame:
+    """
+    Read invoice rows with the typed schema applied at parse time
+    source is a path or a seekable text buffer; usecols restricts the columns that are parsed
+    (columns outside the schema, e.g. filename, are kept as strings when requested or when usecols is None).
+    compact reads FLOAT32_COLUMNS as float32, for in-memory analytics rather than rows that are written back.
+    Falls back to string parsing plus normalize_invoice_frame if a numeric column holds malformed values.
+    """
+    header = _header_columns(source)
+    columns = [col for col in header if usecols is None or col in usecols]
+    parse_dates = [col for col in DATE_COLUMNS if col in columns]
+    position = None if isinstance(source, (str, os.PathLike)) else source.tell()
+
+    try:
+        return pd.read_csv(
+            source,
+            usecols=columns,
+            dtype=csv_dtypes([col for col in columns if col in INVOICE_COLUMNS], compact),
+            parse_dates=parse_dates,
+            date_format=DATE_FORMAT
+        )
+    except (ValueError, TypeError) as e:
+        print(f"Warning: typed CSV parse failed ({e}), falling back to coercion")
+        if position is not None:
+            source.seek(position)
+        df = pd.read_csv(source, usecols=columns, dtype=str)
+        df = normalize_invoice_frame(df, derive_columns=False, fill_missing=False)
+        return df.astype(csv_dtypes([col for col in columns if col in INVOICE_COLUMNS], compact))
+
+
+def memory_usage_report(df: pd.DataFrame) -> pd.DataFrame:
+    """Per-column dtype, total bytes and bytes per row (deep, i.e. including Python string objects)"""
+    usage = df.memory_usage(deep=True, index=False)
+    rows = max(len(df), 1)
+    report = pd.DataFrame({
+        'dtype': df.dtypes.astype(str),
+        'bytes': usage,
+        'bytes_per_row': (usage / rows).round(1)
+    })
+    report.loc['TOTAL'] = ['', usage.sum(), round(usage.sum() / rows, 1)]
+    return report
+
+
+def line_items_path(path: str) -> str:
+    """Path of the line item table stored next to an invoice header CSV (invoice_data.csv -> invoice_data_lines.csv)"""
+    root, ext = os.path.splitext(path)
+    return f"{root}_lines{ext or '.csv'}"
+
+
+def split_invoice_rows(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Split flat line item rows into (invoices, line_items)
+    Invoice-level fields are kept once per invoice_id (the last occurrence wins, so a re-extracted
+    invoice replaces the earlier one); line items keep invoice_id and a 1-based line_no.
+    Rows without an invoice_id are keyed by their filename when one is present.
+    """
+    df = df.reset_index(drop=True)
+    if 'invoice_id' not in df.columns:
+        df['invoice_id'] = None
+    if 'filename' in df.columns:
+        df['invoice_id'] = df['invoice_id'].where(df['invoice_id'].notna(), df['filename'])
+
+    header_columns = [col for col in HEADER_COLUMNS if col in df.columns and col != 'payment_date']
+    line_columns = [col for col in df.columns if col not in HEADER_COLUMNS]
+
+    # A re-extracted invoice appears as a later run of rows with the same invoice_id: keep only the
+    # last run so its header and line items replace the earlier ones instead of being merged with them
+    key = df['invoice_id']
+    run = (key != key.shift()).cumsum()
+    keep = (run == run.groupby(key, dropna=False).transform('max')) | key.isna()
+
+    invoices = df.loc[keep, header_columns].drop_duplicates('invoice_id', keep='last')
+    lines = df.loc[keep, ['invoice_id'] + line_columns].reset_index(drop=True)
+    lines.insert(1, 'line_no', lines.groupby('invoice_id', dropna=False, sort=False).cumcount() + 1)
+    return invoices.reset_index(drop=True), lines
+
+
+def join_invoice_tables(invoices: pd.DataFrame, lines: pd.DataFrame) -> pd.DataFrame:
+    """Flat line item rows (INVOICE_COLUMNS order) from the invoice header and line item tables"""
+    lines = lines.drop(columns=['line_no'], errors='ignore')
+    if 'invoice_id' not in lines.columns:
+        lines = pd.DataFrame(columns=['invoice_id'] + LINE_COLUMNS)
+    flat = invoices.merge(lines, on='invoice_id', how='left', sort=False)
+    ordered = [col for col in INVOICE_COLUMNS if col in flat.columns]
+    return flat[ordered + [col for col in flat.columns if col not in ordered]]
+
+
+def read_invoice_tables(source, lines_source=None, usecols: Optional[List[str]] = None,
+                        compact: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Read the (invoices, line_items) tables with the typed schema
+    For a path source the line item table defaults to line_items_path(source) when that file exists.
+    A legacy flat CSV (one row per line item with every invoice field repeated) is split on read.
+    """
+    wanted = None if usecols is None else list(dict.fromkeys(['invoice_id'] + list(usecols)))
+    if lines_source is None and isinstance(source, (str, os.PathLike)) and os.path.exists(line_items_path(source)):
+        lines_source = line_items_path(source)
+
+    invoices = read_invoice_csv(source, usecols=wanted, compact=compact)
+    if lines_source is None:
+        if any(col in invoices.columns for col in LINE_COLUMNS):
+            return split_invoice_rows(invoices)
+        return invoices, pd.DataFrame(columns=LINE_ITEM_COLUMNS)
+
+    line_usecols = None if wanted is None else ['invoice_id', 'line_no'] + [col for col in wanted if col in LINE_COLUMNS]
+    return invoices, read_invoice_csv(lines_source, usecols=line_usecols, compact=compact)
+
+
+def read_invoice_rows(source, lines_source=None, usecols: Optional[List[str]] = None,
+                      compact: bool = False) -> pd.DataFrame:
+    """Flat, typed line item rows from normalised (or legacy flat) invoice CSV storage"""
+    return join_invoice_tables(*read_invoice_tables(source, lines_source, usecols, compact))
+
+
+def json_records(df: pd.DataFrame) -> List[dict]:
+    """
+    Rows as JSON-ready dicts in the format of the stored CSV: dates as YYYY-MM-DD, numeric columns
+    without fractions as ints (as read_csv would infer them) and missing values as None
+    """
+    out = df.astype(object)
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            out[col] = series.dt.strftime(DATE_FORMAT).astype(object)
+        elif pd.api.types.is_float_dtype(series) and series.notna().all() and (series % 1 == 0).all():
+            out[col] = series.astype('int64').astype(object)
+    return out.where(df.notna(), None).to_dict('records')
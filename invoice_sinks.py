@@ -0,0 +1,183 @@
+# invoice_sinks.py
+"""
+Streaming destinations for extracted invoices
+Each sink takes one invoice at a time with write(header, lines) and keeps at most one
+row group in memory, so a folder of any size can be extracted in constant memory.
+"""
+
+import csv
+import os
+import pandas as pd
+from typing import Dict, List, Optional
+
+from invoice_schema import (DATE_COLUMNS, INVOICE_HEADER_COLUMNS, LINE_ITEM_COLUMNS,
+                            csv_dtypes, line_items_path, normalize_invoice_frame)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Optional; only needed for ParquetInvoiceSink
+    pa = None
+    pq = None
+
+
+class InvoiceSink:
+    """
+    Base class of the sinks: write() skips an invoice_id that was already written in this run
+    (the first extraction wins) and returns whether the invoice was kept
+    """
+
+    def __init__(self):
+        self.invoices_written = 0
+        self.lines_written = 0
+        self.duplicates = 0
+        self._written_ids = set()
+
+    def write(self, header: dict, lines: List[dict]) -> bool:
+        invoice_id = header.get('invoice_id')
+        if invoice_id is not None:
+            if invoice_id in self._written_ids:
+                self.duplicates += 1
+                print(f"Warning: skipping duplicate invoice {invoice_id}")
+                return False
+            self._written_ids.add(invoice_id)
+        self._write(header, lines)
+        self.invoices_written += 1
+        self.lines_written += len(lines)
+        return True
+
+    def _write(self, header: dict, lines: List[dict]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvInvoiceSink(InvoiceSink):
+    """
+    Stream invoices to the header CSV (path) and the line item CSV next to it
+    offsets (as returned by checkpoint()) resumes an earlier sink: both files are truncated to
+    them and appended to, so anything written after that checkpoint is dropped.
+    """
+
+    def __init__(self, path: str, offsets: Optional[Dict[str, int]] = None):
+        super().__init__()
+        self.path = path
+        self.lines_path = line_items_path(path)
+        if offsets and not (os.path.exists(self.path) and os.path.exists(self.lines_path)):
+            raise FileNotFoundError(f"Cannot resume {path}: output files are missing")
+
+        mode = 'r+' if offsets else 'w'
+        self._invoices_file = open(self.path, mode, newline='', encoding='utf-8')
+        self._lines_file = open(self.lines_path, mode, newline='', encoding='utf-8')
+        if offsets:
+            self._invoices_file.truncate(offsets['invoices'])
+            self._lines_file.truncate(offsets['lines'])
+            self._invoices_file.seek(0, os.SEEK_END)
+            self._lines_file.seek(0, os.SEEK_END)
+
+        self._invoice_writer = csv.DictWriter(self._invoices_file, fieldnames=INVOICE_HEADER_COLUMNS,
+                                              extrasaction='ignore')
+        self._line_writer = csv.DictWriter(self._lines_file, fieldnames=LINE_ITEM_COLUMNS, extrasaction='ignore')
+        if not offsets:
+            self._invoice_writer.writeheader()
+            self._line_writer.writeheader()
+
+    def _write(self, header: dict, lines: List[dict]):
+        self._invoice_writer.writerow(header)
+        self._line_writer.writerows(lines)
+
+    def checkpoint(self) -> Dict[str, int]:
+        """Flush both files to disk and return their byte offsets"""
+        for f in (self._invoices_file, self._lines_file):
+            f.flush()
+            os.fsync(f.fileno())
+        return {'invoices': self._invoices_file.tell(), 'lines': self._lines_file.tell()}
+
+    def close(self):
+        self._invoices_file.close()
+        self._lines_file.close()
+
+
+def _arrow_type(column: str):
+    if column in DATE_COLUMNS:
+        return pa.timestamp('ms')
+    if column == 'line_no':
+        return pa.int32()
+    dtype = csv_dtypes([column], compact=True).get(column)
+    if dtype == 'float32':
+        return pa.float32()
+    if dtype == 'float64':
+        return pa.float64()
+    return pa.string()
+
+
+def _typed_frame(rows: List[dict], columns: List[str]) -> pd.DataFrame:
+    """Rows as a frame with the invoice schema dtypes (categoricals stay plain strings so row groups share a schema)"""
+    df = normalize_invoice_frame(pd.DataFrame(rows, columns=columns), derive_columns=False, fill_missing=False)
+    dtypes = {col: dtype for col, dtype in csv_dtypes(columns, compact=True).items() if dtype != 'category'}
+    for col in columns:
+        if col == 'line_no':
+            dtypes[col] = 'int32'
+        elif col not in dtypes and col not in DATE_COLUMNS:
+            dtypes[col] = 'str'
+    return df.astype(dtypes)
+
+
+class ParquetInvoiceSink(InvoiceSink):
+    """
+    Stream invoices to the header Parquet file (path) and the line item file next to it,
+    writing a row group every row_group_size line items (requires pyarrow)
+    """
+
+    def __init__(self, path: str, row_group_size: int = 50_000):
+        if pq is None:
+            raise ImportError("ParquetInvoiceSink requires pyarrow (pip install pyarrow)")
+        super().__init__()
+        self.path = path
+        self.lines_path = line_items_path(path)
+        self.row_group_size = max(1, row_group_size)
+        self.row_groups = 0
+
+        self._invoice_schema = pa.schema([(col, _arrow_type(col)) for col in INVOICE_HEADER_COLUMNS])
+        self._line_schema = pa.schema([(col, _arrow_type(col)) for col in LINE_ITEM_COLUMNS])
+        self._invoice_writer = pq.ParquetWriter(self.path, self._invoice_schema)
+        self._line_writer = pq.ParquetWriter(self.lines_path, self._line_schema)
+        self._headers = []
+        self._lines = []
+
+    def _write(self, header: dict, lines: List[dict]):
+        self._headers.append(header)
+        self._lines.extend(lines)
+        if len(self._lines) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered invoices and line items as one row group of each file"""
+        if not self._headers:
+            return
+        invoices = _typed_frame(self._headers, INVOICE_HEADER_COLUMNS)
+        lines = _typed_frame(self._lines, LINE_ITEM_COLUMNS)
+        self._invoice_writer.write_table(pa.Table.from_pandas(invoices, schema=self._invoice_schema,
+                                                              preserve_index=False))
+        self._line_writer.write_table(pa.Table.from_pandas(lines, schema=self._line_schema, preserve_index=False))
+        self._headers, self._lines = [], []
+        self.row_groups += 1
+
+    def close(self):
+        self.flush()
+        self._invoice_writer.close()
+        self._line_writer.close()
+
+
+def open_invoice_sink(path: str, **options) -> InvoiceSink:
+    """CSV or Parquet sink for path, chosen by its extension"""
+    if os.path.splitext(path)[1].lower() in ('.parquet', '.pq'):
+        return ParquetInvoiceSink(path, **options)
+    return CsvInvoiceSink(path, **options)
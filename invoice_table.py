@@ -0,0 +1,163 @@
+# invoice_table.py
+
+import numpy as np
+import pandas as pd
+from typing import Iterable, List, Optional, Tuple
+
+from invoice_schema import HEADER_COLUMNS
+
+# Dimension columns held as dictionary-encoded categoricals in the compact table
+HEADER_CATEGORICAL_COLUMNS = ['customer_name', 'customer_id', 'customer_location', 'customer_type', 'payment_status']
+LINE_CATEGORICAL_COLUMNS = ['product']
+
+
+def _as_categoricals(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    for col in columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _concat(first: pd.DataFrame, second: pd.DataFrame) -> pd.DataFrame:
+    """Concatenate two frames, unioning categories so categorical columns stay categorical"""
+    if first.empty:
+        return second.reset_index(drop=True)
+    if second.empty:
+        return first
+    first, second = first.copy(), second.copy()
+    for col in first.columns.intersection(second.columns):
+        if isinstance(first[col].dtype, pd.CategoricalDtype) and isinstance(second[col].dtype, pd.CategoricalDtype):
+            categories = first[col].cat.categories.union(second[col].cat.categories)
+            first[col] = first[col].cat.set_categories(categories)
+            second[col] = second[col].cat.set_categories(categories)
+    return pd.concat([first, second], ignore_index=True)
+
+
+class CompactInvoiceTable:
+    """
+    Invoice line items held as two tables instead of one flat frame
+    - invoices: one row per invoice with the invoice-level fields (customer, dates, VAT, profit, ...)
+    - lines: one row per line item with product/qty/unit_price/total and an int32 code into invoices
+    Dimension columns are categoricals, so repeated strings are stored once per distinct value.
+    Rows sharing every invoice-level value form one invoice; rows that disagree on any of them
+    are kept apart, so to_frame() always reproduces the original rows.
+    Instances are never mutated: append/drop_invoices return a new table.
+    """
+
+    def __init__(self, invoices: pd.DataFrame, lines: pd.DataFrame, columns: List[str]):
+        self.invoices = invoices
+        self.lines = lines
+        self.columns = list(columns)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'CompactInvoiceTable':
+        header_columns = [col for col in HEADER_COLUMNS if col in df.columns]
+        line_columns = [col for col in df.columns if col not in header_columns]
+
+        if df.empty or not header_columns:
+            codes = np.arange(len(df), dtype=np.int32)
+        else:
+            codes = df.groupby(header_columns, dropna=False, sort=False, observed=True).ngroup().to_numpy(np.int32)
+
+        first_rows = np.unique(codes, return_index=True)[1]
+        invoices = df[header_columns].iloc[first_rows].reset_index(drop=True)
+        lines = df[line_columns].reset_index(drop=True)
+        lines.insert(0, 'invoice', codes)
+
+        return cls(_as_categoricals(invoices, HEADER_CATEGORICAL_COLUMNS),
+                   _as_categoricals(lines, LINE_CATEGORICAL_COLUMNS),
+                   df.columns)
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    @property
+    def empty(self) -> bool:
+        return self.lines.empty
+
+    @property
+    def invoice_count(self) -> int:
+        """Number of distinct invoice IDs"""
+        if 'invoice_id' not in self.invoices.columns:
+            return len(self.invoices)
+        return self.invoices['invoice_id'].nunique()
+
+    def date_bounds(self) -> Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]:
+        """Earliest and latest invoice_date, or (None, None) when there are no dated invoices"""
+        if 'invoice_date' not in self.invoices.columns:
+            return None, None
+        used = self.invoices['invoice_date'].iloc[np.unique(self.lines['invoice'].to_numpy())].dropna()
+        if used.empty:
+            return None, None
+        return used.min(), used.max()
+
+    def to_frame(self, columns: Optional[Iterable[str]] = None, start_date=None, end_date=None) -> pd.DataFrame:
+        """
+        Materialise the flat line item frame, optionally only some columns and only the invoices
+        dated within [start_date, end_date] (no filtering when either is missing)
+        """
+        columns = [col for col in (columns or self.columns) if col in self.columns]
+        codes = self.lines['invoice'].to_numpy()
+        line_positions = None
+
+        if start_date and end_date and 'invoice_date' in self.invoices.columns:
+            dates = self.invoices['invoice_date']
+            in_range = ((dates >= pd.to_datetime(start_date)) & (dates <= pd.to_datetime(end_date))).to_numpy()
+            line_positions = np.flatnonzero(in_range[codes])
+            codes = codes[line_positions]
+
+        data = {}
+        for col in columns:
+            if col in self.invoices.columns:
+                data[col] = self.invoices[col].take(codes).reset_index(drop=True)
+            else:
+                values = self.lines[col] if line_positions is None else self.lines[col].take(line_positions)
+                data[col] = values.reset_index(drop=True)
+        return pd.DataFrame(data, columns=columns)
+
+    def rows_for_invoices(self, invoice_mask: np.ndarray) -> pd.DataFrame:
+        """Flat rows of the invoices selected by a boolean mask over self.invoices"""
+        line_positions = np.flatnonzero(invoice_mask[self.lines['invoice'].to_numpy()])
+        lines = self.lines.take(line_positions)
+        return CompactInvoiceTable(self.invoices, lines, self.columns).to_frame()
+
+    def append(self, df: pd.DataFrame) -> 'CompactInvoiceTable':
+        """Return a table that also holds the given flat line item rows"""
+        if df.empty:
+            return self
+        added = CompactInvoiceTable.from_frame(df)
+        added.lines['invoice'] += len(self.invoices)
+        columns = self.columns + [col for col in added.columns if col not in self.columns]
+        return CompactInvoiceTable(_concat(self.invoices, added.invoices), _concat(self.lines, added.lines), columns)
+
+    def drop_invoices(self, invoice_mask: np.ndarray) -> 'CompactInvoiceTable':
+        """Return a table without the invoices selected by a boolean mask over self.invoices"""
+        if not invoice_mask.any():
+            return self
+        keep = ~invoice_mask
+        new_codes = np.cumsum(keep, dtype=np.int64) - 1
+        codes = self.lines['invoice'].to_numpy()
+        lines = self.lines[keep[codes]].reset_index(drop=True)
+        lines['invoice'] = new_codes[lines['invoice'].to_numpy()].astype(np.int32)
+        return CompactInvoiceTable(self.invoices[keep].reset_index(drop=True), lines, self.columns)
+
+    def match_invoices(self, values: Iterable[str], columns: Iterable[str] = ('invoice_id', 'filename')) -> np.ndarray:
+        """Boolean mask over self.invoices of the invoices whose ID (or filename) is in values"""
+        values = set(values)
+        mask = np.zeros(len(self.invoices), dtype=bool)
+        for col in columns:
+            if col in self.invoices.columns:
+                mask |= self.invoices[col].astype(str).isin(values).to_numpy()
+        return mask
+
+    def memory_usage(self) -> dict:
+        """Deep memory usage in bytes of both tables"""
+        invoice_bytes = int(self.invoices.memory_usage(deep=True, index=False).sum())
+        line_bytes = int(self.lines.memory_usage(deep=True, index=False).sum())
+        return {
+            'rows': len(self.lines),
+            'invoices': len(self.invoices),
+            'invoice_bytes': invoice_bytes,
+            'line_bytes': line_bytes,
+            'total_bytes': invoice_bytes + line_bytes
+        }
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+# invoice_watcher.py
+"""
+Watch the invoices folder and ingest new or changed PDFs as they arrive
+Run standalone with `python invoice_watcher.py`, or set INVOICE_WATCH=1 to run it inside the API
+"""
+
+import argparse
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    from inotify_simple import INotify, flags as inotify_flags
+except ImportError:  # Optional (Linux only); the watcher polls the folder instead
+    INotify = None
+
+WATCH_POLL_SECONDS = float(os.getenv('INVOICE_WATCH_POLL_SECONDS', '2'))
+WATCH_SETTLE_SECONDS = float(os.getenv('INVOICE_WATCH_SETTLE_SECONDS', '2'))
+WATCH_BATCH_FILES = int(os.getenv('INVOICE_WATCH_BATCH_FILES', '25'))
+WATCH_BATCH_SECONDS = float(os.getenv('INVOICE_WATCH_BATCH_SECONDS', '5'))
+
+
+def _signature(path: str) -> Tuple[int, int]:
+    """(size, mtime in ns) of a file; a change in either means it is still being written or was replaced"""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class InvoiceDirectoryWatcher:
+    """
+    Ingest invoice PDFs dropped into a folder without rescanning everything
+    - changes are detected with inotify when inotify_simple is installed, otherwise by polling (size, mtime)
+    - a file is only extracted once its size and mtime have been stable for settle_seconds
+    - is_processed (the processed-files tracker) skips files whose content was already ingested
+    - extracted rows are handed to on_batch(rows, file_paths) every batch_files files or batch_seconds
+    """
+
+    def __init__(self, directory: str, process_file: Callable[[str], List[dict]],
+                 is_processed: Callable[[str], bool], on_batch: Callable[[List[dict], List[str]], None],
+                 poll_seconds: float = WATCH_POLL_SECONDS, settle_seconds: float = WATCH_SETTLE_SECONDS,
+                 batch_files: int = WATCH_BATCH_FILES, batch_seconds: float = WATCH_BATCH_SECONDS,
+                 use_inotify: bool = True):
+        self.directory = directory
+        self.process_file = process_file
+        self.is_processed = is_processed
+        self.on_batch = on_batch
+        self.poll_seconds = poll_seconds
+        self.settle_seconds = settle_seconds
+        self.batch_files = max(1, batch_files)
+        self.batch_seconds = batch_seconds
+
+        # Signature of every file already handled, and files waiting to settle: path -> (signature, stable since)
+        self._seen: Dict[str, Tuple[int, int]] = {}
+        self._pending: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        self._batch_rows: List[dict] = []
+        self._batch_paths: List[str] = []
+        self._batch_started: Optional[float] = None
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+        if use_inotify and INotify is not None:
+            self._inotify = INotify()
+            self._inotify.add_watch(directory, inotify_flags.CLOSE_WRITE | inotify_flags.MOVED_TO)
+
+        self.stats = {'files_processed': 0, 'files_skipped': 0, 'rows': 0, 'batches': 0, 'errors': 0}
+
+    @property
+    def mode(self) -> str:
+        return 'inotify' if self._inotify is not None else 'polling'
+
+    @property
+    def queue_depth(self) -> int:
+        """Files waiting to settle plus extracted files waiting in the current batch"""
+        return len(self._pending) + len(self._batch_paths)
+
+    def scan(self) -> List[str]:
+        """PDFs whose (size, mtime) differs from when they were last handled"""
+        changed = []
+        present = set()
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not (entry.is_file() and entry.name.lower().endswith('.pdf')):
+                    continue
+                present.add(entry.path)
+                stat = entry.stat()
+                if self._seen.get(entry.path) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append(entry.path)
+        # Forget deleted files so a new file with the same name is picked up
+        self._seen = {path: signature for path, signature in self._seen.items() if path in present}
+        return changed
+
+    def _changed_paths(self) -> List[str]:
+        if self._inotify is None:
+            self._stop.wait(self.poll_seconds)
+            return self.scan()
+        events = self._inotify.read(timeout=int(self.poll_seconds * 1000))
+        return [os.path.join(self.directory, event.name) for event in events
+                if event.name and event.name.lower().endswith('.pdf')]
+
+    def _track(self, path: str, now: float):
+        try:
+            signature = _signature(path)
+        except FileNotFoundError:
+            self._pending.pop(path, None)
+            return
+        if self._pending.get(path, (None,))[0] != signature:
+            self._pending[path] = (signature, now)
+
+    def _ingest_settled(self, now: float):
+        for path, (signature, since) in list(self._pending.items()):
+            try:
+                current = _signature(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            if current != signature:
+                # Still being written: restart the settle timer
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle_seconds and current[0] > 0:
+                del self._pending[path]
+                self._seen[path] = current
+                self._ingest(path)
+
+    def _ingest(self, path: str):
+        filename = os.path.basename(path)
+        if self.is_processed(path):
+            self.stats['files_skipped'] += 1
+            return
+        try:
+            print(f"👀 Processing new/changed file: {filename}")
+            rows = self.process_file(path)
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"❌ Error processing {filename}: {e}")
+            return
+        if not rows:
+            print(f"⚠️  {filename}: No data extracted")
+            return
+        if self._batch_started is None:
+            self._batch_started = time.monotonic()
+        self._batch_rows.extend(rows)
+        self._batch_paths.append(path)
+        self.stats['files_processed'] += 1
+        self.flush()
+
+    def flush(self, force: bool = False):
+        """Hand the buffered rows to on_batch when the batch is full or old enough (or force)"""
+        if not self._batch_paths:
+            return
+        due = (len(self._batch_paths) >= self.batch_files
+               or time.monotonic() - self._batch_started >= self.batch_seconds)
+        if not (force or due):
+            return
+        rows, paths = self._batch_rows, self._batch_paths
+        self._batch_rows, self._batch_paths, self._batch_started = [], [], None
+        try:
+            self.on_batch(rows, paths)
+            self.stats['batches'] += 1
+            self.stats['rows'] += len(rows)
+            print(f"📥 Ingested {len(rows)} records from {len(paths)} file(s)")
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"❌ Error storing batch of {len(paths)} file(s), will retry: {e}")
+            # Nothing was marked as processed, so retry the files on the next pass
+            for path in paths:
+                self._seen.pop(path, None)
+                self._track(path, time.monotonic() - self.settle_seconds)
+
+    def run_once(self):
+        """Pick up changes, ingest files that have settled and flush a due batch"""
+        for path in self._changed_paths():
+            self._track(path, time.monotonic())
+        self._ingest_settled(time.monotonic())
+        self.flush()
+
+    def ingest_existing(self):
+        """Ingest the files currently in the folder that the tracker has not seen, without waiting to settle"""
+        for path in self.scan():
+            self._track(path, time.monotonic() - self.settle_seconds)
+        self._ingest_settled(time.monotonic())
+        self.flush(force=True)
+
+    def run(self):
+        """Watch until stop() is called; files already in the folder are checked against the tracker first"""
+        print(f"👀 Watching {self.directory} for invoices ({self.mode})")
+        for path in self.scan():
+            self._track(path, time.monotonic())
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"❌ Invoice watcher error: {e}")
+        self.flush(force=True)
+
+    def start(self):
+        """Run the watcher in a background thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='invoice-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout if timeout is not None else self.poll_seconds + 5)
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--directory', default=None, help="Folder to watch (default: the API's INVOICES_DIR)")
+    parser.add_argument('--once', action='store_true', help="Ingest what is in the folder now and exit")
+    args = parser.parse_args()
+
+    # Reuse the API's extractor, processed-files tracker and storage
+    import main as api
+    api.initialize_github_storage()
+    api.initialize_csv_if_needed()
+    watcher = api.create_invoice_watcher(args.directory or api.INVOICES_DIR)
+
+    if args.once:
+        watcher.ingest_existing()
+        print(f"✅ Done: {watcher.stats}")
+        return
+
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.flush(force=True)
+        print(f"\n👋 Stopped: {watcher.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,526 @@
+# invoice_workers.py
+"""
+Persistent pool of warm invoice extraction processes
+Each worker imports invoice_extractor and camelot (with OpenCV and Ghostscript) once and
+keeps one InvoiceExtractor, with its learned table layouts, for every job it runs. Workers are
+replaced after max_jobs jobs or once their RSS passes max_rss_mb, so leaks and fragmentation
+in the PDF libraries cannot build up. Every job runs under memory, CPU-time and wall-clock limits,
+so a malformed or huge PDF fails on its own instead of taking the API process down with it.
+A multi-invoice PDF is split by the worker that gets it, and each of its invoices then runs as a
+job of its own, under the same limits and on as many workers as are free.
+"""
+
+import itertools
+import math
+import multiprocessing
+import os
+import queue
+import shutil
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from metrics import REGISTRY, MetricsRegistry
+
+POOL_WORKERS = int(os.getenv('INVOICE_POOL_WORKERS', '0'))  # 0 extracts in the API process
+POOL_MAX_JOBS = int(os.getenv('INVOICE_POOL_MAX_JOBS', '500'))
+POOL_MAX_RSS_MB = float(os.getenv('INVOICE_POOL_MAX_RSS_MB', '1024'))
+# Sandbox of every job: address space of a worker, CPU seconds per job and wall-clock seconds per job
+# (the wall-clock limit kills the worker, for PDFs stuck outside Python); 0 disables a limit.
+# A job is one PDF, or one invoice of a multi-invoice PDF once its worker has split it
+JOB_MAX_MEMORY_MB = int(os.getenv('INVOICE_JOB_MAX_MEMORY_MB', '2048'))
+JOB_MAX_CPU_SECONDS = int(os.getenv('INVOICE_JOB_MAX_CPU_SECONDS', '60'))
+JOB_TIMEOUT_SECONDS = float(os.getenv('INVOICE_JOB_TIMEOUT_SECONDS', '120'))
+# forkserver preloads invoice_extractor once and forks every worker from it, so replacing one is cheap
+POOL_START_METHOD = os.getenv('INVOICE_POOL_START_METHOD',
+                              'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def rss_mb() -> float:
+    """Resident set size of this process in MB (Linux /proc, falling back to the peak RSS)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class CpuTimeExceeded(BaseException):
+    """
+    Raised in a worker when a job uses up its CPU seconds (SIGXCPU from RLIMIT_CPU)
+    A BaseException, like KeyboardInterrupt, so the extractor's catch-all handlers let it through
+    """
+
+
+class ExtractionFailed(RuntimeError):
+    """
+    A pool job that produced no invoices; reason is one of rejected (over the size or page limits),
+    memory_limit, cpu_limit, timeout, crashed (the worker died) or error
+    """
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _raise_cpu_time_exceeded(signum, frame):
+    raise CpuTimeExceeded("CPU time limit of the job exceeded")
+
+
+def limit_job_cpu(seconds: int):
+    """Let this process use `seconds` more CPU seconds before SIGXCPU (0 lifts the limit)"""
+    import resource
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = hard
+    if seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft = math.ceil(usage.ru_utime + usage.ru_stime) + seconds
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def failure_reason(error: Exception) -> str:
+    if isinstance(error, MemoryError):
+        return 'memory_limit'
+    if isinstance(error, CpuTimeExceeded):
+        return 'cpu_limit'
+    return getattr(error, 'reason', 'error')
+
+
+def join_segments(future: Future, segment_futures: List[Future], directory: str, started: float,
+                  split_seconds: float):
+    """
+    Resolve the future of a split PDF with the (invoices, stats) of its segment jobs once they are all done,
+    as process_pdf would, and remove the directory of the segment PDFs. Segments that failed are left out and listed in
+    stats['failed_segments']; the PDF only fails when all of them did.
+    """
+    remaining = [len(segment_futures)]
+    lock = threading.Lock()
+
+    def segment_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+        invoices, segments, failures = [], [], []
+        for i, segment_future in enumerate(segment_futures):
+            try:
+                segment_invoices, segment_stats = segment_future.result()
+            except Exception as e:
+                failures.append({'segment': i, 'reason': getattr(e, 'reason', 'error'), 'error': str(e)})
+                continue
+            invoices.extend(segment_invoices)
+            segments.append(segment_stats)
+        shutil.rmtree(directory, ignore_errors=True)
+        if failures and not invoices:
+            future.set_exception(ExtractionFailed(
+                failures[0]['reason'], f"All {len(failures)} invoices failed, first: {failures[0]['error']}"))
+            return
+        stats = {
+            'stages': {'split': split_seconds, 'total': time.perf_counter() - started},
+            'segments': segments,
+            'line_items': sum(len(lines) for _, lines in invoices)
+        }
+        if failures:
+            stats['failed_segments'] = failures
+        future.set_result((invoices, stats))
+
+    for segment_future in segment_futures:
+        segment_future.add_done_callback(segment_done)
+
+
+def worker_main(worker_id: int, jobs, results, max_jobs: int, max_rss_mb: float,
+                max_memory_mb: int = JOB_MAX_MEMORY_MB, max_cpu_seconds: int = JOB_MAX_CPU_SECONDS):
+    """
+    Worker process body: extract the PDFs sent on jobs until told to stop (None), reporting
+    ('ready' | 'done' | 'split' | 'failed' | 'recycle', worker_id, payload) on results.
+    A multi-invoice PDF is only split here ('split' with the paths of its invoices, see
+    InvoiceExtractor.extract_or_split_pdf); the pool sends those back as segment jobs.
+    Allocations past max_memory_mb fail with MemoryError (RLIMIT_AS) and each job gets
+    max_cpu_seconds of CPU (RLIMIT_CPU); a worker that hit either limit is replaced.
+    """
+    import resource
+    started = time.perf_counter()
+    from invoice_extractor import InvoiceExtractor
+    import camelot  # Lazy in invoice_extractor; a warm worker loads it before its first job instead
+    extractor = InvoiceExtractor()
+    signal.signal(signal.SIGXCPU, _raise_cpu_time_exceeded)
+    results.put(('ready', worker_id, time.perf_counter() - started))
+    if max_memory_mb:
+        # After the first put, which starts the queue's feeder thread (its stack counts against the limit)
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_mb * 2**20, hard))
+
+    jobs_done = 0
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        job_id, pdf_path, segment = job
+        reason = None
+        try:
+            stats = {}
+            limit_job_cpu(max_cpu_seconds)
+            started_job = time.perf_counter()
+            if segment:
+                invoices, segment_paths = [extractor.process_invoice_tables(pdf_path, stats)], None
+            else:
+                invoices, segment_paths = extractor.extract_or_split_pdf(pdf_path, stats)
+            limit_job_cpu(0)
+            if segment_paths:
+                results.put(('split', worker_id, (job_id, segment_paths, time.perf_counter() - started_job)))
+            else:
+                results.put(('done', worker_id, (job_id, invoices, stats)))
+        except (Exception, CpuTimeExceeded) as e:
+            limit_job_cpu(0)
+            reason = failure_reason(e)
+            results.put(('failed', worker_id, (job_id, reason, f"{type(e).__name__}: {e}")))
+
+        jobs_done += 1
+        if reason in ('memory_limit', 'cpu_limit'):
+            # Libraries interrupted mid-allocation may have left this process in a bad state
+            results.put(('recycle', worker_id, reason))
+            return
+        if jobs_done >= max_jobs:
+            results.put(('recycle', worker_id, 'jobs'))
+            return
+        if max_rss_mb and rss_mb() > max_rss_mb:
+            results.put(('recycle', worker_id, 'memory'))
+            return
+
+
+class ExtractionPool:
+    """
+    Extract invoice PDFs in warm worker processes
+    submit(pdf_path) returns a Future of (invoices, stats) as from InvoiceExtractor.process_pdf;
+    extract(pdf_path) waits for it. Jobs are handed to idle workers one at a time, so the pool
+    always knows what each worker is doing, and a job whose worker dies fails instead of hanging.
+    Failed jobs raise ExtractionFailed with the reason, e.g. memory_limit or timeout.
+    The invoices of a multi-invoice PDF are queued as jobs of their own, ahead of other PDFs, so each
+    gets the per-job CPU and time limits and they run in parallel (see join_segments).
+    """
+
+    def __init__(self, workers: int = POOL_WORKERS, max_jobs: int = POOL_MAX_JOBS,
+                 max_rss_mb: float = POOL_MAX_RSS_MB, start_method: str = POOL_START_METHOD,
+                 max_memory_mb: int = JOB_MAX_MEMORY_MB, max_cpu_seconds: int = JOB_MAX_CPU_SECONDS,
+                 job_timeout: float = JOB_TIMEOUT_SECONDS, registry: MetricsRegistry = REGISTRY):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.max_jobs = max(1, max_jobs)
+        self.max_rss_mb = max_rss_mb
+        self.max_memory_mb = max_memory_mb
+        self.max_cpu_seconds = max_cpu_seconds
+        self.job_timeout = job_timeout
+        self.registry = registry
+        self._context = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            self._context.set_forkserver_preload(['invoice_extractor', 'camelot'])
+        self._results = self._context.Queue()
+
+        self._lock = threading.Lock()
+        self._processes: Dict[int, multiprocessing.Process] = {}
+        self._job_queues: Dict[int, object] = {}
+        self._idle: deque = deque()
+        self._running: Dict[int, Tuple[int, float, str]] = {}  # worker_id -> (job_id, started, pdf_path)
+        self._pending: deque = deque()  # (job_id, pdf_path) waiting for a worker
+        self._futures: Dict[int, Tuple[Future, float]] = {}  # job_id -> (future, submitted)
+        self._segment_jobs = set()  # job_ids of single invoices split from a multi-invoice PDF
+        self._worker_ids = itertools.count()
+        self._job_ids = itertools.count()
+        self._collector = None
+        self._closing = False
+        self._started_at = None
+        self._busy_seconds = 0.0
+        self._start_failures = 0  # Workers in a row that died before becoming ready
+        self.error = None  # Set when workers cannot start; the pool then fails every job
+
+        self.job_seconds = registry.histogram('invoice_pool_job_seconds', 'Seconds a worker spent on one PDF').labels()
+        self.wait_seconds = registry.histogram('invoice_pool_wait_seconds',
+                                               'Seconds a PDF waited for a free worker').labels()
+        self.start_seconds = registry.histogram('invoice_pool_worker_start_seconds',
+                                                'Seconds from starting a worker to it being ready').labels()
+        self.jobs = registry.counter('invoice_pool_jobs_total', 'Pool jobs by outcome (done, split, rejected, memory_limit, cpu_limit, timeout, crashed, error, lost)',
+                                     ['outcome'])
+        self.recycles = registry.counter('invoice_pool_recycles_total',
+                                         'Workers replaced, by reason (jobs, memory, memory_limit, cpu_limit, timeout, exit)',
+                                         ['reason'])
+
+    def start(self) -> 'ExtractionPool':
+        with self._lock:
+            if self._collector is not None:
+                return self
+            self._started_at = time.monotonic()
+            for _ in range(self.workers):
+                self._spawn()
+        self._collector = threading.Thread(target=self._collect, name='extraction-pool', daemon=True)
+        self._collector.start()
+        self.registry.register_collector(self.collect_metrics)
+        print(f"🏭 Started {self.workers} extraction workers ({self._context.get_start_method()})")
+        return self
+
+    def _spawn(self):
+        """Start one worker (with self._lock held); it joins the idle list once it reports ready"""
+        worker_id = next(self._worker_ids)
+        jobs = self._context.Queue()
+        process = self._context.Process(target=worker_main, name=f'extraction-worker-{worker_id}',
+                                        args=(worker_id, jobs, self._results, self.max_jobs, self.max_rss_mb,
+                                              self.max_memory_mb, self.max_cpu_seconds),
+                                        daemon=True)
+        process.spawned_at = time.perf_counter()
+        process.start()
+        self._processes[worker_id] = process
+        self._job_queues[worker_id] = jobs
+
+    def _dispatch(self):
+        """Hand pending jobs to idle workers (with self._lock held)"""
+        while self._pending and self._idle:
+            worker_id = self._idle.popleft()
+            job_id, pdf_path = self._pending.popleft()
+            now = time.perf_counter()
+            self._running[worker_id] = (job_id, now, pdf_path)
+            self.wait_seconds.observe(now - self._futures[job_id][1])
+            self._job_queues[worker_id].put((job_id, pdf_path, job_id in self._segment_jobs))
+
+    def submit(self, pdf_path: str) -> Future:
+        """Queue a PDF for extraction; the Future resolves to (invoices, stats)"""
+        if self._collector is None:
+            self.start()
+        future = Future()
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("Extraction pool is closed")
+            if self.error:
+                raise RuntimeError(self.error)
+            job_id = next(self._job_ids)
+            self._futures[job_id] = (future, time.perf_counter())
+            self._pending.append((job_id, os.path.abspath(pdf_path)))
+            self._dispatch()
+        return future
+
+    def _split(self, worker_id: int, job_id: int, segment_paths: List[str], split_seconds: float):
+        """
+        Queue the invoices of a PDF a worker has split as jobs of their own, ahead of other PDFs, and
+        resolve the PDF's future once they are done (with self._lock held)
+        """
+        running = self._release(worker_id, 'split')
+        started = running[1] if running is not None else time.perf_counter()
+        future, _ = self._futures.pop(job_id, (None, None))
+        directory = os.path.dirname(segment_paths[0])
+        if future is None:
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+        now = time.perf_counter()
+        segments = []
+        for segment_path in segment_paths:
+            segment_id = next(self._job_ids)
+            self._futures[segment_id] = (Future(), now)
+            self._segment_jobs.add(segment_id)
+            segments.append((segment_id, segment_path))
+        self._pending.extendleft(reversed(segments))
+        join_segments(future, [self._futures[segment_id][0] for segment_id, _ in segments], directory,
+                      started, split_seconds)
+
+    def extract(self, pdf_path: str, timeout: Optional[float] = None):
+        """(invoices, stats) of one PDF, extracted by a worker"""
+        return self.submit(pdf_path).result(timeout)
+
+    def map(self, pdf_paths: List[str], timeout: Optional[float] = None) -> list:
+        """(invoices, stats) of each PDF, in order, extracted in parallel"""
+        futures = [self.submit(path) for path in pdf_paths]
+        return [future.result(timeout) for future in futures]
+
+    def _finish(self, worker_id: int, job_id: int, outcome: str, result=None, error: Optional[str] = None):
+        """Resolve a job's future and free its worker's slot (with self._lock held); outcome is done or the failure reason"""
+        self._release(worker_id, outcome)
+        self._segment_jobs.discard(job_id)
+        future, _ = self._futures.pop(job_id, (None, None))
+        if future is None:
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(ExtractionFailed(outcome, error))
+
+    def _release(self, worker_id: int, outcome: str):
+        """Free a worker's slot and count its job's outcome (with self._lock held); returns the job it was running"""
+        running = self._running.pop(worker_id, None)
+        if running is not None:
+            elapsed = time.perf_counter() - running[1]
+            self._busy_seconds += elapsed
+            self.job_seconds.observe(elapsed)
+        self.jobs.labels(outcome).inc()
+        return running
+
+    def _replace(self, worker_id: int, reason: str):
+        """Forget an exiting worker and start another in its place (with self._lock held)"""
+        process = self._processes.pop(worker_id, None)
+        self._job_queues.pop(worker_id, None)
+        if worker_id in self._idle:
+            self._idle.remove(worker_id)
+        running = self._running.pop(worker_id, None)
+        if running is not None:
+            # Handed over between the worker's last result and its recycle message: it never started
+            self._pending.appendleft((running[0], running[2]))
+        if process is not None:
+            process.join(timeout=5)
+        self.recycles.labels(reason).inc()
+        if not self._closing:
+            self._spawn()
+
+    def _check_workers(self):
+        """
+        Fail the job of any worker that died (e.g. killed for its memory) or ran past the job timeout,
+        and replace the worker
+        """
+        with self._lock:
+            now = time.perf_counter()
+            for worker_id, (job_id, started, pdf_path) in list(self._running.items()):
+                process = self._processes.get(worker_id)
+                if self.job_timeout and now - started > self.job_timeout and process is not None \
+                        and process.is_alive() and not self._closing:
+                    # Stuck in native code, where neither the CPU limit nor Python can interrupt it
+                    print(f"⏱️  {os.path.basename(pdf_path)} ran over {self.job_timeout:g}s, killing worker {worker_id}")
+                    self._finish(worker_id, job_id, 'timeout',
+                                 error=f"Extraction took longer than {self.job_timeout:g} seconds")
+                    process.kill()
+                    self._replace(worker_id, 'timeout')
+
+            for worker_id, process in list(self._processes.items()):
+                if process.is_alive() or self._closing:
+                    continue
+                running = self._running.get(worker_id)
+                if running is not None:
+                    # A worker past its CPU limit dies of SIGXCPU if native code ignores the Python handler
+                    reason = 'cpu_limit' if process.exitcode == -signal.SIGXCPU else 'crashed'
+                    self._finish(worker_id, running[0], reason,
+                                 error=f"Extraction worker exited with code {process.exitcode}")
+                elif not getattr(process, 'ready', False):
+                    self._start_failures += 1
+                if self._start_failures >= 3:
+                    # Workers crash on start (e.g. the main module is not import-safe): stop retrying
+                    if self.error is None:
+                        self.error = f"Extraction workers fail to start (exit code {process.exitcode})"
+                        print(f"❌ {self.error}")
+                    self._processes.pop(worker_id, None)
+                    self._job_queues.pop(worker_id, None)
+                    while self._pending:
+                        job_id, _ = self._pending.popleft()
+                        self._segment_jobs.discard(job_id)
+                        self._futures.pop(job_id)[0].set_exception(RuntimeError(self.error))
+                    continue
+                print(f"⚠️  Extraction worker {worker_id} exited with code {process.exitcode}, replacing it")
+                self._replace(worker_id, 'exit')
+            self._dispatch()
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while True:
+            with self._lock:
+                if (self._closing or self.error) and not self._processes:
+                    return
+            try:
+                kind, worker_id, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                kind = None
+            except (EOFError, OSError):
+                return
+
+            with self._lock:
+                if kind == 'ready':
+                    process = self._processes.get(worker_id)
+                    if process is not None:
+                        process.ready = True
+                        self._start_failures = 0
+                        self.start_seconds.observe(time.perf_counter() - process.spawned_at)
+                        self._idle.append(worker_id)
+                elif kind == 'done':
+                    job_id, invoices, stats = payload
+                    self._finish(worker_id, job_id, 'done', result=(invoices, stats))
+                    self._idle.append(worker_id)
+                elif kind == 'split':
+                    self._split(worker_id, *payload)
+                    self._idle.append(worker_id)
+                elif kind == 'failed':
+                    job_id, reason, error = payload
+                    self._finish(worker_id, job_id, reason, error=error)
+                    self._idle.append(worker_id)
+                elif kind == 'recycle':
+                    self._replace(worker_id, payload)
+                self._dispatch()
+
+            if kind is None or time.monotonic() - last_check >= 1.0:
+                self._check_workers()
+                last_check = time.monotonic()
+
+    def snapshot(self) -> dict:
+        """Worker counts, queued jobs and the share of worker time spent extracting since start"""
+        with self._lock:
+            now = time.perf_counter()
+            busy = self._busy_seconds + sum(now - started for _, started, _ in self._running.values())
+            uptime = time.monotonic() - self._started_at if self._started_at is not None else 0.0
+            return {
+                'workers': len(self._processes),
+                'busy_workers': len(self._running),
+                'idle_workers': len(self._idle),
+                'pending_jobs': len(self._pending),
+                'utilisation': round(busy / (uptime * self.workers), 4) if uptime > 0 else 0.0,
+                'jobs': {labels['outcome']: int(counter.value) for labels, counter in self.jobs.children()},
+                'recycles': {labels['reason']: int(counter.value) for labels, counter in self.recycles.children()},
+                'job_seconds': self.job_seconds.snapshot(),
+                'wait_seconds': self.wait_seconds.snapshot()
+            }
+
+    def collect_metrics(self):
+        """Registry collector for the pool's gauges"""
+        snapshot = self.snapshot()
+        yield ('invoice_pool_workers', 'gauge', 'Extraction worker processes', [({}, snapshot['workers'])])
+        yield ('invoice_pool_busy_workers', 'gauge', 'Extraction workers running a job',
+               [({}, snapshot['busy_workers'])])
+        yield ('invoice_pool_pending_jobs', 'gauge', 'PDFs waiting for a free extraction worker',
+               [({}, snapshot['pending_jobs'])])
+        yield ('invoice_pool_utilisation', 'gauge', 'Share of worker time spent extracting since the pool started',
+               [({}, snapshot['utilisation'])])
+
+    def close(self, timeout: float = 10.0):
+        """Let running jobs finish, fail the queued ones and stop the workers"""
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+            while self._pending:
+                job_id, _ = self._pending.popleft()
+                self._segment_jobs.discard(job_id)
+                future, _ = self._futures.pop(job_id)
+                future.set_exception(RuntimeError("Extraction pool was closed"))
+            for jobs in self._job_queues.values():
+                jobs.put(None)
+            processes = list(self._processes.items())
+
+        deadline = time.monotonic() + timeout
+        for worker_id, process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+                process.join(1)
+        with self._lock:
+            for worker_id, _ in processes:
+                self._processes.pop(worker_id, None)
+                running = self._running.get(worker_id)
+                if running is not None:
+                    self._finish(worker_id, running[0], 'lost', error="Extraction pool was closed")
+        if self._collector is not None:
+            self._collector.join(timeout=2)
+        self.registry.unregister_collector(self.collect_metrics)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
@@ -9,11 +9,20 @@ import pandas as pd
 import uvicorn
 import json
 import hashlib
+import asyncio
+import threading
+from datetime import datetime
 from fastapi.middleware.wsgi import WSGIMiddleware
+from starlette.concurrency import run_in_threadpool
 
 # Import your existing classes
-from invoice_extractor import InvoiceExtractor
-from dashboard import app as dash_app
+from invoice_extractor import InvoiceExtractor, invoice_rows
+from invoice_watcher import InvoiceDirectoryWatcher
+from invoice_workers import POOL_WORKERS, ExtractionPool
+from invoice_schema import json_records, line_items_path, read_invoice_csv, read_invoice_rows, split_invoice_rows
+from dashboard import app as dash_app, publish_data_change, get_cache_stats
+from metrics import REGISTRY, PrometheusMiddleware, extraction_metrics
+from health import HealthMonitor
 
 # Import the new GitHub storage class
 from github_storage import GitHubCSVStorage, GitHubConfig
@@ -34,6 +43,9 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Time every request (added last, so it is the outermost middleware and sees the full latency)
+app.add_middleware(PrometheusMiddleware)
+
 # Pydantic models for request/response
 class DeleteInvoiceRequest(BaseModel):
     invoice_ids: List[str]  # List of invoice IDs to delete
@@ -48,7 +60,8 @@ class DeleteInvoiceResponse(BaseModel):
 
 # Global variables
 INVOICES_DIR = "invoices"
-CSV_FILE = "invoice_data.csv"  # Local fallback file
+CSV_FILE = "invoice_data.csv"  # Local fallback file (one header row per invoice)
+LINE_ITEMS_CSV_FILE = line_items_path(CSV_FILE)  # Line items referencing CSV_FILE by invoice_id
 PROCESSED_FILES_TRACKER = "processed_files.json"
 extractor = InvoiceExtractor()
 
@@ -56,6 +69,34 @@ extractor = InvoiceExtractor()
 github_storage = None
 use_github_storage = False
 
+# Set EXTRACTION_STATS_FILE to append each file's stage timings and product tier (JSON lines) to that file
+EXTRACTION_STATS_FILE = os.getenv("EXTRACTION_STATS_FILE", "")
+
+# Serialises writes to the invoice storage and tracker (upload/delete endpoints and the folder watcher)
+storage_lock = threading.RLock()
+
+# Set INVOICE_POOL_WORKERS=N to extract in N warm worker processes instead of the API process
+# With EXTRACTION_SANDBOX on (the default) extraction always runs in at least one worker, under the
+# INVOICE_JOB_* memory, CPU and time limits, so one bad PDF cannot take the API down
+EXTRACTION_SANDBOX = os.getenv("EXTRACTION_SANDBOX", "1").lower() in ("1", "true", "yes")
+extraction_pool = None
+
+# Set once startup_event has finished (and cleared on shutdown); reported by /readyz
+app_ready = False
+
+# Set INVOICE_WATCH=1 to ingest PDFs dropped into INVOICES_DIR in the background
+INVOICE_WATCH_ENABLED = os.getenv("INVOICE_WATCH", "").lower() in ("1", "true", "yes")
+invoice_watcher = None
+
+# Service metrics served at /metrics (see metrics.py)
+storage_read_seconds = REGISTRY.histogram('invoice_storage_read_seconds', 'Seconds to read all invoice rows',
+                                          ['source'])
+upload_rows = REGISTRY.histogram('invoice_upload_rows', 'Line item rows added per upload request',
+                                 buckets=(0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)).labels()
+upload_files = REGISTRY.counter('invoice_upload_files_total', 'Uploaded files by outcome', ['outcome'])
+REGISTRY.gauge('invoice_extraction_queue_depth', 'PDFs the folder watcher has yet to extract or store',
+               function=lambda: invoice_watcher.queue_depth if invoice_watcher is not None else 0).labels()
+
 # Ensure directories exist
 os.makedirs(INVOICES_DIR, exist_ok=True)
 
@@ -133,6 +174,16 @@ def mark_file_as_processed(file_path: str):
     except Exception as e:
         print(f"Error marking file as processed {filename}: {e}")
 
+def mark_files_as_processed(file_paths: List[str]):
+    """Mark several files as processed with a single tracker write"""
+    tracker = load_processed_files_tracker()
+    for file_path in file_paths:
+        try:
+            tracker[os.path.basename(file_path)] = get_file_hash(file_path)
+        except Exception as e:
+            print(f"Error marking file as processed {os.path.basename(file_path)}: {e}")
+    save_processed_files_tracker(tracker)
+
 def remove_file_from_tracker(filename: str):
     """Remove a file from the processed files tracker"""
     tracker = load_processed_files_tracker()
@@ -147,7 +198,8 @@ def read_csv_data() -> pd.DataFrame:
     
     if use_github_storage and github_storage:
         try:
-            df = github_storage.read_csv_as_dataframe()
+            with storage_read_seconds.labels('github').time():
+                df = github_storage.read_csv_as_dataframe()
             if df is not None:
                 print("📡 Successfully read CSV from GitHub")
                 return df
@@ -160,7 +212,8 @@ def read_csv_data() -> pd.DataFrame:
     # Fallback to local file
     if os.path.exists(CSV_FILE):
         try:
-            df = pd.read_csv(CSV_FILE)
+            with storage_read_seconds.labels('local').time():
+                df = read_invoice_rows(CSV_FILE)
             print("📁 Successfully read local CSV file")
             return df
         except Exception as e:
@@ -194,19 +247,42 @@ def append_to_csv(new_data: List[dict]):
     if not success:
         try:
             new_df = pd.DataFrame(new_data)
+            new_invoices, new_lines = split_invoice_rows(new_df)
             
-            if os.path.exists(CSV_FILE):
-                # Append to existing CSV
-                new_df.to_csv(CSV_FILE, mode='a', header=False, index=False)
+            if can_append_local_tables(new_invoices, new_lines):
+                # Append to the existing header and line item CSVs
+                new_lines.reindex(columns=pd.read_csv(LINE_ITEMS_CSV_FILE, nrows=0).columns).to_csv(
+                    LINE_ITEMS_CSV_FILE, mode='a', header=False, index=False)
+                new_invoices.reindex(columns=pd.read_csv(CSV_FILE, nrows=0).columns).to_csv(
+                    CSV_FILE, mode='a', header=False, index=False)
             else:
-                # Create new CSV with headers
-                new_df.to_csv(CSV_FILE, index=False)
+                # Rewrite both tables: first write, legacy flat CSV, or invoices extracted again
+                existing = read_invoice_rows(CSV_FILE) if os.path.exists(CSV_FILE) else None
+                combined = new_df if existing is None else pd.concat([existing, new_df], ignore_index=True)
+                write_local_tables(*split_invoice_rows(combined))
             
             print(f"📁 Added {len(new_data)} records to local CSV")
         except Exception as e:
             print(f"Error appending to local CSV: {e}")
             raise
 
+def can_append_local_tables(new_invoices: pd.DataFrame, new_lines: pd.DataFrame) -> bool:
+    """True when new invoices can be appended in place: both local tables exist with all the new
+    columns and none of the invoice IDs is already stored"""
+    if not (os.path.exists(CSV_FILE) and os.path.exists(LINE_ITEMS_CSV_FILE)):
+        return False
+    if not set(new_invoices.columns) <= set(pd.read_csv(CSV_FILE, nrows=0).columns):
+        return False
+    if not set(new_lines.columns) <= set(pd.read_csv(LINE_ITEMS_CSV_FILE, nrows=0).columns):
+        return False
+    stored_ids = read_invoice_csv(CSV_FILE, usecols=['invoice_id'])['invoice_id']
+    return not stored_ids.isin(new_invoices['invoice_id']).any()
+
+def write_local_tables(invoices: pd.DataFrame, lines: pd.DataFrame):
+    """Write the invoice header and line item tables to the local CSV files"""
+    lines.to_csv(LINE_ITEMS_CSV_FILE, index=False)
+    invoices.to_csv(CSV_FILE, index=False)
+
 def get_invoice_records_by_ids(invoice_ids: List[str]) -> tuple:
     """
     Get invoice records from CSV by invoice IDs
@@ -287,7 +363,7 @@ def delete_records_from_csv(invoice_ids: List[str]) -> int:
         
         # Use local CSV if GitHub failed or not configured
         if not success:
-            df_filtered.to_csv(CSV_FILE, index=False)
+            write_local_tables(*split_invoice_rows(df_filtered))
             print(f"📁 Deleted {deleted_count} records from local CSV")
         
         return deleted_count
@@ -296,6 +372,78 @@ def delete_records_from_csv(invoice_ids: List[str]) -> int:
         print(f"Error deleting records from CSV: {e}")
         raise HTTPException(status_code=500, detail=f"Error updating CSV: {str(e)}")
 
+def extract_invoice_file(file_path: str, stats: Optional[dict] = None) -> List[dict]:
+    """
+    Extract one invoice PDF into flat rows, recording its per-stage timings and product tier
+    in the extraction metrics (and EXTRACTION_STATS_FILE when set); stats receives them too
+    """
+    stats = {} if stats is None else stats
+    if extraction_pool is not None:
+        invoices, worker_stats = extraction_pool.extract(file_path)
+        stats.update(worker_stats)
+        rows = invoice_rows(invoices)
+    else:
+        rows = extractor.process_invoice(file_path, stats=stats)
+    record_extraction(file_path, rows, stats)
+    return rows
+
+async def extract_invoice_file_async(file_path: str, stats: Optional[dict] = None) -> List[dict]:
+    """
+    extract_invoice_file for request handlers: awaits the worker (or runs the in-process extractor
+    in the thread pool), so probes, metrics and the dashboard are served while a PDF is extracted
+    """
+    stats = {} if stats is None else stats
+    if extraction_pool is not None:
+        invoices, worker_stats = await asyncio.wrap_future(extraction_pool.submit(file_path))
+        stats.update(worker_stats)
+        rows = invoice_rows(invoices)
+    else:
+        rows = await run_in_threadpool(extractor.process_invoice, file_path, stats=stats)
+    record_extraction(file_path, rows, stats)
+    return rows
+
+def record_extraction(file_path: str, rows: List[dict], stats: dict):
+    """Record one file's extraction stats in the metrics and EXTRACTION_STATS_FILE (when set)"""
+    extraction_metrics.record(stats)
+    if EXTRACTION_STATS_FILE:
+        save_extraction_stats(file_path, rows, stats)
+
+def save_extraction_stats(file_path: str, rows: List[dict], stats: dict):
+    """Append one file's extraction stats to EXTRACTION_STATS_FILE, keyed like its stored rows"""
+    record = {
+        "filename": os.path.basename(file_path),
+        "invoice_id": rows[0].get('invoice_id') if rows else None,
+        "extracted_at": datetime.now().isoformat(timespec='seconds'),
+        **stats
+    }
+    try:
+        with open(EXTRACTION_STATS_FILE, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+    except Exception as e:
+        print(f"Error saving extraction stats for {record['filename']}: {e}")
+
+def ingest_invoice_batch(rows: List[dict], file_paths: List[str]):
+    """
+    Store a micro-batch of rows extracted by the folder watcher, then mark its files as processed
+    (only after the rows are stored, so a failed batch is retried) and notify the dashboard
+    """
+    with storage_lock:
+        append_to_csv(rows)
+        mark_files_as_processed(file_paths)
+    publish_data_change(
+        inserted_records=rows,
+        deleted_invoice_ids=list({str(row['invoice_id']) for row in rows if row.get('invoice_id')})
+    )
+
+def create_invoice_watcher(directory: str = INVOICES_DIR) -> InvoiceDirectoryWatcher:
+    """Folder watcher wired to the API's extractor, processed-files tracker and storage"""
+    return InvoiceDirectoryWatcher(
+        directory,
+        process_file=extract_invoice_file,
+        is_processed=is_file_processed,
+        on_batch=ingest_invoice_batch
+    )
+
 def delete_pdf_files(filenames: List[str]) -> List[str]:
     """
     Delete PDF files from the invoices directory
@@ -324,12 +472,12 @@ def initialize_csv_if_needed():
     """Initialize CSV file with headers if it doesn't exist"""
     global github_storage, use_github_storage
     
-    # Check if we have data in GitHub
+    # Check if we have data in GitHub (metadata only: the CSV itself is not downloaded at startup)
     if use_github_storage and github_storage:
         try:
-            df = github_storage.read_csv_as_dataframe()
-            if df is not None and not df.empty:
-                print("✅ CSV data exists in GitHub repository")
+            metadata = github_storage.get_file_metadata()
+            if metadata is not None and metadata.get('size'):
+                print(f"✅ CSV data exists in GitHub repository ({metadata['size']} bytes)")
                 return
         except Exception as e:
             print(f"Error checking GitHub CSV: {e}")
@@ -339,8 +487,8 @@ def initialize_csv_if_needed():
         try:
             # Create empty CSV with headers
             df = pd.DataFrame(columns=extractor.csv_fields if hasattr(extractor, 'csv_fields') else [])
-            df.to_csv(CSV_FILE, index=False)
-            print("📁 Initialized local CSV file with headers")
+            write_local_tables(*split_invoice_rows(df))
+            print("📁 Initialized local CSV files with headers")
             
             # Also upload to GitHub if configured
             if use_github_storage and github_storage:
@@ -356,6 +504,7 @@ def initialize_csv_if_needed():
 @app.on_event("startup")
 async def startup_event():
     """Initialize the application on startup"""
+    global invoice_watcher, extraction_pool, app_ready
     print("🚀 Starting Invoice Processing API...")
     
     # Initialize GitHub storage
@@ -371,6 +520,30 @@ async def startup_event():
             print(f"📊 CSV URL: {raw_url}")
     else:
         print("📁 Running with local CSV storage")
+    
+    # Start the extraction workers before the watcher, which uses them
+    if POOL_WORKERS > 0 or EXTRACTION_SANDBOX:
+        extraction_pool = ExtractionPool(POOL_WORKERS or 1).start()
+    
+    # Start the drop-folder watcher if enabled
+    if INVOICE_WATCH_ENABLED:
+        invoice_watcher = create_invoice_watcher()
+        invoice_watcher.start()
+    
+    # Compute the detailed health report in the background; /health/ serves the last one
+    health_monitor.start()
+    app_ready = True
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the folder watcher, storing any rows it still buffers, then the extraction workers"""
+    global app_ready
+    app_ready = False
+    health_monitor.stop()
+    if invoice_watcher is not None:
+        invoice_watcher.stop()
+    if extraction_pool is not None:
+        extraction_pool.close()
 
 @app.get("/")
 async def root():
@@ -390,7 +563,12 @@ async def root():
             "get_data": "/data/",
             "dashboard": "/dash_app/",
             "health": "/health/",
-            "csv_url": "/csv-url/"
+            "liveness": "/livez",
+            "readiness": "/readyz",
+            "csv_url": "/csv-url/",
+            "dashboard_cache_stats": "/dashboard-cache-stats/",
+            "extraction_metrics": "/extraction-metrics/",
+            "metrics": "/metrics"
         }
     }
 
@@ -410,6 +588,24 @@ async def get_csv_url():
             "note": "CSV is stored locally and not accessible via URL"
         }
 
+@app.get("/dashboard-cache-stats/")
+async def dashboard_cache_stats():
+    """Get hit/miss counters of the dashboard result caches"""
+    return get_cache_stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Service metrics in the Prometheus text exposition format"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/extraction-metrics/")
+async def get_extraction_metrics():
+    """Latency histograms of the extraction stages, counts of the product tier that succeeded and worker pool use"""
+    snapshot = extraction_metrics.snapshot()
+    if extraction_pool is not None:
+        snapshot['pool'] = extraction_pool.snapshot()
+    return snapshot
+
 @app.get("/dashboard/")
 async def get_dashboard():
     """Redirect directly to the dashboard"""
@@ -439,10 +635,14 @@ async def delete_invoices(request: DeleteInvoiceRequest):
         
         # Delete records from CSV
         try:
-            deleted_count = delete_records_from_csv(request.invoice_ids)
+            with storage_lock:
+                deleted_count = delete_records_from_csv(request.invoice_ids)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error deleting from CSV: {str(e)}")
         
+        # Publish the deletion so the dashboard drops these invoices from its cached data
+        publish_data_change(deleted_invoice_ids=request.invoice_ids)
+        
         # Extract filenames from the found records and delete PDF files
         filenames_to_delete = []
         for record in found_records:
@@ -511,14 +711,14 @@ async def list_invoices():
         
         # Create a list of invoices with their basic info
         invoices = []
-        for _, row in df.iterrows():
+        for row in json_records(df):
             invoice_info = {
                 "id": str(row[id_column]),
                 "filename": row.get('filename', 'unknown'),
             }
             # Add other relevant fields if they exist
             for field in ['invoice_number', 'date', 'total_amount', 'vendor']:
-                if field in row and pd.notna(row[field]):
+                if row.get(field) is not None:
                     invoice_info[field] = row[field]
             
             invoices.append(invoice_info)
@@ -549,12 +749,14 @@ async def upload_invoices(files: Union[List[UploadFile], UploadFile] = File(...)
     processed_files = []
     total_new_records = 0
     errors = []
+    failed_files = []  # {"filename", "reason", "error"} of every PDF that could not be extracted
     all_new_data = []
     skipped_files = []
     
     for file in files:
         if not file.filename.endswith('.pdf'):
             errors.append(f"{file.filename}: Only PDF files are allowed")
+            upload_files.labels('rejected').inc()
             continue
         
         file_path = os.path.join(INVOICES_DIR, file.filename)
@@ -570,11 +772,13 @@ async def upload_invoices(files: Union[List[UploadFile], UploadFile] = File(...)
                     "filename": file.filename,
                     "reason": "Already processed (no changes detected)"
                 })
+                upload_files.labels('skipped').inc()
                 continue
             
             # Process the new/changed file
             print(f"Processing new/changed file: {file.filename}")
-            invoice_data = extractor.process_invoice(file_path)
+            extraction = {}
+            invoice_data = await extract_invoice_file_async(file_path, extraction)
             
             if invoice_data:
                 all_new_data.extend(invoice_data)
@@ -582,16 +786,23 @@ async def upload_invoices(files: Union[List[UploadFile], UploadFile] = File(...)
                 
                 processed_files.append({
                     "filename": file.filename,
-                    "records_added": len(invoice_data)
+                    "records_added": len(invoice_data),
+                    "extraction": extraction
                 })
                 total_new_records += len(invoice_data)
+                upload_files.labels('processed').inc()
                 print(f"Successfully processed {file.filename}: {len(invoice_data)} records")
             else:
                 errors.append(f"{file.filename}: No data extracted")
+                failed_files.append({"filename": file.filename, "reason": "no_data", "error": "No data extracted"})
+                upload_files.labels('empty').inc()
                 
         except Exception as e:
             error_msg = f"{file.filename}: {str(e)}"
             errors.append(error_msg)
+            # Rejected and sandbox-limited PDFs carry why they failed (see ExtractionFailed)
+            failed_files.append({"filename": file.filename, "reason": getattr(e, 'reason', 'error'), "error": str(e)})
+            upload_files.labels('error').inc()
             print(f"Error processing {file.filename}: {e}")
             
             # Clean up file on error
@@ -601,11 +812,19 @@ async def upload_invoices(files: Union[List[UploadFile], UploadFile] = File(...)
                 except:
                     pass
     
+    upload_rows.observe(total_new_records)
+    
     # Append all new data to CSV in one operation
     if all_new_data:
         try:
-            append_to_csv(all_new_data)
+            with storage_lock:
+                append_to_csv(all_new_data)
             print(f"Added {len(all_new_data)} total records to CSV")
+            # Invoices extracted again replace their stored rows, so drop those from the dashboard first
+            publish_data_change(
+                inserted_records=all_new_data,
+                deleted_invoice_ids=list({str(row['invoice_id']) for row in all_new_data if row.get('invoice_id')})
+            )
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error saving data to CSV: {str(e)}")
     
@@ -621,90 +840,134 @@ async def upload_invoices(files: Union[List[UploadFile], UploadFile] = File(...)
         "message": f"Upload completed. Processed {len(processed_files)} new/changed files",
         "processed_files": processed_files,
         "skipped_files": skipped_files,
+        "failed_files": failed_files,
         "total_new_records": total_new_records,
         "total_records": total_records,
         "storage_type": "GitHub" if use_github_storage else "Local",
         "errors": errors if errors else None
     }
 
-@app.get("/health/")
-async def health_check():
-    """Health check endpoint"""
+# Hashes of the PDFs seen by the health check, by filename: (size, mtime_ns, md5), so unchanged files are not re-read
+health_file_hashes = {}
+# Record count of the stored tables and the storage version it was counted at (see storage_version)
+health_storage_count = {"version": None, "records": 0}
+
+def storage_version(github_metadata: Optional[dict] = None):
+    """Value that changes whenever the stored tables do: the GitHub sha of the invoice CSV, or local file stats"""
+    if github_metadata is not None:
+        return github_metadata.get('sha')
+    stats = [os.stat(path) for path in (CSV_FILE, LINE_ITEMS_CSV_FILE) if os.path.exists(path)]
+    return tuple((stat.st_size, stat.st_mtime_ns) for stat in stats)
+
+def compute_health_report() -> dict:
+    """
+    Detailed health of the file processing and storage, computed by health_monitor in the background
+    PDFs are only re-hashed when their size or mtime changed, and stored records only re-counted
+    when the storage version did
+    """
+    pdf_count = 0
+    processed_count = 0
+    unprocessed_count = 0
+    
     try:
-        # Get processing status
-        pdf_count = 0
-        processed_count = 0
-        unprocessed_count = 0
-        
-        try:
-            if os.path.exists(INVOICES_DIR):
-                pdf_files = [f for f in os.listdir(INVOICES_DIR) if f.endswith('.pdf')]
-                pdf_count = len(pdf_files)
-                
-                for filename in pdf_files:
-                    file_path = os.path.join(INVOICES_DIR, filename)
-                    if is_file_processed(file_path):
-                        processed_count += 1
-                    else:
-                        unprocessed_count += 1
-                        
-        except Exception as e:
-            print(f"Warning: Could not get processing status: {e}")
-        
-        # Get CSV record count
-        csv_records = 0
-        csv_accessible = False
-        csv_location = "none"
-        
-        try:
-            df = read_csv_data()
-            csv_records = len(df)
-            csv_accessible = True
-            if use_github_storage:
-                csv_location = "GitHub"
-            else:
-                csv_location = "Local"
-        except Exception as e:
-            print(f"Warning: Could not count CSV records: {e}")
-        
-        # GitHub storage status
-        github_status = {
-            "configured": use_github_storage,
-            "accessible": False,
-            "csv_url": None
-        }
-        
-        if use_github_storage and github_storage:
-            try:
-                # Test GitHub connectivity
-                content, sha = github_storage.get_file_content()
-                github_status["accessible"] = True
-                github_status["csv_url"] = github_storage.get_raw_csv_url()
-            except Exception as e:
-                print(f"GitHub storage not accessible: {e}")
-        
-        return {
-            "status": "healthy",
-            "message": "Invoice Processing API is running",
-            "dashboard_status": "mounted at /dash_app/",
-            "storage": {
-                "type": csv_location,
-                "csv_records": csv_records,
-                "csv_accessible": csv_accessible,
-                "github": github_status
-            },
-            "files": {
-                "invoices_directory_exists": os.path.exists(INVOICES_DIR),
-                "total_pdf_files": pdf_count,
-                "processed_files": processed_count,
-                "unprocessed_files": unprocessed_count
-            }
-        }
+        if os.path.exists(INVOICES_DIR):
+            tracker = load_processed_files_tracker()
+            pdf_files = [f for f in os.listdir(INVOICES_DIR) if f.endswith('.pdf')]
+            pdf_count = len(pdf_files)
+            
+            for filename in pdf_files:
+                file_path = os.path.join(INVOICES_DIR, filename)
+                try:
+                    stat = os.stat(file_path)
+                    cached = health_file_hashes.get(filename)
+                    if cached is None or cached[:2] != (stat.st_size, stat.st_mtime_ns):
+                        cached = (stat.st_size, stat.st_mtime_ns, get_file_hash(file_path))
+                        health_file_hashes[filename] = cached
+                    processed = tracker.get(filename) == cached[2]
+                except OSError:
+                    processed = False
+                if processed:
+                    processed_count += 1
+                else:
+                    unprocessed_count += 1
+            
+            for filename in set(health_file_hashes) - set(pdf_files):
+                del health_file_hashes[filename]
+                    
     except Exception as e:
-        return {
-            "status": "error",
-            "message": f"Health check failed: {str(e)}"
+        print(f"Warning: Could not get processing status: {e}")
+    
+    # GitHub storage status, from a metadata-only call
+    github_status = {
+        "configured": use_github_storage,
+        "accessible": False,
+        "csv_url": None
+    }
+    github_metadata = None
+    
+    if use_github_storage and github_storage:
+        github_metadata = github_storage.get_file_metadata()
+        if github_metadata is not None:
+            github_status["accessible"] = True
+            github_status["csv_url"] = github_storage.get_raw_csv_url()
+        else:
+            print("GitHub storage not accessible")
+    
+    # Get CSV record count, reading the tables only when they changed since the last count
+    csv_accessible = False
+    csv_location = "none"
+    
+    try:
+        version = storage_version(github_metadata)
+        if version != health_storage_count["version"]:
+            health_storage_count["records"] = len(read_csv_data())
+            health_storage_count["version"] = version
+        csv_accessible = True
+        csv_location = "GitHub" if use_github_storage else "Local"
+    except Exception as e:
+        print(f"Warning: Could not count CSV records: {e}")
+    
+    return {
+        "status": "healthy",
+        "message": "Invoice Processing API is running",
+        "dashboard_status": "mounted at /dash_app/",
+        "storage": {
+            "type": csv_location,
+            "csv_records": health_storage_count["records"],
+            "csv_accessible": csv_accessible,
+            "github": github_status
+        },
+        "files": {
+            "invoices_directory_exists": os.path.exists(INVOICES_DIR),
+            "total_pdf_files": pdf_count,
+            "processed_files": processed_count,
+            "unprocessed_files": unprocessed_count
         }
+    }
+
+# Recomputes the health report every HEALTH_INTERVAL_SECONDS once the app has started
+health_monitor = HealthMonitor(compute_health_report)
+
+@app.get("/health/")
+async def health_check():
+    """Detailed health report, served from memory; report.age_seconds and report.stale say how current it is"""
+    return health_monitor.snapshot()
+
+@app.get("/livez")
+async def liveness():
+    """Liveness probe: the process serves requests"""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readiness():
+    """Readiness probe: startup has finished and the extraction workers (if any) can take jobs"""
+    checks = {
+        "startup": app_ready,
+        "extraction_pool": extraction_pool is None or extraction_pool.error is None
+    }
+    ready = all(checks.values())
+    return JSONResponse({"status": "ready" if ready else "not ready", "checks": checks},
+                        status_code=200 if ready else 503)
 
 @app.get("/data/")
 async def get_data():
@@ -720,8 +983,8 @@ async def get_data():
                 "storage_type": "GitHub" if use_github_storage else "Local"
             }
         
-        # Convert DataFrame to list of dictionaries
-        data = df.to_dict('records')
+        # Convert DataFrame to list of dictionaries, formatted as stored (YYYY-MM-DD dates)
+        data = json_records(df)
         
         return {
             "message": f"Successfully retrieved {len(data)} records",
@@ -0,0 +1,324 @@
+# metrics.py
+"""
+In-process metrics for the invoice pipeline, exposed in the Prometheus text format
+Histograms use fixed cumulative buckets (as Prometheus does), so recording is O(log buckets)
+and memory does not grow with the number of observations.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Seconds, from sub-millisecond regex passes to slow multi-page camelot runs
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    """Monotonically increasing value"""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """Value that goes up and down, or is read from a function at collection time"""
+
+    def __init__(self, function: Optional[Callable[[], float]] = None):
+        self.function = function
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> float:
+        return self.function() if self.function is not None else self._value
+
+    def set(self, value: float):
+        self._value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+
+class Histogram:
+    """Counts of observed values per bucket, plus their total count and sum"""
+
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # The last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observe the seconds spent in the with block"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def cumulative_counts(self) -> list:
+        """Number of observations <= each bucket bound, the last entry being the +Inf bucket"""
+        with self._lock:
+            counts = list(self._counts)
+        total = 0
+        cumulative = []
+        for value in counts:
+            total += value
+            cumulative.append(total)
+        return cumulative
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate of the q-quantile, interpolated linearly within its bucket"""
+        cumulative = self.cumulative_counts()
+        if not cumulative[-1]:
+            return None
+        rank = q * cumulative[-1]
+        index = bisect.bisect_left(cumulative, rank)
+        if index >= len(self.buckets):
+            return self.buckets[-1]
+        lower = self.buckets[index - 1] if index > 0 else 0.0
+        below = cumulative[index - 1] if index > 0 else 0
+        in_bucket = cumulative[index] - below
+        return lower + (self.buckets[index] - lower) * ((rank - below) / in_bucket if in_bucket else 1.0)
+
+    def snapshot(self) -> dict:
+        cumulative = self.cumulative_counts()
+        quantiles = {name: self.quantile(q) for name, q in [('p50', 0.5), ('p95', 0.95), ('p99', 0.99)]}
+        return {
+            'count': cumulative[-1],
+            'sum': round(self.sum, 6),
+            'mean': round(self.sum / cumulative[-1], 6) if cumulative[-1] else None,
+            **{name: round(value, 6) if value is not None else None for name, value in quantiles.items()},
+            'buckets': {**{str(bound): count for bound, count in zip(self.buckets, cumulative)},
+                        '+Inf': cumulative[-1]}
+        }
+
+
+class MetricFamily:
+    """
+    A named metric with one child (Counter, Gauge or Histogram) per combination of label values
+    Use family.labels(value, ...) to get a child; a family without labels has a single child, labels()
+    """
+
+    def __init__(self, name: str, documentation: str, metric_type: str, labelnames: Iterable[str],
+                 factory: Callable[[], object]):
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def children(self) -> List[Tuple[Dict[str, str], object]]:
+        with self._lock:
+            items = list(self._children.items())
+        return [(dict(zip(self.labelnames, key)), child) for key, child in items]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class MetricsRegistry:
+    """Metric families plus collector functions, rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._families: Dict[str, MetricFamily] = {}
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+        self._lock = threading.Lock()
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        with self._lock:
+            # Registering the same name again (e.g. a module imported twice) returns the existing family
+            return self._families.setdefault(family.name, family)
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, 'counter', labelnames, Counter))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+              function: Optional[Callable[[], float]] = None) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, 'gauge', labelnames, lambda: Gauge(function)))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> MetricFamily:
+        buckets = tuple(buckets)
+        return self._register(MetricFamily(name, documentation, 'histogram', labelnames,
+                                           lambda: Histogram(buckets)))
+
+    def register_collector(self, collector: Callable[[], Iterable[tuple]]):
+        """
+        Add a function called on every scrape, returning (name, type, documentation, samples)
+        tuples with samples as [(labels dict, value)]; for values owned by other modules
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def unregister_collector(self, collector: Callable[[], Iterable[tuple]]):
+        with self._lock:
+            if collector in self._collectors:
+                self._collectors.remove(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            families = list(self._families.values())
+            collectors = list(self._collectors)
+
+        output = []
+        for family in families:
+            output.append(f"# HELP {family.name} {family.documentation}")
+            output.append(f"# TYPE {family.name} {family.type}")
+            for labels, child in family.children():
+                if family.type == 'histogram':
+                    cumulative = child.cumulative_counts()
+                    for bound, count in zip(child.buckets + (float('inf'),), cumulative):
+                        bucket_labels = _format_labels({**labels, 'le': _format_value(bound)})
+                        output.append(f"{family.name}_bucket{bucket_labels} {count}")
+                    output.append(f"{family.name}_sum{_format_labels(labels)} {_format_value(child.sum)}")
+                    output.append(f"{family.name}_count{_format_labels(labels)} {cumulative[-1]}")
+                else:
+                    output.append(f"{family.name}{_format_labels(labels)} {_format_value(child.value)}")
+
+        for collector in collectors:
+            try:
+                for name, metric_type, documentation, samples in collector():
+                    output.append(f"# HELP {name} {documentation}")
+                    output.append(f"# TYPE {name} {metric_type}")
+                    for labels, value in samples:
+                        output.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+
+        return '\n'.join(output) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+
+class PrometheusMiddleware:
+    """
+    ASGI middleware timing every HTTP request by method, route template and status code
+    Routes are labelled by their path template (/invoices/, not the raw URL), and requests
+    to mounted apps by the mount path, so label cardinality stays bounded.
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = REGISTRY):
+        self.app = app
+        self.duration = registry.histogram('http_request_duration_seconds', 'HTTP request latency',
+                                           ['method', 'route', 'status'])
+        self.in_progress = registry.gauge('http_requests_in_progress', 'HTTP requests being served').labels()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        self.in_progress.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.in_progress.dec()
+            # The router stores the matched route in the scope; mounts only set root_path
+            route = scope.get('route')
+            route = getattr(route, 'path', None) or scope.get('root_path') or 'unmatched'
+            self.duration.labels(scope['method'], route, status).observe(time.perf_counter() - started)
+
+
+class ExtractionMetrics:
+    """Per-stage latency histograms and product tier counts of InvoiceExtractor.process_invoice_tables"""
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY):
+        self.stage_seconds = registry.histogram('invoice_extraction_stage_seconds',
+                                                'Seconds spent in each invoice extraction stage', ['stage'])
+        self.tiers = registry.counter('invoice_extraction_files_total',
+                                      'Extracted invoices by the product extraction tier that succeeded', ['tier'])
+        self.line_items = registry.histogram('invoice_extraction_line_items', 'Line items extracted per file',
+                                             buckets=(1, 2, 5, 10, 20, 50, 100, 200)).labels()
+        self.layouts = registry.counter('invoice_extraction_layout_cache_total',
+                                        'Table layout cache lookups by result (hit, miss, invalid)', ['result'])
+        self.regex_timeouts = registry.counter('invoice_extraction_regex_timeouts_total',
+                                               'Field patterns that gave up on their time limit, leaving the field empty',
+                                               ['field'])
+
+    def record(self, stats: dict):
+        """Add the stats dict filled by process_invoice_tables(pdf_path, stats), or process_pdf for a multi-invoice PDF"""
+        if 'segments' in stats:
+            self.stage_seconds.labels('split').observe(stats['stages']['split'])
+            for segment_stats in stats['segments']:
+                self.record(segment_stats)
+            return
+        for stage, seconds in stats.get('stages', {}).items():
+            self.stage_seconds.labels(stage).observe(seconds)
+        self.tiers.labels(stats.get('tier', 'none')).inc()
+        if 'line_items' in stats:
+            self.line_items.observe(stats['line_items'])
+        if 'layout' in stats:
+            self.layouts.labels(stats['layout']).inc()
+        for field in stats.get('regex_timeouts', []):
+            self.regex_timeouts.labels(field).inc()
+
+    def snapshot(self) -> dict:
+        tiers = {labels['tier']: int(counter.value) for labels, counter in self.tiers.children()}
+        return {
+            'files': sum(tiers.values()),
+            'product_tiers': tiers,
+            'layout_cache': {labels['result']: int(counter.value) for labels, counter in self.layouts.children()},
+            'regex_timeouts': {labels['field']: int(counter.value) for labels, counter in self.regex_timeouts.children()},
+            'stage_seconds': {labels['stage']: histogram.snapshot()
+                              for labels, histogram in self.stage_seconds.children()},
+            'line_items_per_file': self.line_items.snapshot()
+        }
+
+
+extraction_metrics = ExtractionMetrics()
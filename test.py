@@ -1,5 +1,5 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
@@ -9,7 +9,9 @@ import pandas as pd
 import uvicorn
 import json
 import hashlib
+import asyncio
 from fastapi.middleware.wsgi import WSGIMiddleware
+from starlette.concurrency import run_in_threadpool
 from pymongo import MongoClient
 import gridfs
 from datetime import datetime
@@ -22,7 +24,10 @@ load_dotenv()
 
 # Import your existing classes
 from invoice_extractor import InvoiceExtractor
-from dashboard import app as dash_app, increment_data_version
+from invoice_workers import POOL_WORKERS, ExtractionPool
+from invoice_schema import LINE_COLUMNS, normalize_invoice_frame
+from dashboard import app as dash_app, increment_data_version, publish_data_change, set_data_loader
+from metrics import REGISTRY, PrometheusMiddleware, extraction_metrics
 
 # Initialize FastAPI
 app = FastAPI(title="Invoice Processing API", version="1.0.0")
@@ -40,6 +45,9 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+# Time every request (added last, so it is the outermost middleware and sees the full latency)
+app.add_middleware(PrometheusMiddleware)
+
 # Pydantic models for request/response
 class DeleteInvoiceRequest(BaseModel):
     invoice_ids: List[str]  # List of invoice IDs to delete
@@ -55,6 +63,15 @@ class DeleteInvoiceResponse(BaseModel):
 # Global variables
 extractor = InvoiceExtractor()
 
+# Set STORE_EXTRACTION_STATS=1 to keep each invoice's stage timings and product tier in its document
+STORE_EXTRACTION_STATS = os.getenv("STORE_EXTRACTION_STATS", "").lower() in ("1", "true", "yes")
+
+# Set INVOICE_POOL_WORKERS=N to extract in N warm worker processes instead of the API process
+# With EXTRACTION_SANDBOX on (the default) extraction always runs in at least one worker, under the
+# INVOICE_JOB_* memory, CPU and time limits, so one bad PDF cannot take the API down
+EXTRACTION_SANDBOX = os.getenv("EXTRACTION_SANDBOX", "1").lower() in ("1", "true", "yes")
+extraction_pool = None
+
 # MongoDB connection
 try:
     MONGODB_URI = os.getenv("MONGODB_URI")
@@ -127,26 +144,35 @@ def delete_file_from_gridfs(file_id: str) -> bool:
         print(f"Error deleting file from GridFS: {e}")
         return False
 
-def save_invoice_data_to_mongodb(invoice_data: List[dict], filename: str, file_hash: str, gridfs_file_id: str):
-    """Save invoice data to MongoDB"""
+def save_invoice_to_mongodb(header: dict, lines: List[dict], filename: str, file_hash: str, gridfs_file_id: str,
+                            extraction: Optional[dict] = None):
+    """
+    Save one invoice to MongoDB as a single document keyed by invoice_id, with its line items
+    embedded in a line_items array. A previously stored invoice with the same ID is replaced.
+    extraction (the stats of process_invoice_tables) is stored with it when given.
+    Returns the number of line items saved.
+    """
     try:
-        # Prepare documents for insertion
-        documents = []
-        for data in invoice_data:
-            document = {
-                **data,
-                "filename": filename,
-                "file_hash": file_hash,
-                "gridfs_file_id": gridfs_file_id,
-                "created_at": datetime.utcnow(),
-                "processed_at": datetime.utcnow()
-            }
-            documents.append(document)
+        document = {
+            **header,
+            "line_items": [{key: value for key, value in line.items() if key != "invoice_id"} for line in lines],
+            "filename": filename,
+            "file_hash": file_hash,
+            "gridfs_file_id": gridfs_file_id,
+            "created_at": datetime.utcnow(),
+            "processed_at": datetime.utcnow()
+        }
+        if extraction is not None:
+            document["extraction"] = extraction
         
-        # Insert all documents
-        result = collection.insert_many(documents)
-        print(f"Inserted {len(result.inserted_ids)} records to MongoDB")
-        return len(result.inserted_ids)
+        if header.get("invoice_id"):
+            # Also removes per-line documents written before line items were embedded
+            replaced = collection.delete_many({"invoice_id": header["invoice_id"]}).deleted_count
+            if replaced:
+                print(f"Replacing {replaced} stored document(s) for invoice {header['invoice_id']}")
+        collection.insert_one(document)
+        print(f"Inserted invoice {header.get('invoice_id')} with {len(lines)} line items to MongoDB")
+        return len(lines)
     except Exception as e:
         print(f"Error saving invoice data to MongoDB: {e}")
         raise
@@ -223,86 +249,246 @@ def delete_records_from_mongodb(invoice_ids: List[str]) -> int:
         print(f"Error deleting records from MongoDB: {e}")
         raise HTTPException(status_code=500, detail=f"Error deleting from database: {str(e)}")
 
-def get_all_invoice_data_as_dataframe() -> pd.DataFrame:
-    """Get all invoice data from MongoDB as a pandas DataFrame for the dashboard"""
+# Columns read back from MongoDB for the dashboard (storage bookkeeping fields are not transferred)
+DASHBOARD_COLUMNS = extractor.csv_fields + ['filename']
+READ_BATCH_SIZE = int(os.getenv("MONGODB_READ_BATCH_SIZE", "5000"))
+
+def _typed_chunk(buffers: dict) -> pd.DataFrame:
+    """Build a typed DataFrame chunk from per-column value buffers"""
+    chunk = pd.DataFrame({col: pd.Series(values, dtype=object) for col, values in buffers.items()})
+    return normalize_invoice_frame(chunk, derive_columns=False, fill_missing=False,
+                                   extra_date_columns=['created_at', 'processed_at'])
+
+def get_all_invoice_data_as_dataframe(columns: Optional[List[str]] = None, start_date=None, end_date=None,
+                                      batch_size: int = READ_BATCH_SIZE) -> pd.DataFrame:
+    """
+    Get invoice data from MongoDB as a pandas DataFrame of line item rows for the dashboard
+    Only the requested columns are projected, the invoice_date range is pushed down to the query,
+    and the cursor is consumed in batches that are typed column by column as they arrive.
+    Each embedded line item becomes one row carrying its invoice's fields.
+    """
+    columns = list(columns) if columns else list(DASHBOARD_COLUMNS)
+    header_columns = [col for col in columns if col not in LINE_COLUMNS]
+    line_columns = [col for col in columns if col in LINE_COLUMNS]
     try:
-        # Get all records from MongoDB
-        cursor = collection.find({})
-        records = list(cursor)
-        
-        if not records:
-            print("No records found in MongoDB")
-            return pd.DataFrame(columns=[
-                'invoice_id', 'invoice_date', 'customer_name', 'customer_id',
-                'customer_location', 'customer_type', 'customer_trn', 'payment_status',
-                'due_date', 'product', 'qty', 'unit_price', 'total', 'amount_excl_vat',
-                'vat', 'profit', 'profit_margin', 'cost_price', 'days_to_payment'
-            ])
-        
-        # Convert to DataFrame
-        df = pd.DataFrame(records)
-        
-        # Convert MongoDB ObjectId to string
-        df['_id'] = df['_id'].astype(str)
+        match = build_date_match_stage(start_date, end_date)["$match"]
+        projection = {"_id": 0, **{col: 1 for col in header_columns}}
+        if line_columns:
+            # Documents stored before line items were embedded hold their single line inline
+            projection.update({"line_items": 1, **{col: 1 for col in line_columns}})
+        cursor = collection.find(match, projection).batch_size(batch_size)
         
-        # Convert date columns to datetime
-        date_columns = ['invoice_date', 'due_date', 'created_at', 'processed_at']
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
+        chunks = []
+        buffers = {col: [] for col in columns}
+        buffered = 0
+        for document in cursor:
+            for line in (document.get("line_items") or [document]) if line_columns else [document]:
+                for col in header_columns:
+                    buffers[col].append(document.get(col))
+                for col in line_columns:
+                    buffers[col].append(line.get(col))
+                buffered += 1
+            if buffered >= batch_size:
+                chunks.append(_typed_chunk(buffers))
+                buffers = {col: [] for col in columns}
+                buffered = 0
+        if buffered:
+            chunks.append(_typed_chunk(buffers))
         
-        # Ensure numeric columns are properly typed
-        numeric_cols = ['qty', 'unit_price', 'total', 'amount_excl_vat', 'vat', 
-                         'profit', 'profit_margin', 'cost_price', 'days_to_payment']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+        if not chunks:
+            print("No records found in MongoDB")
+            return pd.DataFrame(columns=columns)
         
+        df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
         print(f"Successfully loaded {len(df)} invoice records from MongoDB")
         return df
     except Exception as e:
         print(f"Error loading data from MongoDB: {e}")
         return pd.DataFrame()
 
-def create_temp_csv_for_dashboard():
-    """Create a temporary CSV file for the dashboard to read"""
+# The dashboard reads its full dataset straight from MongoDB and is kept current with published deltas
+set_data_loader(get_all_invoice_data_as_dataframe)
+
+def _as_double(field: str) -> dict:
+    """
+    Aggregation expression reading a stored field as a double (extracted amounts are stored as strings)
+    field is a field path without the leading '$', or a '$$variable.path' expression
+    """
+    return {"$convert": {"input": field if field.startswith("$") else f"${field}",
+                         "to": "double", "onError": 0.0, "onNull": 0.0}}
+
+# Line items of an invoice document; documents stored before line items were embedded hold one line inline
+LINE_ITEMS_EXPRESSION = {"$ifNull": ["$line_items", [{"product": "$product", "qty": "$qty", "total": "$total"}]]}
+
+def _normalise_date_bound(value) -> Optional[str]:
+    """Convert a date-like value to the 'YYYY-MM-DD' string format used by invoice_date"""
+    if value is None or value == "":
+        return None
+    parsed = pd.to_datetime(value, errors='coerce')
+    if pd.isna(parsed):
+        return None
+    return parsed.strftime("%Y-%m-%d")
+
+def build_date_match_stage(start_date=None, end_date=None) -> dict:
+    """
+    Build a $match stage restricting invoice_date to [start_date, end_date]
+    invoice_date is stored as 'YYYY-MM-DD' so string comparison keeps date order
+    """
+    date_range = {}
+    start = _normalise_date_bound(start_date)
+    end = _normalise_date_bound(end_date)
+    if start:
+        date_range["$gte"] = start
+    if end:
+        date_range["$lte"] = end
+    return {"$match": {"invoice_date": date_range} if date_range else {}}
+
+def _group_revenue_by(field: str) -> List[dict]:
+    """Facet sub-pipeline summing invoice totals per value of an invoice-level field"""
+    return [
+        {"$group": {"_id": f"${field}", "revenue": {"$sum": "$_invoice_total"}}},
+        {"$sort": {"revenue": -1}}
+    ]
+
+def _group_lines_by_product() -> List[dict]:
+    """Facet sub-pipeline summing line item totals and quantities per product"""
+    return [
+        {"$unwind": "$_lines"},
+        {"$group": {
+            "_id": "$_lines.product",
+            "revenue": {"$sum": _as_double("$_lines.total")},
+            "qty": {"$sum": _as_double("$_lines.qty")}
+        }},
+        {"$sort": {"revenue": -1}}
+    ]
+
+def build_dashboard_metrics_pipeline(start_date=None, end_date=None) -> List[dict]:
+    """
+    Build the aggregation pipeline computing every dashboard KPI and group-by in one round trip
+    Mirrors the calculations of the dashboard cube: revenue sums line items, while VAT, amount
+    excluding VAT and profit are invoice-level and summed once per invoice document
+    """
+    month = {"$substrCP": ["$invoice_date", 0, 7]}
+    return [
+        build_date_match_stage(start_date, end_date),
+        {"$addFields": {"_lines": LINE_ITEMS_EXPRESSION}},
+        {"$addFields": {"_invoice_total": {"$sum": {
+            "$map": {"input": "$_lines", "as": "line", "in": _as_double("$$line.total")}
+        }}}},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": None,
+                    "total_revenue": {"$sum": "$_invoice_total"},
+                    "paid_revenue": {"$sum": {
+                        "$cond": [{"$eq": ["$payment_status", "Paid"]}, "$_invoice_total", 0.0]
+                    }},
+                    "line_items": {"$sum": {"$size": "$_lines"}}
+                }}
+            ],
+            "invoices": [
+                {"$match": {"invoice_id": {"$ne": None}}},
+                {"$group": {"_id": "$invoice_id", "total": {"$sum": "$_invoice_total"}}},
+                {"$group": {"_id": None, "invoice_count": {"$sum": 1}, "avg_invoice": {"$avg": "$total"}}}
+            ],
+            "monthly": [
+                {"$match": {"invoice_date": {"$type": "string"}}},
+                {"$group": {
+                    "_id": month,
+                    "revenue": {"$sum": "$_invoice_total"},
+                    "vat": {"$sum": _as_double("vat")},
+                    "amount_excl_vat": {"$sum": _as_double("amount_excl_vat")},
+                    "profit": {"$sum": _as_double("profit")}
+                }},
+                {"$addFields": {"margin": {
+                    "$cond": [
+                        {"$gt": ["$amount_excl_vat", 0]},
+                        {"$multiply": [{"$divide": ["$profit", "$amount_excl_vat"]}, 100]},
+                        None
+                    ]
+                }}},
+                {"$sort": {"_id": 1}}
+            ],
+            "product": _group_lines_by_product(),
+            "location": _group_revenue_by("customer_location"),
+            "customer_type": _group_revenue_by("customer_type")
+        }}
+    ]
+
+def get_dashboard_metrics(start_date=None, end_date=None) -> dict:
+    """
+    Compute dashboard KPIs and group-bys server-side with a MongoDB aggregation pipeline
+    Only the aggregated results are transferred, never the raw invoice documents
+    """
     try:
-        df = get_all_invoice_data_as_dataframe()
-        if not df.empty:
-            # Remove MongoDB-specific columns for CSV
-            columns_to_remove = ['_id', 'file_hash', 'gridfs_file_id', 'created_at', 'processed_at']
-            df_csv = df.drop(columns=[col for col in columns_to_remove if col in df.columns])
-            
-            # Save to temporary CSV file
-            df_csv.to_csv('invoice_data.csv', index=False)
-            print(f"Created temporary CSV with {len(df_csv)} records")
-        else:
-            # Create empty CSV with headers
-            empty_df = pd.DataFrame(columns=[
-                'invoice_id', 'invoice_date', 'customer_name', 'customer_id',
-                'customer_location', 'customer_type', 'customer_trn', 'payment_status',
-                'due_date', 'product', 'qty', 'unit_price', 'total', 'amount_excl_vat',
-                'vat', 'profit', 'profit_margin', 'cost_price', 'days_to_payment'
-            ])
-            empty_df.to_csv('invoice_data.csv', index=False)
-            print("Created empty CSV file")
+        pipeline = build_dashboard_metrics_pipeline(start_date, end_date)
+        result = next(collection.aggregate(pipeline, allowDiskUse=True), {})
     except Exception as e:
-        print(f"Error creating temporary CSV: {e}")
+        print(f"Error aggregating dashboard metrics: {e}")
+        raise
+
+    totals = (result.get("totals") or [{}])[0]
+    invoices = (result.get("invoices") or [{}])[0]
+    total_revenue = totals.get("total_revenue", 0.0)
+    paid_revenue = totals.get("paid_revenue", 0.0)
+
+    def rename_id(rows: List[dict], key: str) -> List[dict]:
+        return [{key: row.pop("_id"), **row} for row in rows]
+
+    return {
+        "kpis": {
+            "total_revenue": total_revenue,
+            "invoice_count": invoices.get("invoice_count", 0),
+            "avg_invoice": invoices.get("avg_invoice") or 0.0,
+            "payment_rate": (paid_revenue / total_revenue * 100) if total_revenue > 0 else 0.0,
+            "line_items": totals.get("line_items", 0)
+        },
+        "monthly": rename_id(result.get("monthly", []), "month"),
+        "product": rename_id(result.get("product", []), "product"),
+        "location": rename_id(result.get("location", []), "customer_location"),
+        "customer_type": rename_id(result.get("customer_type", []), "customer_type"),
+        "date_range": {
+            "start_date": _normalise_date_bound(start_date),
+            "end_date": _normalise_date_bound(end_date)
+        }
+    }
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize the application on startup"""
+    global extraction_pool
     print("Starting Invoice Processing API...")
     try:
         # Test MongoDB connection
         db.command('ping')
         print("MongoDB connection successful")
-        
-        # Create temporary CSV for dashboard
-        create_temp_csv_for_dashboard()
-        print("Temporary CSV created for dashboard")
+
+        # Index the date field so dashboard aggregations can use it for range filtering,
+        # and the invoice key used to replace re-extracted invoices
+        collection.create_index("invoice_date")
+        collection.create_index("invoice_id")
     except Exception as e:
         print(f"Startup error: {e}")
+    
+    if POOL_WORKERS > 0 or EXTRACTION_SANDBOX:
+        extraction_pool = ExtractionPool(POOL_WORKERS or 1).start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the extraction workers"""
+    if extraction_pool is not None:
+        extraction_pool.close()
+
+async def extract_invoices(file_path: str, stats: dict) -> list:
+    """
+    Extract the (header, lines) of each invoice in a PDF, in the extraction workers when they run
+    (else in the thread pool), without blocking the event loop while it waits
+    """
+    if extraction_pool is not None:
+        invoices, worker_stats = await asyncio.wrap_future(extraction_pool.submit(file_path))
+        stats.update(worker_stats)
+        return invoices
+    return await run_in_threadpool(extractor.process_pdf, file_path, stats=stats)
 
 @app.get("/")
 async def root():
@@ -314,6 +500,9 @@ async def root():
             "delete_invoices": "/delete-invoices/",
             "list_invoices": "/invoices/",
             "dashboard": "/dash_app/",
+            "dashboard_metrics": "/dashboard-metrics/",
+            "extraction_metrics": "/extraction-metrics/",
+            "metrics": "/metrics",
             "health": "/health/"
         }
     }
@@ -323,6 +512,30 @@ async def get_dashboard():
     """Redirect directly to the dashboard"""
     return RedirectResponse(url="/dash_app/")
 
+@app.get("/dashboard-metrics/")
+async def dashboard_metrics(start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """
+    Get dashboard KPIs and group-bys aggregated inside MongoDB
+    Optional start_date / end_date (YYYY-MM-DD) restrict the invoice_date range
+    """
+    try:
+        return get_dashboard_metrics(start_date, end_date)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error computing dashboard metrics: {str(e)}")
+
+@app.get("/metrics")
+async def get_metrics():
+    """Service metrics in the Prometheus text exposition format"""
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/extraction-metrics/")
+async def get_extraction_metrics():
+    """Latency histograms of the extraction stages, counts of the product tier that succeeded and worker pool use"""
+    snapshot = extraction_metrics.snapshot()
+    if extraction_pool is not None:
+        snapshot['pool'] = extraction_pool.snapshot()
+    return snapshot
+
 @app.delete("/delete-invoices/")
 async def delete_invoices(request: DeleteInvoiceRequest):
     """
@@ -367,9 +580,10 @@ async def delete_invoices(request: DeleteInvoiceRequest):
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error deleting from database: {str(e)}")
         
-        # Update temporary CSV and increment data version for dashboard refresh
-        create_temp_csv_for_dashboard()
-        increment_data_version()
+        # Publish the deletion so the dashboard drops these invoices from its cached data
+        publish_data_change(
+            deleted_invoice_ids=request.invoice_ids + [str(r['invoice_id']) for r in found_records if r.get('invoice_id')]
+        )
         
         # Get remaining record count
         remaining_records = collection.count_documents({})
@@ -395,16 +609,19 @@ async def list_invoices():
     This helps users know which IDs they can delete
     """
     try:
-        cursor = collection.find({}, {
+        # The invoice total is the sum of its line items (embedded, or inline in older per-line documents)
+        cursor = collection.aggregate([{"$project": {
             "_id": 1, 
             "invoice_id": 1, 
             "filename": 1, 
             "invoice_number": 1, 
             "invoice_date": 1, 
-            "total": 1, 
+            "total": {"$sum": {
+                "$map": {"input": LINE_ITEMS_EXPRESSION, "as": "line", "in": _as_double("$$line.total")}
+            }},
             "customer_name": 1,
             "created_at": 1
-        })
+        }}])
         
         invoices = []
         for record in cursor:
@@ -445,15 +662,20 @@ async def upload_invoices(files: Union[List[UploadFile], UploadFile] = File(...)
         raise HTTPException(status_code=400, detail="No files provided")
     
     processed_files = []
-    total_new_records = 0
+    total_new_invoices = 0
+    total_new_line_items = 0
     errors = []
+    failed_files = []  # {"filename", "reason", "error"} of every PDF that could not be extracted
     skipped_files = []
+    inserted_rows = []
     
     for file in files:
         if not file.filename.endswith('.pdf'):
             errors.append(f"{file.filename}: Only PDF files are allowed")
             continue
         
+        gridfs_file_id = None
+        temp_file_path = f"/tmp/{file.filename}"
         try:
             # Read file content
             file_content = await file.read()
@@ -471,53 +693,82 @@ async def upload_invoices(files: Union[List[UploadFile], UploadFile] = File(...)
             gridfs_file_id = save_file_to_gridfs(file.filename, file_content)
             
             # Create temporary file for processing
-            temp_file_path = f"/tmp/{file.filename}"
             with open(temp_file_path, "wb") as temp_file:
                 temp_file.write(file_content)
             
-            # Process the invoice
+            # Process the file into the header and line items of each invoice it holds
             print(f"Processing new/changed file: {file.filename}")
-            invoice_data = extractor.process_invoice(temp_file_path)
-            
-            # Clean up temporary file
-            os.remove(temp_file_path)
+            extraction = {}
+            results = await extract_invoices(temp_file_path, extraction)
+            invoices = [(header, lines, invoice_stats) for (header, lines), invoice_stats
+                        in zip(results, extraction.get('segments', [extraction])) if lines]
+            extraction_metrics.record(extraction)
             
-            if invoice_data:
-                # Save to MongoDB
-                records_added = save_invoice_data_to_mongodb(
-                    invoice_data, file.filename, file_hash, gridfs_file_id
-                )
+            if invoices:
+                # Save to MongoDB, one document per invoice
+                line_items_added = 0
+                for header, lines, invoice_stats in invoices:
+                    line_items_added += save_invoice_to_mongodb(
+                        header, lines, file.filename, file_hash, gridfs_file_id,
+                        invoice_stats if STORE_EXTRACTION_STATS else None
+                    )
+                    inserted_rows.extend(
+                        {**header, **{field: line[field] for field in LINE_COLUMNS}, "filename": file.filename}
+                        for line in lines
+                    )
                 
                 processed_files.append({
                     "filename": file.filename,
-                    "records_added": records_added
+                    "invoices_added": len(invoices),
+                    "line_items_added": line_items_added,
+                    "extraction": extraction
                 })
-                total_new_records += records_added
-                print(f"Successfully processed {file.filename}: {records_added} records")
+                total_new_invoices += len(invoices)
+                total_new_line_items += line_items_added
+                print(f"Successfully processed {file.filename}: {len(invoices)} invoices, {line_items_added} line items")
             else:
                 errors.append(f"{file.filename}: No data extracted")
+                failed_files.append({"filename": file.filename, "reason": "no_data", "error": "No data extracted"})
                 # Delete the file from GridFS if no data was extracted
                 delete_file_from_gridfs(gridfs_file_id)
                 
         except Exception as e:
             error_msg = f"{file.filename}: {str(e)}"
             errors.append(error_msg)
+            # Rejected and sandbox-limited PDFs carry why they failed (see ExtractionFailed)
+            failed_files.append({"filename": file.filename, "reason": getattr(e, 'reason', 'error'), "error": str(e)})
             print(f"Error processing {file.filename}: {e}")
+            if gridfs_file_id is not None:
+                delete_file_from_gridfs(gridfs_file_id)
+        finally:
+            # Clean up temporary file
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
     
-    # Update temporary CSV and increment data version for dashboard refresh
-    if total_new_records > 0:
-        create_temp_csv_for_dashboard()
-        increment_data_version()
+    # Publish the new rows so the dashboard appends them to its cached data,
+    # dropping any earlier copy of a re-extracted invoice first
+    if inserted_rows:
+        publish_data_change(
+            inserted_records=inserted_rows,
+            deleted_invoice_ids=list({str(row["invoice_id"]) for row in inserted_rows if row.get("invoice_id")})
+        )
     
-    # Get current total records
-    total_records = collection.count_documents({})
+    # Stored totals, in the same two units as the counts above
+    totals = next(collection.aggregate([{"$group": {
+        "_id": None,
+        "invoices": {"$sum": 1},
+        "line_items": {"$sum": {"$size": LINE_ITEMS_EXPRESSION}}
+    }}]), {})
     
     return {
         "message": f"Upload completed. Processed {len(processed_files)} new/changed files",
         "processed_files": processed_files,
         "skipped_files": skipped_files,
-        "total_new_records": total_new_records,
-        "total_records": total_records,
+        "total_new_invoices": total_new_invoices,
+        "total_new_line_items": total_new_line_items,
+        "total_invoices": totals.get("invoices", 0),
+        "total_line_items": totals.get("line_items", 0),
+        "failed_files": failed_files,
         "errors": errors if errors else None
     }
 
@@ -557,7 +808,7 @@ async def health_check():
 async def refresh_dashboard():
     """Manually refresh the dashboard data"""
     try:
-        create_temp_csv_for_dashboard()
+        # Request a full reload from MongoDB on the dashboard's next poll
         increment_data_version()
         return {"message": "Dashboard data refreshed successfully"}
     except Exception as e:
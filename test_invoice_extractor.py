@@ -0,0 +1,52 @@
+# test_invoice_extractor.py
+"""Folder extraction with unreadable PDFs among valid ones (run with pytest)"""
+
+import os
+
+from invoice_extractor import InvoiceExtractor
+from invoice_generator import generate_invoices
+
+
+def write_bad_pdfs(directory):
+    """A PDF that is not a PDF at all, and an empty one"""
+    with open(os.path.join(directory, "corrupt.pdf"), "wb") as f:
+        f.write(b"%PDF-1.4\nnot really a pdf")
+    open(os.path.join(directory, "empty.pdf"), "wb").close()
+
+
+def test_iter_invoice_tables_skips_unreadable_pdfs(tmp_path):
+    paths = generate_invoices(str(tmp_path), 3, seed=1)
+    write_bad_pdfs(str(tmp_path))
+
+    results = list(InvoiceExtractor().iter_invoice_tables(str(tmp_path)))
+
+    assert sorted(pdf_path for pdf_path, _, _ in results) == sorted(paths)
+    assert all(lines for _, _, lines in results)
+
+
+def test_save_to_csv_writes_valid_invoices_around_a_corrupt_pdf(tmp_path):
+    invoices_dir = tmp_path / "invoices"
+    paths = generate_invoices(str(invoices_dir), 2, seed=2)
+    write_bad_pdfs(str(invoices_dir))
+    extractor = InvoiceExtractor()
+
+    output = str(tmp_path / "invoice_data.csv")
+    extractor.save_to_csv(extractor.iter_invoices(str(invoices_dir)), output)
+
+    with open(output) as f:
+        assert len(f.read().splitlines()) == len(paths) + 1
+
+
+def test_save_to_csv_keeps_invoices_without_an_id_apart(tmp_path):
+    rows = [
+        {'invoice_id': None, 'customer_name': 'First', 'product': 'A', 'qty': 1, 'unit_price': 2.0, 'total': 2.0},
+        {'invoice_id': None, 'customer_name': 'Second', 'product': 'B', 'qty': 1, 'unit_price': 3.0, 'total': 3.0},
+        {'invoice_id': 'INV-1', 'customer_name': 'Third', 'product': 'C', 'qty': 1, 'unit_price': 4.0, 'total': 4.0},
+        {'invoice_id': 'INV-1', 'customer_name': 'Third', 'product': 'D', 'qty': 2, 'unit_price': 1.0, 'total': 2.0},
+    ]
+
+    output = str(tmp_path / "invoice_data.csv")
+    InvoiceExtractor().save_to_csv(rows, output)
+
+    with open(output) as f:
+        assert len(f.read().splitlines()) == 4